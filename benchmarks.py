@@ -0,0 +1,613 @@
+"""
+Benchmarks of the teapot server.
+
+Every benchmark starts its own server processes configured from `.env.test`,
+for example:
+
+    python benchmarks.py batch --rounds 50
+"""
+import asyncio
+import collections
+import contextlib
+import functools
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+import timeit
+from multiprocessing.managers import BaseProxy
+
+from aiohttp import ClientSession, TCPConnector
+import click
+import dotenv
+import psutil
+
+
+dotenv.load_dotenv('.env.test', override=True)
+
+
+import server
+import statuslines
+import uvengine
+
+
+BENCHMARK_HOST = '127.0.0.1'
+BENCHMARK_PORT = 10500
+
+
+@contextlib.contextmanager
+def running_server(*args, port=BENCHMARK_PORT, env=None):
+    """
+    :param env: environment variables set for the server on top of ours
+    """
+    server_process = psutil.Popen([
+        'python',
+        'server.py',
+        f'--host={BENCHMARK_HOST}',
+        f'--port={port}',
+        *args
+    ], env=dict(os.environ, **(env or {})))
+
+    try:
+        for _ in range(100):
+            try:
+                http_request('GET', '/', port=port)
+            except ConnectionError:
+                time.sleep(0.05)
+            else:
+                break
+
+        yield server_process
+
+    finally:
+        server_processes = [server_process, *server_process.children(recursive=True)]
+
+        for process in server_processes:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                continue
+
+        psutil.wait_procs(server_processes, timeout=5)
+
+
+def http_request(method, endpoint, body=None, headers=None, port=BENCHMARK_PORT, source_ip=None):
+    """
+    Make a single request on a new connection and return ``(status, body)``.
+
+    Pots are identified by client IP, so every loopback ``source_ip``
+    (127.x.x.x) gets its own, fresh set of pots.
+    """
+    connection = http.client.HTTPConnection(
+        BENCHMARK_HOST,
+        port,
+        source_address=(source_ip, 0) if source_ip else None
+    )
+
+    try:
+        connection.request(method, endpoint, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def client_ip(group, num):
+    return f'127.{group}.{num // 250}.{num % 250 + 1}'
+
+
+def brew(endpoint, body, **kwargs):
+    return http_request('BREW', endpoint, body=body, headers={'Content-Type': server.TEA_CONTENT_TYPE}, **kwargs)
+
+
+def print_latencies(name, latencies):
+    click.echo(
+        f'{name:<24} mean {statistics.mean(latencies) * 1000:8.3f} ms   '
+        f'median {statistics.median(latencies) * 1000:8.3f} ms   '
+        f'max {max(latencies) * 1000:8.3f} ms'
+    )
+
+
+def measure_latencies(count, func, *args, **kwargs):
+    latencies = []
+
+    for _ in range(count):
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        latencies.append(time.perf_counter() - start_time)
+
+    return latencies
+
+
+def measure_throughput(method, endpoint, requests_count, concurrency, port=BENCHMARK_PORT, **kwargs):
+    """
+    Send ``requests_count`` requests over at most ``concurrency`` connections
+    at once and return requests per second.
+    """
+    url = f'http://{BENCHMARK_HOST}:{port}{endpoint}'
+
+    async def run():
+        async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+
+            async def send():
+                async with session.request(method, url, **kwargs) as response:
+                    await response.read()
+
+            await asyncio.gather(*[send() for _ in range(requests_count)])
+
+    loop = asyncio.new_event_loop()
+    start_time = time.perf_counter()
+    loop.run_until_complete(run())
+    duration = time.perf_counter() - start_time
+    loop.close()
+
+    return requests_count / duration
+
+
+def get_tree_rss(process):
+    rss = 0
+
+    for tree_process in [process, *process.children(recursive=True)]:
+        try:
+            rss += tree_process.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+
+    return rss
+
+
+class CountingProxy:
+    """
+    Wrapper of a Manager proxy counting calls made through it - each of them
+    is a round trip to the Manager process.
+    """
+
+    calls = 0
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def _call(self, method_name, *args):
+        CountingProxy.calls += 1
+
+        args = [arg._proxy if isinstance(arg, CountingProxy) else arg for arg in args]
+        result = getattr(self._proxy, method_name)(*args)
+
+        if isinstance(result, BaseProxy):
+            return CountingProxy(result)
+
+        return result
+
+    def __getattr__(self, name):
+        return functools.partial(self._call, name)
+
+    def __contains__(self, key):
+        return self._call('__contains__', key)
+
+    def __getitem__(self, key):
+        return self._call('__getitem__', key)
+
+    def __setitem__(self, key, value):
+        return self._call('__setitem__', key, value)
+
+    def __delitem__(self, key):
+        return self._call('__delitem__', key)
+
+
+@contextlib.contextmanager
+def counting_state_calls():
+    names = [
+        'mp_manager',
+        'POTS_BREWING',
+        'TRAFFIC',
+        'TRAFFIC_LOCK_INCREASE',
+        'TRAFFIC_LOCK_ADD_SECOND',
+        'TRAFFIC_LOCK_DEL_SECOND',
+    ]
+    originals = {name: getattr(server, name) for name in names}
+
+    for name, value in originals.items():
+        setattr(server, name, CountingProxy(value))
+
+    CountingProxy.calls = 0
+
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(server, name, value)
+
+
+class BenchmarkRequest:
+    """Minimal in-process stand-in for a japronto request."""
+
+    def __init__(self, remote_addr, endpoint, body):
+        self.method = 'BREW'
+        self.remote_addr = remote_addr
+        self.match_dict = {'endpoint': endpoint}
+        self.headers = {'Content-Type': server.TEA_CONTENT_TYPE}
+        self.body = body
+
+    @staticmethod
+    def Response(code, text='', headers=None):
+        return code
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--rounds', default=20, help='Number of client rounds, each using fresh pots')
+@click.option('--operations', default=server.MIN_REQUESTS_COUNT, help='Earl-grey starts sent in each round')
+def batch(rounds, operations):
+    """Batch BREW versus individual requests reaching the earl-grey traffic gate."""
+
+    batch_body = json.dumps([[server.HIGH_TRAFFIC_VARIANT, 'start']] * operations)
+
+    # State layer - Manager round trips of a single round, measured in-process
+    with counting_state_calls():
+        for _ in range(operations):
+            server.slash(BenchmarkRequest('10.0.0.1', server.HIGH_TRAFFIC_VARIANT, b'start'))
+        individual_calls = CountingProxy.calls
+
+    with counting_state_calls():
+        server.slash(BenchmarkRequest('10.0.0.2', server.BATCH_ENDPOINT, batch_body.encode()))
+        batch_calls = CountingProxy.calls
+
+    click.echo(f'State calls per round: individual {individual_calls}, batch {batch_calls}')
+
+    # Latency of whole rounds over HTTP
+    individual_latencies = []
+    batch_latencies = []
+
+    with running_server():
+        for round_num in range(rounds):
+            source_ip = client_ip(1, round_num)
+            start_time = time.perf_counter()
+            for _ in range(operations):
+                brew(f'/{server.HIGH_TRAFFIC_VARIANT}', 'start', source_ip=source_ip)
+            individual_latencies.append(time.perf_counter() - start_time)
+
+            source_ip = client_ip(2, round_num)
+            start_time = time.perf_counter()
+            brew(f'/{server.BATCH_ENDPOINT}', batch_body, source_ip=source_ip)
+            batch_latencies.append(time.perf_counter() - start_time)
+
+    print_latencies('Individual requests', individual_latencies)
+    print_latencies('Batch request', batch_latencies)
+
+
+@cli.command()
+@click.option('--engine', 'engines', multiple=True, default=server.SERVER_ENGINES,
+              type=click.Choice(server.SERVER_ENGINES))
+@click.option('--worker-num', default=server.SERVER_WORKER_NUM)
+@click.option('--requests', 'requests_count', default=10000, help='Requests sent for throughput')
+@click.option('--concurrency', default=1000, help='Connections open at once for throughput')
+@click.option('--latency-requests', default=1000, help='Sequential requests sent for latency')
+def engines(engines, worker_num, requests_count, concurrency, latency_requests):
+    """Earl-grey starts served by every engine, side by side."""
+
+    results = []
+
+    for engine in engines:
+        with running_server(f'--engine={engine}', f'--worker-num={worker_num}'):
+            latencies = measure_latencies(latency_requests, brew, f'/{server.HIGH_TRAFFIC_VARIANT}', 'start')
+            throughput = measure_throughput(
+                'BREW',
+                f'/{server.HIGH_TRAFFIC_VARIANT}',
+                requests_count,
+                concurrency,
+                data='start',
+                headers={'Content-Type': server.TEA_CONTENT_TYPE}
+            )
+
+        results.append((engine, latencies, throughput))
+
+    for engine, latencies, throughput in results:
+        print_latencies(f'{engine} latency', latencies)
+        click.echo(f'{engine + " throughput":<24} {throughput:.1f} requests per second ({worker_num} workers)')
+
+
+@cli.command()
+@click.option('--requests', 'requests_count', default=1000000, help='Requests sent in total')
+@click.option('--warmup', 'warmup_count', default=50000, help='Requests sent before the first measurement')
+@click.option('--chunk', 'chunk_count', default=100000, help='Requests sent between measurements')
+@click.option('--max-growth', default=50.0, help='Allowed RSS growth of all server processes in MB')
+@click.option('--concurrency', default=100)
+@click.option('--worker-num', default=server.SERVER_WORKER_NUM)
+def soak(requests_count, warmup_count, chunk_count, max_growth, concurrency, worker_num):
+    """Long earl-grey load failing when server memory keeps growing."""
+
+    def send(count):
+        measure_throughput(
+            'BREW',
+            f'/{server.HIGH_TRAFFIC_VARIANT}',
+            count,
+            concurrency,
+            data='start',
+            headers={'Content-Type': server.TEA_CONTENT_TYPE}
+        )
+
+    with running_server(f'--worker-num={worker_num}') as server_process:
+        send(warmup_count)
+        start_rss = get_tree_rss(server_process)
+
+        sent_count = 0
+        growth = 0.0
+        while sent_count < requests_count:
+            count = min(chunk_count, requests_count - sent_count)
+            send(count)
+            sent_count += count
+
+            growth = (get_tree_rss(server_process) - start_rss) / 1024 / 1024
+            click.echo(f'{sent_count:>10} requests   RSS growth {growth:8.1f} MB')
+
+    if growth > max_growth:
+        raise click.ClickException(f'Server memory grew by {growth:.1f} MB, more than {max_growth:.1f} MB')
+
+
+@cli.command()
+@click.option('--operations', default=20000)
+@click.option('--write-ratio', default=0.05, help='Share of operations changing pot state')
+@click.option('--pots', default=100, help='Number of distinct pots')
+def cache(operations, write_ratio, pots):
+    """Read-heavy pot state mix with and without the worker cache."""
+
+    random.seed(0)
+    pot_keys = [server.get_pot_key(client_ip(3, num), server.HIGH_TRAFFIC_VARIANT) for num in range(pots)]
+    mix = [
+        (random.choice(pot_keys), random.random() < write_ratio, random.random() < 0.5)
+        for _ in range(operations)
+    ]
+    pot_state_cache = server.pot_state_cache
+
+    for name, cache_dict in (('Without cache', None), ('With cache', {})):
+        server.pot_state_cache = cache_dict
+
+        with counting_state_calls():
+            start_time = time.perf_counter()
+            for pot_key, is_write, brewing_state in mix:
+                if is_write:
+                    server.set_pot_states({pot_key: brewing_state})
+                else:
+                    server.get_pot_state(pot_key)
+            duration = time.perf_counter() - start_time
+
+            click.echo(
+                f'{name:<24} {CountingProxy.calls:>8} state calls   '
+                f'{duration / operations * 1000000:8.1f} us per operation'
+            )
+
+    server.pot_state_cache = pot_state_cache
+
+
+@cli.command()
+@click.option('--number', default=200000, help='Responses serialized by every variant')
+def responses(number):
+    """Status line and whole response serialization of codes the server sends."""
+
+    codes = [200, 201, 202, 300, 400, 405, 424, 500, 503]
+    reasons = statuslines.REASONS
+
+    def format_status_lines():
+        for code in codes:
+            f'HTTP/1.1 {code} {reasons[code]}\r\n'.encode()
+
+    def lookup_status_lines():
+        for code in codes:
+            statuslines.STATUS_LINES[code]
+
+    code_responses = [uvengine.Response(code=code, text='Pot is busy') for code in codes]
+
+    def render_responses():
+        for response in code_responses:
+            response.render(keep_alive=True)
+
+    for name, func in (
+        ('Formatted status line', format_status_lines),
+        ('Pre-serialized line', lookup_status_lines),
+        ('Whole response', render_responses),
+    ):
+        duration = timeit.timeit(func, number=number // len(codes))
+        click.echo(f'{name:<24} {duration / number * 1000000000:8.1f} ns per response')
+
+
+async def send_pipelined(requests_count, connections_count, depth, port=BENCHMARK_PORT):
+    """
+    Send ``requests_count`` earl-grey starts over ``connections_count``
+    connections, writing ``depth`` requests before reading their responses.
+    """
+    request = (
+        f'BREW /{server.HIGH_TRAFFIC_VARIANT} HTTP/1.1\r\n'
+        f'Host: {BENCHMARK_HOST}\r\n'
+        f'Content-Type: {server.TEA_CONTENT_TYPE}\r\n'
+        f'Content-Length: 5\r\n\r\nstart'
+    ).encode()
+
+    async def send(count):
+        reader, writer = await asyncio.open_connection(BENCHMARK_HOST, port)
+
+        while count:
+            batch = min(depth, count)
+            writer.write(request * batch)
+
+            for _ in range(batch):
+                head = await reader.readuntil(b'\r\n\r\n')
+                content_length = int(head.lower().split(b'content-length: ')[1].split(b'\r\n')[0])
+                await reader.readexactly(content_length)
+
+            count -= batch
+
+        writer.close()
+
+    await asyncio.gather(*[
+        send(requests_count // connections_count + (num < requests_count % connections_count))
+        for num in range(connections_count)
+    ])
+
+
+@cli.command()
+@click.option('--requests', 'requests_count', default=20000)
+@click.option('--concurrency', default=100, help='Connections open at once')
+@click.option('--depth', default=10, help='Requests written at once by the pipelined client')
+@click.option('--worker-num', default=server.SERVER_WORKER_NUM)
+@click.option('--keep-alive-timeout', default=server.SERVER_KEEP_ALIVE_TIMEOUT)
+@click.option('--max-requests-per-connection', default=server.SERVER_MAX_REQUESTS_PER_CONNECTION)
+def connections(requests_count, concurrency, depth, worker_num, keep_alive_timeout, max_requests_per_connection):
+    """Earl-grey starts over connection per request, keep-alive and pipelined clients (uvloop engine)."""
+
+    def get_connection_stats():
+        return json.loads(http_request('GET', '/debug/connections')[1])['total']
+
+    def new_connections():
+        loop = asyncio.new_event_loop()
+
+        async def run():
+            connector = TCPConnector(limit=concurrency, force_close=True)
+            async with ClientSession(connector=connector) as session:
+
+                async def send():
+                    async with session.request(
+                        'BREW',
+                        f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}/{server.HIGH_TRAFFIC_VARIANT}',
+                        data='start',
+                        headers={'Content-Type': server.TEA_CONTENT_TYPE}
+                    ) as response:
+                        await response.read()
+
+                await asyncio.gather(*[send() for _ in range(requests_count)])
+
+        loop.run_until_complete(run())
+        loop.close()
+
+    def keep_alive():
+        measure_throughput(
+            'BREW',
+            f'/{server.HIGH_TRAFFIC_VARIANT}',
+            requests_count,
+            concurrency,
+            data='start',
+            headers={'Content-Type': server.TEA_CONTENT_TYPE}
+        )
+
+    def pipelined():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(send_pipelined(requests_count, concurrency, depth))
+        loop.close()
+
+    with running_server(
+        '--engine=uvloop',
+        f'--worker-num={worker_num}',
+        f'--keep-alive-timeout={keep_alive_timeout}',
+        f'--max-requests-per-connection={max_requests_per_connection}'
+    ):
+        for name, send in (
+            ('Connection per request', new_connections),
+            ('Keep-alive', keep_alive),
+            (f'Pipelined ({depth} deep)', pipelined),
+        ):
+            stats_before = get_connection_stats()
+            start_time = time.perf_counter()
+            send()
+            duration = time.perf_counter() - start_time
+            stats = {
+                counter: count - stats_before[counter]
+                for counter, count in get_connection_stats().items()
+            }
+
+            click.echo(
+                f'{name:<24} {requests_count / duration:10.1f} requests per second   '
+                f'opened {stats["opened"]:>6}   reused {stats["reused"]:>6}   pipelined {stats["pipelined"]:>6}'
+            )
+
+
+@cli.command('single-worker')
+@click.option('--rounds', default=2000, help='Start and stop pairs, each on a fresh pot')
+def single_worker(rounds):
+    """BREW start and stop latency of a single worker with local and Manager state."""
+
+    # Emails of completed pots are sent in the background by the digest
+    env = {'EMAIL_MODE': 'digest', 'EMAIL_DIGEST_INTERVAL': '3600', 'EMAIL_DIGEST_COUNT': str(rounds + 1)}
+    results = []
+
+    for state_backend in ('manager', 'local'):
+        with running_server('--worker-num=1', env=dict(env, STATE_BACKEND=state_backend)):
+            connection = http.client.HTTPConnection(BENCHMARK_HOST, BENCHMARK_PORT)
+            latencies = {'start': [], 'stop': []}
+
+            # The same pot of the same client is started and stopped over and over
+            for round_num in range(rounds):
+                endpoint = f'/{server.TEA_VARIANTS[0]}'
+                headers = {'Content-Type': server.TEA_CONTENT_TYPE, 'Email': f'{round_num}@example.com'}
+
+                for command, expected_status in (('start', 202), ('stop', 201)):
+                    start_time = time.perf_counter()
+                    connection.request('BREW', endpoint, body=command, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    latencies[command].append(time.perf_counter() - start_time)
+
+                    if response.status != expected_status:
+                        raise click.ClickException(f'{command} answered {response.status}, not {expected_status}')
+
+            connection.close()
+
+        results.append((state_backend, latencies))
+
+    for state_backend, latencies in results:
+        for command, command_latencies in latencies.items():
+            print_latencies(f'{state_backend} {command}', command_latencies)
+
+
+@cli.command('smtp-down')
+@click.option('--requests', 'requests_count', default=2000, help='GET requests sent while stops are sent')
+@click.option('--concurrency', default=10)
+@click.option('--connect-timeout', default=1.0, help='EMAIL_CONNECT_TIMEOUT of the server')
+def smtp_down(requests_count, concurrency, connect_timeout):
+    """Throughput of a single worker answering stops while SMTP server hangs, with and without the breaker."""
+
+    # Connections wait in the backlog of a socket which never accepts them
+    with socket.socket() as smtp_socket:
+        smtp_socket.bind((BENCHMARK_HOST, 0))
+        smtp_socket.listen(1)
+
+        env = {
+            'EMAIL_CREDS': f'user:pass:{BENCHMARK_HOST}:{smtp_socket.getsockname()[1]}',
+            'EMAIL_SECURITY': 'plain',
+            'EMAIL_CONNECT_TIMEOUT': str(connect_timeout),
+        }
+
+        for name, breaker_failures in (('Without breaker', 0), ('With breaker', server.EMAIL_BREAKER_FAILURES)):
+            with running_server('--worker-num=1', env=dict(env, EMAIL_BREAKER_FAILURES=str(breaker_failures))):
+                stop_statuses = collections.Counter()
+                is_done = threading.Event()
+
+                def send_stops():
+                    headers = {'Content-Type': server.TEA_CONTENT_TYPE, 'Email': 'candidate@example.com'}
+                    brew(f'/{server.TEA_VARIANTS[0]}', 'start')
+
+                    while not is_done.is_set():
+                        stop_statuses[http_request('BREW', f'/{server.TEA_VARIANTS[0]}', 'stop', headers)[0]] += 1
+
+                stop_thread = threading.Thread(target=send_stops)
+                stop_thread.start()
+                try:
+                    throughput = measure_throughput('GET', '/', requests_count, concurrency)
+                finally:
+                    is_done.set()
+                    stop_thread.join()
+
+            click.echo(
+                f'{name:<24} {throughput:10.1f} requests per second   '
+                f'stops {", ".join(f"{status}: {count}" for status, count in sorted(stop_statuses.items()))}'
+            )
+
+
+if __name__ == '__main__':
+    cli()
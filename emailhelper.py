@@ -16,7 +16,34 @@ import smtplib
 import sys
 
 
-class GmailSender(namedtuple('SmtpAuthData', 'server port user password')):
+class GmailSender(namedtuple('SmtpAuthData', 'server port user password security connect_timeout send_timeout')):
+    """
+    ``security`` is one of ``ssl``, ``starttls`` or ``plain`` (local relays
+    only), by default ``ssl`` for port 465 and ``starttls`` otherwise.
+
+    ``connect_timeout`` limits connecting (with the server greeting and SSL
+    handshake), ``send_timeout`` every later wait for the server, both in
+    seconds and unlimited by default.
+    """
+
+    def __new__(cls, server, port, user, password, security=None, connect_timeout=None, send_timeout=None):
+        if not security:
+            security = 'ssl' if int(port) == 465 else 'starttls'
+
+        return super().__new__(cls, server, port, user, password, security, connect_timeout, send_timeout)
+
+    def connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.security == 'ssl' else smtplib.SMTP
+
+        if self.connect_timeout is None:
+            s = smtp_class(self.server, self.port)
+        else:
+            s = smtp_class(self.server, self.port, timeout=self.connect_timeout)
+
+        if self.send_timeout is not None:
+            s.sock.settimeout(self.send_timeout)
+
+        return s
 
     def send(self, addr_from, addr_to, subject, message, files=tuple()):
         msg = MIMEMultipart('alternative')
@@ -39,19 +66,23 @@ class GmailSender(namedtuple('SmtpAuthData', 'server port user password')):
             )
             msg.attach(part)
 
-        # SSL
-        if self.port == 465:
-            s = smtplib.SMTP_SSL(self.server, self.port)
-            s.ehlo()
-        
-        # TLS
-        else:
-            s = smtplib.SMTP(self.server, self.port)
+        s = self.connect()
+
+        try:
             s.ehlo()
-            s.starttls()
 
-        s.login(self.user, self.password)
-        s.sendmail(addr_from, addr_to, msg.as_string())
+            # TLS
+            if self.security == 'starttls':
+                s.starttls()
+
+            if self.user:
+                s.login(self.user, self.password)
+            s.sendmail(addr_from, addr_to, msg.as_string())
+        except:
+            # Don't wait for a reply to QUIT of a failed connection
+            s.close()
+            raise
+
         s.quit()
 
 
@@ -1,8 +1,534 @@
+// Generated by statuslines.py - do not edit, run:
+//   python statuslines.py > japronto_diff/src/japronto/response/reasons.h
 #pragma once
 
+#include <stddef.h>
+#include <string.h>
+
+typedef struct {
+  const char* line;
+  size_t length;
+} StatusLine;
+
+#define STATUS_LINE_MIN 100
+#define STATUS_LINE_MAX 599
+
+// Whole "HTTP/1.1 <code> <reason>\r\n" of every code in the range
+static const StatusLine status_lines[] = {
+  {"HTTP/1.1 100 Continue\r\n", 23}, //100
+  {"HTTP/1.1 101 Switching Protocols\r\n", 34}, //101
+  {"HTTP/1.1 102 Processing\r\n", 25}, //102
+  {"HTTP/1.1 103 Early Hints\r\n", 26}, //103
+  {"HTTP/1.1 104 Unknown\r\n", 22}, //104
+  {"HTTP/1.1 105 Unknown\r\n", 22}, //105
+  {"HTTP/1.1 106 Unknown\r\n", 22}, //106
+  {"HTTP/1.1 107 Unknown\r\n", 22}, //107
+  {"HTTP/1.1 108 Unknown\r\n", 22}, //108
+  {"HTTP/1.1 109 Unknown\r\n", 22}, //109
+  {"HTTP/1.1 110 Unknown\r\n", 22}, //110
+  {"HTTP/1.1 111 Unknown\r\n", 22}, //111
+  {"HTTP/1.1 112 Unknown\r\n", 22}, //112
+  {"HTTP/1.1 113 Unknown\r\n", 22}, //113
+  {"HTTP/1.1 114 Unknown\r\n", 22}, //114
+  {"HTTP/1.1 115 Unknown\r\n", 22}, //115
+  {"HTTP/1.1 116 Unknown\r\n", 22}, //116
+  {"HTTP/1.1 117 Unknown\r\n", 22}, //117
+  {"HTTP/1.1 118 Unknown\r\n", 22}, //118
+  {"HTTP/1.1 119 Unknown\r\n", 22}, //119
+  {"HTTP/1.1 120 Unknown\r\n", 22}, //120
+  {"HTTP/1.1 121 Unknown\r\n", 22}, //121
+  {"HTTP/1.1 122 Unknown\r\n", 22}, //122
+  {"HTTP/1.1 123 Unknown\r\n", 22}, //123
+  {"HTTP/1.1 124 Unknown\r\n", 22}, //124
+  {"HTTP/1.1 125 Unknown\r\n", 22}, //125
+  {"HTTP/1.1 126 Unknown\r\n", 22}, //126
+  {"HTTP/1.1 127 Unknown\r\n", 22}, //127
+  {"HTTP/1.1 128 Unknown\r\n", 22}, //128
+  {"HTTP/1.1 129 Unknown\r\n", 22}, //129
+  {"HTTP/1.1 130 Unknown\r\n", 22}, //130
+  {"HTTP/1.1 131 Unknown\r\n", 22}, //131
+  {"HTTP/1.1 132 Unknown\r\n", 22}, //132
+  {"HTTP/1.1 133 Unknown\r\n", 22}, //133
+  {"HTTP/1.1 134 Unknown\r\n", 22}, //134
+  {"HTTP/1.1 135 Unknown\r\n", 22}, //135
+  {"HTTP/1.1 136 Unknown\r\n", 22}, //136
+  {"HTTP/1.1 137 Unknown\r\n", 22}, //137
+  {"HTTP/1.1 138 Unknown\r\n", 22}, //138
+  {"HTTP/1.1 139 Unknown\r\n", 22}, //139
+  {"HTTP/1.1 140 Unknown\r\n", 22}, //140
+  {"HTTP/1.1 141 Unknown\r\n", 22}, //141
+  {"HTTP/1.1 142 Unknown\r\n", 22}, //142
+  {"HTTP/1.1 143 Unknown\r\n", 22}, //143
+  {"HTTP/1.1 144 Unknown\r\n", 22}, //144
+  {"HTTP/1.1 145 Unknown\r\n", 22}, //145
+  {"HTTP/1.1 146 Unknown\r\n", 22}, //146
+  {"HTTP/1.1 147 Unknown\r\n", 22}, //147
+  {"HTTP/1.1 148 Unknown\r\n", 22}, //148
+  {"HTTP/1.1 149 Unknown\r\n", 22}, //149
+  {"HTTP/1.1 150 Unknown\r\n", 22}, //150
+  {"HTTP/1.1 151 Unknown\r\n", 22}, //151
+  {"HTTP/1.1 152 Unknown\r\n", 22}, //152
+  {"HTTP/1.1 153 Unknown\r\n", 22}, //153
+  {"HTTP/1.1 154 Unknown\r\n", 22}, //154
+  {"HTTP/1.1 155 Unknown\r\n", 22}, //155
+  {"HTTP/1.1 156 Unknown\r\n", 22}, //156
+  {"HTTP/1.1 157 Unknown\r\n", 22}, //157
+  {"HTTP/1.1 158 Unknown\r\n", 22}, //158
+  {"HTTP/1.1 159 Unknown\r\n", 22}, //159
+  {"HTTP/1.1 160 Unknown\r\n", 22}, //160
+  {"HTTP/1.1 161 Unknown\r\n", 22}, //161
+  {"HTTP/1.1 162 Unknown\r\n", 22}, //162
+  {"HTTP/1.1 163 Unknown\r\n", 22}, //163
+  {"HTTP/1.1 164 Unknown\r\n", 22}, //164
+  {"HTTP/1.1 165 Unknown\r\n", 22}, //165
+  {"HTTP/1.1 166 Unknown\r\n", 22}, //166
+  {"HTTP/1.1 167 Unknown\r\n", 22}, //167
+  {"HTTP/1.1 168 Unknown\r\n", 22}, //168
+  {"HTTP/1.1 169 Unknown\r\n", 22}, //169
+  {"HTTP/1.1 170 Unknown\r\n", 22}, //170
+  {"HTTP/1.1 171 Unknown\r\n", 22}, //171
+  {"HTTP/1.1 172 Unknown\r\n", 22}, //172
+  {"HTTP/1.1 173 Unknown\r\n", 22}, //173
+  {"HTTP/1.1 174 Unknown\r\n", 22}, //174
+  {"HTTP/1.1 175 Unknown\r\n", 22}, //175
+  {"HTTP/1.1 176 Unknown\r\n", 22}, //176
+  {"HTTP/1.1 177 Unknown\r\n", 22}, //177
+  {"HTTP/1.1 178 Unknown\r\n", 22}, //178
+  {"HTTP/1.1 179 Unknown\r\n", 22}, //179
+  {"HTTP/1.1 180 Unknown\r\n", 22}, //180
+  {"HTTP/1.1 181 Unknown\r\n", 22}, //181
+  {"HTTP/1.1 182 Unknown\r\n", 22}, //182
+  {"HTTP/1.1 183 Unknown\r\n", 22}, //183
+  {"HTTP/1.1 184 Unknown\r\n", 22}, //184
+  {"HTTP/1.1 185 Unknown\r\n", 22}, //185
+  {"HTTP/1.1 186 Unknown\r\n", 22}, //186
+  {"HTTP/1.1 187 Unknown\r\n", 22}, //187
+  {"HTTP/1.1 188 Unknown\r\n", 22}, //188
+  {"HTTP/1.1 189 Unknown\r\n", 22}, //189
+  {"HTTP/1.1 190 Unknown\r\n", 22}, //190
+  {"HTTP/1.1 191 Unknown\r\n", 22}, //191
+  {"HTTP/1.1 192 Unknown\r\n", 22}, //192
+  {"HTTP/1.1 193 Unknown\r\n", 22}, //193
+  {"HTTP/1.1 194 Unknown\r\n", 22}, //194
+  {"HTTP/1.1 195 Unknown\r\n", 22}, //195
+  {"HTTP/1.1 196 Unknown\r\n", 22}, //196
+  {"HTTP/1.1 197 Unknown\r\n", 22}, //197
+  {"HTTP/1.1 198 Unknown\r\n", 22}, //198
+  {"HTTP/1.1 199 Unknown\r\n", 22}, //199
+  {"HTTP/1.1 200 OK\r\n", 17}, //200
+  {"HTTP/1.1 201 Created\r\n", 22}, //201
+  {"HTTP/1.1 202 Accepted\r\n", 23}, //202
+  {"HTTP/1.1 203 Non-Authoritative Information\r\n", 44}, //203
+  {"HTTP/1.1 204 No Content\r\n", 25}, //204
+  {"HTTP/1.1 205 Reset Content\r\n", 28}, //205
+  {"HTTP/1.1 206 Partial Content\r\n", 30}, //206
+  {"HTTP/1.1 207 Multi-Status\r\n", 27}, //207
+  {"HTTP/1.1 208 Already Reported\r\n", 31}, //208
+  {"HTTP/1.1 209 Unknown\r\n", 22}, //209
+  {"HTTP/1.1 210 Unknown\r\n", 22}, //210
+  {"HTTP/1.1 211 Unknown\r\n", 22}, //211
+  {"HTTP/1.1 212 Unknown\r\n", 22}, //212
+  {"HTTP/1.1 213 Unknown\r\n", 22}, //213
+  {"HTTP/1.1 214 Unknown\r\n", 22}, //214
+  {"HTTP/1.1 215 Unknown\r\n", 22}, //215
+  {"HTTP/1.1 216 Unknown\r\n", 22}, //216
+  {"HTTP/1.1 217 Unknown\r\n", 22}, //217
+  {"HTTP/1.1 218 Unknown\r\n", 22}, //218
+  {"HTTP/1.1 219 Unknown\r\n", 22}, //219
+  {"HTTP/1.1 220 Unknown\r\n", 22}, //220
+  {"HTTP/1.1 221 Unknown\r\n", 22}, //221
+  {"HTTP/1.1 222 Unknown\r\n", 22}, //222
+  {"HTTP/1.1 223 Unknown\r\n", 22}, //223
+  {"HTTP/1.1 224 Unknown\r\n", 22}, //224
+  {"HTTP/1.1 225 Unknown\r\n", 22}, //225
+  {"HTTP/1.1 226 IM Used\r\n", 22}, //226
+  {"HTTP/1.1 227 Unknown\r\n", 22}, //227
+  {"HTTP/1.1 228 Unknown\r\n", 22}, //228
+  {"HTTP/1.1 229 Unknown\r\n", 22}, //229
+  {"HTTP/1.1 230 Unknown\r\n", 22}, //230
+  {"HTTP/1.1 231 Unknown\r\n", 22}, //231
+  {"HTTP/1.1 232 Unknown\r\n", 22}, //232
+  {"HTTP/1.1 233 Unknown\r\n", 22}, //233
+  {"HTTP/1.1 234 Unknown\r\n", 22}, //234
+  {"HTTP/1.1 235 Unknown\r\n", 22}, //235
+  {"HTTP/1.1 236 Unknown\r\n", 22}, //236
+  {"HTTP/1.1 237 Unknown\r\n", 22}, //237
+  {"HTTP/1.1 238 Unknown\r\n", 22}, //238
+  {"HTTP/1.1 239 Unknown\r\n", 22}, //239
+  {"HTTP/1.1 240 Unknown\r\n", 22}, //240
+  {"HTTP/1.1 241 Unknown\r\n", 22}, //241
+  {"HTTP/1.1 242 Unknown\r\n", 22}, //242
+  {"HTTP/1.1 243 Unknown\r\n", 22}, //243
+  {"HTTP/1.1 244 Unknown\r\n", 22}, //244
+  {"HTTP/1.1 245 Unknown\r\n", 22}, //245
+  {"HTTP/1.1 246 Unknown\r\n", 22}, //246
+  {"HTTP/1.1 247 Unknown\r\n", 22}, //247
+  {"HTTP/1.1 248 Unknown\r\n", 22}, //248
+  {"HTTP/1.1 249 Unknown\r\n", 22}, //249
+  {"HTTP/1.1 250 Unknown\r\n", 22}, //250
+  {"HTTP/1.1 251 Unknown\r\n", 22}, //251
+  {"HTTP/1.1 252 Unknown\r\n", 22}, //252
+  {"HTTP/1.1 253 Unknown\r\n", 22}, //253
+  {"HTTP/1.1 254 Unknown\r\n", 22}, //254
+  {"HTTP/1.1 255 Unknown\r\n", 22}, //255
+  {"HTTP/1.1 256 Unknown\r\n", 22}, //256
+  {"HTTP/1.1 257 Unknown\r\n", 22}, //257
+  {"HTTP/1.1 258 Unknown\r\n", 22}, //258
+  {"HTTP/1.1 259 Unknown\r\n", 22}, //259
+  {"HTTP/1.1 260 Unknown\r\n", 22}, //260
+  {"HTTP/1.1 261 Unknown\r\n", 22}, //261
+  {"HTTP/1.1 262 Unknown\r\n", 22}, //262
+  {"HTTP/1.1 263 Unknown\r\n", 22}, //263
+  {"HTTP/1.1 264 Unknown\r\n", 22}, //264
+  {"HTTP/1.1 265 Unknown\r\n", 22}, //265
+  {"HTTP/1.1 266 Unknown\r\n", 22}, //266
+  {"HTTP/1.1 267 Unknown\r\n", 22}, //267
+  {"HTTP/1.1 268 Unknown\r\n", 22}, //268
+  {"HTTP/1.1 269 Unknown\r\n", 22}, //269
+  {"HTTP/1.1 270 Unknown\r\n", 22}, //270
+  {"HTTP/1.1 271 Unknown\r\n", 22}, //271
+  {"HTTP/1.1 272 Unknown\r\n", 22}, //272
+  {"HTTP/1.1 273 Unknown\r\n", 22}, //273
+  {"HTTP/1.1 274 Unknown\r\n", 22}, //274
+  {"HTTP/1.1 275 Unknown\r\n", 22}, //275
+  {"HTTP/1.1 276 Unknown\r\n", 22}, //276
+  {"HTTP/1.1 277 Unknown\r\n", 22}, //277
+  {"HTTP/1.1 278 Unknown\r\n", 22}, //278
+  {"HTTP/1.1 279 Unknown\r\n", 22}, //279
+  {"HTTP/1.1 280 Unknown\r\n", 22}, //280
+  {"HTTP/1.1 281 Unknown\r\n", 22}, //281
+  {"HTTP/1.1 282 Unknown\r\n", 22}, //282
+  {"HTTP/1.1 283 Unknown\r\n", 22}, //283
+  {"HTTP/1.1 284 Unknown\r\n", 22}, //284
+  {"HTTP/1.1 285 Unknown\r\n", 22}, //285
+  {"HTTP/1.1 286 Unknown\r\n", 22}, //286
+  {"HTTP/1.1 287 Unknown\r\n", 22}, //287
+  {"HTTP/1.1 288 Unknown\r\n", 22}, //288
+  {"HTTP/1.1 289 Unknown\r\n", 22}, //289
+  {"HTTP/1.1 290 Unknown\r\n", 22}, //290
+  {"HTTP/1.1 291 Unknown\r\n", 22}, //291
+  {"HTTP/1.1 292 Unknown\r\n", 22}, //292
+  {"HTTP/1.1 293 Unknown\r\n", 22}, //293
+  {"HTTP/1.1 294 Unknown\r\n", 22}, //294
+  {"HTTP/1.1 295 Unknown\r\n", 22}, //295
+  {"HTTP/1.1 296 Unknown\r\n", 22}, //296
+  {"HTTP/1.1 297 Unknown\r\n", 22}, //297
+  {"HTTP/1.1 298 Unknown\r\n", 22}, //298
+  {"HTTP/1.1 299 Unknown\r\n", 22}, //299
+  {"HTTP/1.1 300 Multiple Choices\r\n", 31}, //300
+  {"HTTP/1.1 301 Moved Permanently\r\n", 32}, //301
+  {"HTTP/1.1 302 Found\r\n", 20}, //302
+  {"HTTP/1.1 303 See Other\r\n", 24}, //303
+  {"HTTP/1.1 304 Not Modified\r\n", 27}, //304
+  {"HTTP/1.1 305 Use Proxy\r\n", 24}, //305
+  {"HTTP/1.1 306 Unknown\r\n", 22}, //306
+  {"HTTP/1.1 307 Temporary Redirect\r\n", 33}, //307
+  {"HTTP/1.1 308 Permanent Redirect\r\n", 33}, //308
+  {"HTTP/1.1 309 Unknown\r\n", 22}, //309
+  {"HTTP/1.1 310 Unknown\r\n", 22}, //310
+  {"HTTP/1.1 311 Unknown\r\n", 22}, //311
+  {"HTTP/1.1 312 Unknown\r\n", 22}, //312
+  {"HTTP/1.1 313 Unknown\r\n", 22}, //313
+  {"HTTP/1.1 314 Unknown\r\n", 22}, //314
+  {"HTTP/1.1 315 Unknown\r\n", 22}, //315
+  {"HTTP/1.1 316 Unknown\r\n", 22}, //316
+  {"HTTP/1.1 317 Unknown\r\n", 22}, //317
+  {"HTTP/1.1 318 Unknown\r\n", 22}, //318
+  {"HTTP/1.1 319 Unknown\r\n", 22}, //319
+  {"HTTP/1.1 320 Unknown\r\n", 22}, //320
+  {"HTTP/1.1 321 Unknown\r\n", 22}, //321
+  {"HTTP/1.1 322 Unknown\r\n", 22}, //322
+  {"HTTP/1.1 323 Unknown\r\n", 22}, //323
+  {"HTTP/1.1 324 Unknown\r\n", 22}, //324
+  {"HTTP/1.1 325 Unknown\r\n", 22}, //325
+  {"HTTP/1.1 326 Unknown\r\n", 22}, //326
+  {"HTTP/1.1 327 Unknown\r\n", 22}, //327
+  {"HTTP/1.1 328 Unknown\r\n", 22}, //328
+  {"HTTP/1.1 329 Unknown\r\n", 22}, //329
+  {"HTTP/1.1 330 Unknown\r\n", 22}, //330
+  {"HTTP/1.1 331 Unknown\r\n", 22}, //331
+  {"HTTP/1.1 332 Unknown\r\n", 22}, //332
+  {"HTTP/1.1 333 Unknown\r\n", 22}, //333
+  {"HTTP/1.1 334 Unknown\r\n", 22}, //334
+  {"HTTP/1.1 335 Unknown\r\n", 22}, //335
+  {"HTTP/1.1 336 Unknown\r\n", 22}, //336
+  {"HTTP/1.1 337 Unknown\r\n", 22}, //337
+  {"HTTP/1.1 338 Unknown\r\n", 22}, //338
+  {"HTTP/1.1 339 Unknown\r\n", 22}, //339
+  {"HTTP/1.1 340 Unknown\r\n", 22}, //340
+  {"HTTP/1.1 341 Unknown\r\n", 22}, //341
+  {"HTTP/1.1 342 Unknown\r\n", 22}, //342
+  {"HTTP/1.1 343 Unknown\r\n", 22}, //343
+  {"HTTP/1.1 344 Unknown\r\n", 22}, //344
+  {"HTTP/1.1 345 Unknown\r\n", 22}, //345
+  {"HTTP/1.1 346 Unknown\r\n", 22}, //346
+  {"HTTP/1.1 347 Unknown\r\n", 22}, //347
+  {"HTTP/1.1 348 Unknown\r\n", 22}, //348
+  {"HTTP/1.1 349 Unknown\r\n", 22}, //349
+  {"HTTP/1.1 350 Unknown\r\n", 22}, //350
+  {"HTTP/1.1 351 Unknown\r\n", 22}, //351
+  {"HTTP/1.1 352 Unknown\r\n", 22}, //352
+  {"HTTP/1.1 353 Unknown\r\n", 22}, //353
+  {"HTTP/1.1 354 Unknown\r\n", 22}, //354
+  {"HTTP/1.1 355 Unknown\r\n", 22}, //355
+  {"HTTP/1.1 356 Unknown\r\n", 22}, //356
+  {"HTTP/1.1 357 Unknown\r\n", 22}, //357
+  {"HTTP/1.1 358 Unknown\r\n", 22}, //358
+  {"HTTP/1.1 359 Unknown\r\n", 22}, //359
+  {"HTTP/1.1 360 Unknown\r\n", 22}, //360
+  {"HTTP/1.1 361 Unknown\r\n", 22}, //361
+  {"HTTP/1.1 362 Unknown\r\n", 22}, //362
+  {"HTTP/1.1 363 Unknown\r\n", 22}, //363
+  {"HTTP/1.1 364 Unknown\r\n", 22}, //364
+  {"HTTP/1.1 365 Unknown\r\n", 22}, //365
+  {"HTTP/1.1 366 Unknown\r\n", 22}, //366
+  {"HTTP/1.1 367 Unknown\r\n", 22}, //367
+  {"HTTP/1.1 368 Unknown\r\n", 22}, //368
+  {"HTTP/1.1 369 Unknown\r\n", 22}, //369
+  {"HTTP/1.1 370 Unknown\r\n", 22}, //370
+  {"HTTP/1.1 371 Unknown\r\n", 22}, //371
+  {"HTTP/1.1 372 Unknown\r\n", 22}, //372
+  {"HTTP/1.1 373 Unknown\r\n", 22}, //373
+  {"HTTP/1.1 374 Unknown\r\n", 22}, //374
+  {"HTTP/1.1 375 Unknown\r\n", 22}, //375
+  {"HTTP/1.1 376 Unknown\r\n", 22}, //376
+  {"HTTP/1.1 377 Unknown\r\n", 22}, //377
+  {"HTTP/1.1 378 Unknown\r\n", 22}, //378
+  {"HTTP/1.1 379 Unknown\r\n", 22}, //379
+  {"HTTP/1.1 380 Unknown\r\n", 22}, //380
+  {"HTTP/1.1 381 Unknown\r\n", 22}, //381
+  {"HTTP/1.1 382 Unknown\r\n", 22}, //382
+  {"HTTP/1.1 383 Unknown\r\n", 22}, //383
+  {"HTTP/1.1 384 Unknown\r\n", 22}, //384
+  {"HTTP/1.1 385 Unknown\r\n", 22}, //385
+  {"HTTP/1.1 386 Unknown\r\n", 22}, //386
+  {"HTTP/1.1 387 Unknown\r\n", 22}, //387
+  {"HTTP/1.1 388 Unknown\r\n", 22}, //388
+  {"HTTP/1.1 389 Unknown\r\n", 22}, //389
+  {"HTTP/1.1 390 Unknown\r\n", 22}, //390
+  {"HTTP/1.1 391 Unknown\r\n", 22}, //391
+  {"HTTP/1.1 392 Unknown\r\n", 22}, //392
+  {"HTTP/1.1 393 Unknown\r\n", 22}, //393
+  {"HTTP/1.1 394 Unknown\r\n", 22}, //394
+  {"HTTP/1.1 395 Unknown\r\n", 22}, //395
+  {"HTTP/1.1 396 Unknown\r\n", 22}, //396
+  {"HTTP/1.1 397 Unknown\r\n", 22}, //397
+  {"HTTP/1.1 398 Unknown\r\n", 22}, //398
+  {"HTTP/1.1 399 Unknown\r\n", 22}, //399
+  {"HTTP/1.1 400 Bad Request\r\n", 26}, //400
+  {"HTTP/1.1 401 Unauthorized\r\n", 27}, //401
+  {"HTTP/1.1 402 Payment Required\r\n", 31}, //402
+  {"HTTP/1.1 403 Forbidden\r\n", 24}, //403
+  {"HTTP/1.1 404 Not Found\r\n", 24}, //404
+  {"HTTP/1.1 405 Method Not Allowed\r\n", 33}, //405
+  {"HTTP/1.1 406 Not Acceptable\r\n", 29}, //406
+  {"HTTP/1.1 407 Proxy Authentication Required\r\n", 44}, //407
+  {"HTTP/1.1 408 Request Timeout\r\n", 30}, //408
+  {"HTTP/1.1 409 Conflict\r\n", 23}, //409
+  {"HTTP/1.1 410 Gone\r\n", 19}, //410
+  {"HTTP/1.1 411 Length Required\r\n", 30}, //411
+  {"HTTP/1.1 412 Precondition Failed\r\n", 34}, //412
+  {"HTTP/1.1 413 Payload Too Large\r\n", 32}, //413
+  {"HTTP/1.1 414 URI Too Long\r\n", 27}, //414
+  {"HTTP/1.1 415 Unsupported Media Type\r\n", 37}, //415
+  {"HTTP/1.1 416 Range Not Satisfiable\r\n", 36}, //416
+  {"HTTP/1.1 417 Expectation Failed\r\n", 33}, //417
+  {"HTTP/1.1 418 I'm a teapot\r\n", 27}, //418
+  {"HTTP/1.1 419 Unknown\r\n", 22}, //419
+  {"HTTP/1.1 420 Unknown\r\n", 22}, //420
+  {"HTTP/1.1 421 Misdirected Request\r\n", 34}, //421
+  {"HTTP/1.1 422 Unprocessable Entity\r\n", 35}, //422
+  {"HTTP/1.1 423 Locked\r\n", 21}, //423
+  {"HTTP/1.1 424 Failed Dependency\r\n", 32}, //424
+  {"HTTP/1.1 425 Too Early\r\n", 24}, //425
+  {"HTTP/1.1 426 Upgrade Required\r\n", 31}, //426
+  {"HTTP/1.1 427 Unknown\r\n", 22}, //427
+  {"HTTP/1.1 428 Precondition Required\r\n", 36}, //428
+  {"HTTP/1.1 429 Too Many Requests\r\n", 32}, //429
+  {"HTTP/1.1 430 Unknown\r\n", 22}, //430
+  {"HTTP/1.1 431 Request Header Fields Too Large\r\n", 46}, //431
+  {"HTTP/1.1 432 Unknown\r\n", 22}, //432
+  {"HTTP/1.1 433 Unknown\r\n", 22}, //433
+  {"HTTP/1.1 434 Unknown\r\n", 22}, //434
+  {"HTTP/1.1 435 Unknown\r\n", 22}, //435
+  {"HTTP/1.1 436 Unknown\r\n", 22}, //436
+  {"HTTP/1.1 437 Unknown\r\n", 22}, //437
+  {"HTTP/1.1 438 Unknown\r\n", 22}, //438
+  {"HTTP/1.1 439 Unknown\r\n", 22}, //439
+  {"HTTP/1.1 440 Unknown\r\n", 22}, //440
+  {"HTTP/1.1 441 Unknown\r\n", 22}, //441
+  {"HTTP/1.1 442 Unknown\r\n", 22}, //442
+  {"HTTP/1.1 443 Unknown\r\n", 22}, //443
+  {"HTTP/1.1 444 Unknown\r\n", 22}, //444
+  {"HTTP/1.1 445 Unknown\r\n", 22}, //445
+  {"HTTP/1.1 446 Unknown\r\n", 22}, //446
+  {"HTTP/1.1 447 Unknown\r\n", 22}, //447
+  {"HTTP/1.1 448 Unknown\r\n", 22}, //448
+  {"HTTP/1.1 449 Unknown\r\n", 22}, //449
+  {"HTTP/1.1 450 Unknown\r\n", 22}, //450
+  {"HTTP/1.1 451 Unavailable For Legal Reasons\r\n", 44}, //451
+  {"HTTP/1.1 452 Unknown\r\n", 22}, //452
+  {"HTTP/1.1 453 Unknown\r\n", 22}, //453
+  {"HTTP/1.1 454 Unknown\r\n", 22}, //454
+  {"HTTP/1.1 455 Unknown\r\n", 22}, //455
+  {"HTTP/1.1 456 Unknown\r\n", 22}, //456
+  {"HTTP/1.1 457 Unknown\r\n", 22}, //457
+  {"HTTP/1.1 458 Unknown\r\n", 22}, //458
+  {"HTTP/1.1 459 Unknown\r\n", 22}, //459
+  {"HTTP/1.1 460 Unknown\r\n", 22}, //460
+  {"HTTP/1.1 461 Unknown\r\n", 22}, //461
+  {"HTTP/1.1 462 Unknown\r\n", 22}, //462
+  {"HTTP/1.1 463 Unknown\r\n", 22}, //463
+  {"HTTP/1.1 464 Unknown\r\n", 22}, //464
+  {"HTTP/1.1 465 Unknown\r\n", 22}, //465
+  {"HTTP/1.1 466 Unknown\r\n", 22}, //466
+  {"HTTP/1.1 467 Unknown\r\n", 22}, //467
+  {"HTTP/1.1 468 Unknown\r\n", 22}, //468
+  {"HTTP/1.1 469 Unknown\r\n", 22}, //469
+  {"HTTP/1.1 470 Unknown\r\n", 22}, //470
+  {"HTTP/1.1 471 Unknown\r\n", 22}, //471
+  {"HTTP/1.1 472 Unknown\r\n", 22}, //472
+  {"HTTP/1.1 473 Unknown\r\n", 22}, //473
+  {"HTTP/1.1 474 Unknown\r\n", 22}, //474
+  {"HTTP/1.1 475 Unknown\r\n", 22}, //475
+  {"HTTP/1.1 476 Unknown\r\n", 22}, //476
+  {"HTTP/1.1 477 Unknown\r\n", 22}, //477
+  {"HTTP/1.1 478 Unknown\r\n", 22}, //478
+  {"HTTP/1.1 479 Unknown\r\n", 22}, //479
+  {"HTTP/1.1 480 Unknown\r\n", 22}, //480
+  {"HTTP/1.1 481 Unknown\r\n", 22}, //481
+  {"HTTP/1.1 482 Unknown\r\n", 22}, //482
+  {"HTTP/1.1 483 Unknown\r\n", 22}, //483
+  {"HTTP/1.1 484 Unknown\r\n", 22}, //484
+  {"HTTP/1.1 485 Unknown\r\n", 22}, //485
+  {"HTTP/1.1 486 Unknown\r\n", 22}, //486
+  {"HTTP/1.1 487 Unknown\r\n", 22}, //487
+  {"HTTP/1.1 488 Unknown\r\n", 22}, //488
+  {"HTTP/1.1 489 Unknown\r\n", 22}, //489
+  {"HTTP/1.1 490 Unknown\r\n", 22}, //490
+  {"HTTP/1.1 491 Unknown\r\n", 22}, //491
+  {"HTTP/1.1 492 Unknown\r\n", 22}, //492
+  {"HTTP/1.1 493 Unknown\r\n", 22}, //493
+  {"HTTP/1.1 494 Unknown\r\n", 22}, //494
+  {"HTTP/1.1 495 Unknown\r\n", 22}, //495
+  {"HTTP/1.1 496 Unknown\r\n", 22}, //496
+  {"HTTP/1.1 497 Unknown\r\n", 22}, //497
+  {"HTTP/1.1 498 Unknown\r\n", 22}, //498
+  {"HTTP/1.1 499 Unknown\r\n", 22}, //499
+  {"HTTP/1.1 500 Internal Server Error\r\n", 36}, //500
+  {"HTTP/1.1 501 Not Implemented\r\n", 30}, //501
+  {"HTTP/1.1 502 Bad Gateway\r\n", 26}, //502
+  {"HTTP/1.1 503 Service Unavailable\r\n", 34}, //503
+  {"HTTP/1.1 504 Gateway Timeout\r\n", 30}, //504
+  {"HTTP/1.1 505 HTTP Version Not Supported\r\n", 41}, //505
+  {"HTTP/1.1 506 Variant Also Negotiates\r\n", 38}, //506
+  {"HTTP/1.1 507 Insufficient Storage\r\n", 35}, //507
+  {"HTTP/1.1 508 Loop Detected\r\n", 28}, //508
+  {"HTTP/1.1 509 Unknown\r\n", 22}, //509
+  {"HTTP/1.1 510 Not Extended\r\n", 27}, //510
+  {"HTTP/1.1 511 Network Authentication Required\r\n", 46}, //511
+  {"HTTP/1.1 512 Unknown\r\n", 22}, //512
+  {"HTTP/1.1 513 Unknown\r\n", 22}, //513
+  {"HTTP/1.1 514 Unknown\r\n", 22}, //514
+  {"HTTP/1.1 515 Unknown\r\n", 22}, //515
+  {"HTTP/1.1 516 Unknown\r\n", 22}, //516
+  {"HTTP/1.1 517 Unknown\r\n", 22}, //517
+  {"HTTP/1.1 518 Unknown\r\n", 22}, //518
+  {"HTTP/1.1 519 Unknown\r\n", 22}, //519
+  {"HTTP/1.1 520 Unknown\r\n", 22}, //520
+  {"HTTP/1.1 521 Unknown\r\n", 22}, //521
+  {"HTTP/1.1 522 Unknown\r\n", 22}, //522
+  {"HTTP/1.1 523 Unknown\r\n", 22}, //523
+  {"HTTP/1.1 524 Unknown\r\n", 22}, //524
+  {"HTTP/1.1 525 Unknown\r\n", 22}, //525
+  {"HTTP/1.1 526 Unknown\r\n", 22}, //526
+  {"HTTP/1.1 527 Unknown\r\n", 22}, //527
+  {"HTTP/1.1 528 Unknown\r\n", 22}, //528
+  {"HTTP/1.1 529 Unknown\r\n", 22}, //529
+  {"HTTP/1.1 530 Unknown\r\n", 22}, //530
+  {"HTTP/1.1 531 Unknown\r\n", 22}, //531
+  {"HTTP/1.1 532 Unknown\r\n", 22}, //532
+  {"HTTP/1.1 533 Unknown\r\n", 22}, //533
+  {"HTTP/1.1 534 Unknown\r\n", 22}, //534
+  {"HTTP/1.1 535 Unknown\r\n", 22}, //535
+  {"HTTP/1.1 536 Unknown\r\n", 22}, //536
+  {"HTTP/1.1 537 Unknown\r\n", 22}, //537
+  {"HTTP/1.1 538 Unknown\r\n", 22}, //538
+  {"HTTP/1.1 539 Unknown\r\n", 22}, //539
+  {"HTTP/1.1 540 Unknown\r\n", 22}, //540
+  {"HTTP/1.1 541 Unknown\r\n", 22}, //541
+  {"HTTP/1.1 542 Unknown\r\n", 22}, //542
+  {"HTTP/1.1 543 Unknown\r\n", 22}, //543
+  {"HTTP/1.1 544 Unknown\r\n", 22}, //544
+  {"HTTP/1.1 545 Unknown\r\n", 22}, //545
+  {"HTTP/1.1 546 Unknown\r\n", 22}, //546
+  {"HTTP/1.1 547 Unknown\r\n", 22}, //547
+  {"HTTP/1.1 548 Unknown\r\n", 22}, //548
+  {"HTTP/1.1 549 Unknown\r\n", 22}, //549
+  {"HTTP/1.1 550 Unknown\r\n", 22}, //550
+  {"HTTP/1.1 551 Unknown\r\n", 22}, //551
+  {"HTTP/1.1 552 Unknown\r\n", 22}, //552
+  {"HTTP/1.1 553 Unknown\r\n", 22}, //553
+  {"HTTP/1.1 554 Unknown\r\n", 22}, //554
+  {"HTTP/1.1 555 Unknown\r\n", 22}, //555
+  {"HTTP/1.1 556 Unknown\r\n", 22}, //556
+  {"HTTP/1.1 557 Unknown\r\n", 22}, //557
+  {"HTTP/1.1 558 Unknown\r\n", 22}, //558
+  {"HTTP/1.1 559 Unknown\r\n", 22}, //559
+  {"HTTP/1.1 560 Unknown\r\n", 22}, //560
+  {"HTTP/1.1 561 Unknown\r\n", 22}, //561
+  {"HTTP/1.1 562 Unknown\r\n", 22}, //562
+  {"HTTP/1.1 563 Unknown\r\n", 22}, //563
+  {"HTTP/1.1 564 Unknown\r\n", 22}, //564
+  {"HTTP/1.1 565 Unknown\r\n", 22}, //565
+  {"HTTP/1.1 566 Unknown\r\n", 22}, //566
+  {"HTTP/1.1 567 Unknown\r\n", 22}, //567
+  {"HTTP/1.1 568 Unknown\r\n", 22}, //568
+  {"HTTP/1.1 569 Unknown\r\n", 22}, //569
+  {"HTTP/1.1 570 Unknown\r\n", 22}, //570
+  {"HTTP/1.1 571 Unknown\r\n", 22}, //571
+  {"HTTP/1.1 572 Unknown\r\n", 22}, //572
+  {"HTTP/1.1 573 Unknown\r\n", 22}, //573
+  {"HTTP/1.1 574 Unknown\r\n", 22}, //574
+  {"HTTP/1.1 575 Unknown\r\n", 22}, //575
+  {"HTTP/1.1 576 Unknown\r\n", 22}, //576
+  {"HTTP/1.1 577 Unknown\r\n", 22}, //577
+  {"HTTP/1.1 578 Unknown\r\n", 22}, //578
+  {"HTTP/1.1 579 Unknown\r\n", 22}, //579
+  {"HTTP/1.1 580 Unknown\r\n", 22}, //580
+  {"HTTP/1.1 581 Unknown\r\n", 22}, //581
+  {"HTTP/1.1 582 Unknown\r\n", 22}, //582
+  {"HTTP/1.1 583 Unknown\r\n", 22}, //583
+  {"HTTP/1.1 584 Unknown\r\n", 22}, //584
+  {"HTTP/1.1 585 Unknown\r\n", 22}, //585
+  {"HTTP/1.1 586 Unknown\r\n", 22}, //586
+  {"HTTP/1.1 587 Unknown\r\n", 22}, //587
+  {"HTTP/1.1 588 Unknown\r\n", 22}, //588
+  {"HTTP/1.1 589 Unknown\r\n", 22}, //589
+  {"HTTP/1.1 590 Unknown\r\n", 22}, //590
+  {"HTTP/1.1 591 Unknown\r\n", 22}, //591
+  {"HTTP/1.1 592 Unknown\r\n", 22}, //592
+  {"HTTP/1.1 593 Unknown\r\n", 22}, //593
+  {"HTTP/1.1 594 Unknown\r\n", 22}, //594
+  {"HTTP/1.1 595 Unknown\r\n", 22}, //595
+  {"HTTP/1.1 596 Unknown\r\n", 22}, //596
+  {"HTTP/1.1 597 Unknown\r\n", 22}, //597
+  {"HTTP/1.1 598 Unknown\r\n", 22}, //598
+  {"HTTP/1.1 599 Unknown\r\n", 22}, //599
+};
+
+// Copies status line of a code between STATUS_LINE_MIN and STATUS_LINE_MAX
+static inline size_t write_status_line(char* buffer, int code) {
+  const StatusLine* status_line = &status_lines[code - STATUS_LINE_MIN];
+  memcpy(buffer, status_line->line, status_line->length);
+  return status_line->length;
+}
+
 static const char* reasons_1xx[] = {
   "Continue", //100
   "Switching Protocols", //101
+  "Processing", //102
+  "Early Hints", //103
 };
 
 static const char* reasons_2xx[] = {
@@ -10,20 +536,41 @@ static const char* reasons_2xx[] = {
   "Created", //201
   "Accepted", //202
   "Non-Authoritative Information", //203
-  "No Content", // 204
+  "No Content", //204
   "Reset Content", //205
   "Partial Content", //206
+  "Multi-Status", //207
+  "Already Reported", //208
+  "Unknown", //209
+  "Unknown", //210
+  "Unknown", //211
+  "Unknown", //212
+  "Unknown", //213
+  "Unknown", //214
+  "Unknown", //215
+  "Unknown", //216
+  "Unknown", //217
+  "Unknown", //218
+  "Unknown", //219
+  "Unknown", //220
+  "Unknown", //221
+  "Unknown", //222
+  "Unknown", //223
+  "Unknown", //224
+  "Unknown", //225
+  "IM Used", //226
 };
 
 static const char* reasons_3xx[] = {
   "Multiple Choices", //300
   "Moved Permanently", //301
   "Found", //302
-  "See Other", //303,
+  "See Other", //303
   "Not Modified", //304
-  "Use Proxy",  //305
-  "Proxy Switch", //306
+  "Use Proxy", //305
+  "Unknown", //306
   "Temporary Redirect", //307
+  "Permanent Redirect", //308
 };
 
 static const char* reasons_4xx[] = {
@@ -33,29 +580,52 @@ static const char* reasons_4xx[] = {
   "Forbidden", //403
   "Not Found", //404
   "Method Not Allowed", //405
-  "Not acceptable", //406
+  "Not Acceptable", //406
   "Proxy Authentication Required", //407
   "Request Timeout", //408
   "Conflict", //409
   "Gone", //410
   "Length Required", //411
   "Precondition Failed", //412
-  "Request Entity Too Large", //413
-  "Request-URI Too Long", //414
+  "Payload Too Large", //413
+  "URI Too Long", //414
   "Unsupported Media Type", //415
-  "Requested Range Not Satisfiable", //416
+  "Range Not Satisfiable", //416
   "Expectation Failed", //417
   "I'm a teapot", //418
-  "HTTP_STATUS_MESSAGE_419", //419
-  "Enhance Your Calm", //420
+  "Unknown", //419
+  "Unknown", //420
   "Misdirected Request", //421
   "Unprocessable Entity", //422
   "Locked", //423
   "Failed Dependency", //424
   "Too Early", //425
   "Upgrade Required", //426
-  "HTTP_STATUS_MESSAGE_427", //427
+  "Unknown", //427
   "Precondition Required", //428
+  "Too Many Requests", //429
+  "Unknown", //430
+  "Request Header Fields Too Large", //431
+  "Unknown", //432
+  "Unknown", //433
+  "Unknown", //434
+  "Unknown", //435
+  "Unknown", //436
+  "Unknown", //437
+  "Unknown", //438
+  "Unknown", //439
+  "Unknown", //440
+  "Unknown", //441
+  "Unknown", //442
+  "Unknown", //443
+  "Unknown", //444
+  "Unknown", //445
+  "Unknown", //446
+  "Unknown", //447
+  "Unknown", //448
+  "Unknown", //449
+  "Unknown", //450
+  "Unavailable For Legal Reasons", //451
 };
 
 static const char* reasons_5xx[] = {
@@ -65,6 +635,12 @@ static const char* reasons_5xx[] = {
   "Service Unavailable", //503
   "Gateway Timeout", //504
   "HTTP Version Not Supported", //505
+  "Variant Also Negotiates", //506
+  "Insufficient Storage", //507
+  "Loop Detected", //508
+  "Unknown", //509
+  "Not Extended", //510
+  "Network Authentication Required", //511
 };
 
 typedef struct {
@@ -73,9 +649,9 @@ typedef struct {
 } ReasonRange;
 
 static const ReasonRange reason_ranges[] = {
-  {reasons_1xx, 1},
-  {reasons_2xx, 6},
-  {reasons_3xx, 7},
-  {reasons_4xx, 28},
-  {reasons_5xx, 5}
+  {reasons_1xx, 3},
+  {reasons_2xx, 26},
+  {reasons_3xx, 8},
+  {reasons_4xx, 51},
+  {reasons_5xx, 11},
 };
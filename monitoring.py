@@ -0,0 +1,120 @@
+"""
+Cheap, per-worker measurements used by the health and debug endpoints.
+"""
+import asyncio
+import collections
+import time
+import tracemalloc
+
+import psutil
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a timer scheduled every ``interval``
+    seconds. It costs one timer callback per interval, so probes only read
+    the last measurement.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lag = 0.0
+        self._loop = None
+        self._expected_time = None
+
+    @property
+    def is_running(self):
+        return self._loop is not None
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._schedule()
+
+    def _schedule(self):
+        self._expected_time = self._loop.time() + self.interval
+        self._loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        self.lag = max(0.0, self._loop.time() - self._expected_time)
+        self._schedule()
+
+    def current_lag(self):
+        if not self.is_running:
+            return 0.0
+
+        # Timer which is already overdue means the loop is lagging right now
+        return max(self.lag, self._loop.time() - self._expected_time)
+
+
+class MemoryDiagnostics:
+    """
+    Takes a tracemalloc snapshot of the worker every ``interval`` seconds and
+    keeps the last ``snapshots_kept`` of them, so allocations may be compared
+    over the whole kept period. Taking a snapshot blocks the event loop, keep
+    it disabled unless debugging memory.
+    """
+
+    def __init__(self, interval, snapshots_kept, frames=1):
+        self.interval = interval
+        self.frames = frames
+        self.snapshots = collections.deque(maxlen=snapshots_kept)
+        self._loop = None
+
+    @property
+    def is_running(self):
+        return self._loop is not None
+
+    def start(self, loop=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._run()
+
+    def _run(self):
+        self.take_snapshot()
+        self._loop.call_later(self.interval, self._run)
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        self.snapshots.append((time.time(), snapshot))
+
+    def top_diff(self, limit):
+        """
+        Allocations which grew the most between the oldest and the newest snapshot.
+        """
+        (first_time, first_snapshot), (last_time, last_snapshot) = self.snapshots[0], self.snapshots[-1]
+
+        return {
+            'from_time': first_time,
+            'to_time': last_time,
+            'top': [
+                {
+                    'location': str(stat.traceback),
+                    'size': stat.size,
+                    'size_diff': stat.size_diff,
+                    'count': stat.count,
+                    'count_diff': stat.count_diff,
+                }
+                for stat in last_snapshot.compare_to(first_snapshot, 'lineno')[:limit]
+            ],
+        }
+
+
+def get_rss_by_process(manager_pid):
+    """
+    RSS in bytes of this worker's master, the Manager process and every worker.
+    """
+    master = psutil.Process().parent()
+
+    return {
+        'master': master.memory_info().rss,
+        'manager': psutil.Process(manager_pid).memory_info().rss,
+        'workers': {
+            worker.pid: worker.memory_info().rss
+            for worker in master.children()
+            if worker.pid != manager_pid
+        },
+    }
@@ -0,0 +1,224 @@
+"""
+Sending of notification emails - circuit breaker around the email client and
+coalescing of emails into periodic digests.
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+import traceback
+
+
+BREAKER_STATES = ('closed', 'open', 'half_open')
+BREAKER_COUNTERS = ('successes', 'failures', 'rejected', 'opened', 'probes')
+
+# Values of the shared array of a breaker
+BREAKER_VALUES = ('state', 'consecutive_failures', *BREAKER_COUNTERS)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Circuit is open, next attempt in {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Breaker of calls to a failing service, shared by all workers (it must be
+    created before they are forked).
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    calls fail with ``CircuitOpenError`` right away. Every ``reset_timeout``
+    seconds while open, a single call is let through as a probe (half-open) -
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._values = multiprocessing.RawArray('q', len(BREAKER_VALUES))
+        self._opened_at = multiprocessing.RawValue('d', 0)
+        self._lock = multiprocessing.Lock()
+
+    def _get(self, name):
+        return self._values[BREAKER_VALUES.index(name)]
+
+    def _set(self, name, value):
+        self._values[BREAKER_VALUES.index(name)] = value
+
+    def _add(self, name):
+        self._set(name, self._get(name) + 1)
+
+    @property
+    def state(self):
+        return BREAKER_STATES[self._get('state')]
+
+    def _get_retry_after(self):
+        return max(self._opened_at.value + self.reset_timeout - time.monotonic(), 0.0)
+
+    def _start_call(self):
+        """
+        Whether the call is a probe, or CircuitOpenError when it isn't allowed.
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return False
+
+            # A probe which never finished (its worker was killed) is replaced too
+            retry_after = self._get_retry_after()
+            if not retry_after:
+                self._set('state', BREAKER_STATES.index('half_open'))
+                self._opened_at.value = time.monotonic()
+                self._add('probes')
+                return True
+
+            self._add('rejected')
+
+        raise CircuitOpenError(retry_after)
+
+    def _finish_call(self, is_success, is_probe):
+        with self._lock:
+            if is_success:
+                self._add('successes')
+                self._set('consecutive_failures', 0)
+                self._set('state', BREAKER_STATES.index('closed'))
+                return
+
+            self._add('failures')
+            self._add('consecutive_failures')
+
+            if is_probe or (self.state == 'closed' and self._get('consecutive_failures') >= self.failure_threshold):
+                self._set('state', BREAKER_STATES.index('open'))
+                self._opened_at.value = time.monotonic()
+                self._add('opened')
+
+    def call(self, func, *args, **kwargs):
+        is_probe = self._start_call()
+
+        try:
+            result = func(*args, **kwargs)
+        except:
+            self._finish_call(False, is_probe)
+            raise
+
+        self._finish_call(True, is_probe)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {name: self._get(name) for name in BREAKER_VALUES}
+            snapshot['state'] = self.state
+            snapshot['retry_after'] = self._get_retry_after() if self.state != 'closed' else 0.0
+
+        return snapshot
+
+
+class CircuitBreakerSender:
+    """
+    Email client sending through a ``CircuitBreaker``.
+    """
+
+    def __init__(self, email_client, breaker):
+        self.email_client = email_client
+        self.breaker = breaker
+
+    def send(self, *args, **kwargs):
+        return self.breaker.call(self.email_client.send, *args, **kwargs)
+
+
+class DigestSender:
+    """
+    Collects rows and sends all of them in a single email once ``max_count``
+    rows are waiting or ``interval`` seconds have passed.
+
+    Rows are kept by each worker process separately. They are sent from a
+    background thread started in the process on its first row and flushed
+    when the process exits. Rows of a failed send are kept for the next one.
+    """
+
+    def __init__(self, email_client, addr_from, addr_to, format_digest, interval, max_count):
+        """
+        :param format_digest: function making ``(subject, message)`` from a list of rows
+        """
+        self.email_client = email_client
+        self.addr_from = addr_from
+        self.addr_to = addr_to
+        self.format_digest = format_digest
+        self.interval = interval
+        self.max_count = max_count
+
+        self.rows_retrying = 0
+        self._rows = []
+        self._rows_sending = 0
+        self._pid = None
+
+    def __len__(self):
+        """
+        Rows waiting to be sent, including the ones of a send in progress.
+        """
+        return len(self._rows) + self._rows_sending
+
+    def _start(self):
+        # Neither threads nor exit finalizers survive fork - start them in every worker
+        self._pid = os.getpid()
+        self._rows = []
+        self._rows_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        threading.Thread(target=self._run, daemon=True).start()
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def add(self, row):
+        if self._pid != os.getpid():
+            self._start()
+
+        with self._rows_lock:
+            self._rows.append(row)
+            is_full = len(self._rows) >= self.max_count
+
+        if is_full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            except:
+                print(traceback.format_exc())
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+
+        with self._send_lock:
+            with self._rows_lock:
+                rows, self._rows = self._rows, []
+                self._rows_sending = len(rows)
+
+            if not rows:
+                return
+
+            subject, message = self.format_digest(rows)
+
+            try:
+                self.email_client.send(
+                    addr_from=self.addr_from,
+                    addr_to=self.addr_to,
+                    subject=subject,
+                    message=message
+                )
+            except:
+                with self._rows_lock:
+                    self._rows[:0] = rows
+                    self._rows_sending = 0
+                    self.rows_retrying = len(self._rows)
+                raise
+
+            self._rows_sending = 0
+            self.rows_retrying = 0
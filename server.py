@@ -1,43 +1,161 @@
 # Based on https://tools.ietf.org/html/rfc7168
 import os
+import signal
 import time
+import collections
+import json
+import html
+import math
+import zlib
 import multiprocessing
+import multiprocessing.util
 import traceback
 
-from japronto import Application
 import click
+import psutil
 
 import emailhelper
+import monitoring
+import notifications
+import statestore
+import traffichistory
 
 __version__ = '19.8.10'  # Year / Month / Day
 
 
 # Configuration (load .env file if variables aren't present)
-for _ in range(2):
-    try:
-        MIN_REQUESTS_COUNT = int(os.environ['MIN_REQUESTS_COUNT'])
-        SERVER_HOST = os.environ['SERVER_HOST']
-        SERVER_PORT = os.environ['SERVER_PORT']
-        SERVER_WORKER_NUM = int(os.environ['SERVER_WORKER_NUM'])
-        SMTP_USER, SMTP_PASS, SMTP_SERVER, SMTP_PORT = os.environ['EMAIL_CREDS'].split(':')
-        SMTP_PORT = int(SMTP_PORT)
-        EMAIL_RECEIVER = [e for e in os.environ['EMAIL_RECEIVER'].split(';') if e]
-    except KeyError:
-        import dotenv
-        dotenv.load_dotenv('.env', override=True)
-    else:
-        break
+SERVER_ENV_FILE = os.environ.get('SERVER_ENV_FILE', '.env')
+SERVER_PID_FILE = os.environ.get('SERVER_PID_FILE')
 
 
+def read_config():
+    """
+    Settings which may be changed without restart (see ``reload_config``).
+    """
+    smtp_user, smtp_pass, smtp_server, smtp_port = os.environ['EMAIL_CREDS'].split(':')
+
+    return {
+        'MIN_REQUESTS_COUNT': int(os.environ['MIN_REQUESTS_COUNT']),
+        'SERVER_HOST': os.environ['SERVER_HOST'],
+        'SERVER_PORT': os.environ['SERVER_PORT'],
+        'SERVER_WORKER_NUM': int(os.environ['SERVER_WORKER_NUM']),
+        'SMTP_USER': smtp_user,
+        'SMTP_PASS': smtp_pass,
+        'SMTP_SERVER': smtp_server,
+        'SMTP_PORT': int(smtp_port),
+        'EMAIL_RECEIVER': [e for e in os.environ['EMAIL_RECEIVER'].split(';') if e],
+        'TEA_VARIANTS': [v for v in os.environ.get('TEA_VARIANTS', 'english-breakfast;earl-grey').split(';') if v],
+
+        # Email - `urgent` sends every completion right away, `digest` sends a summary
+        # of completions every EMAIL_DIGEST_INTERVAL seconds or EMAIL_DIGEST_COUNT completions
+        'SMTP_SECURITY': os.environ.get('EMAIL_SECURITY'),
+        'SMTP_CONNECT_TIMEOUT': float(os.environ.get('EMAIL_CONNECT_TIMEOUT', 5)),
+        'SMTP_SEND_TIMEOUT': float(os.environ.get('EMAIL_SEND_TIMEOUT', 10)),
+        'EMAIL_MODE': os.environ.get('EMAIL_MODE', 'urgent'),
+        'EMAIL_DIGEST_INTERVAL': float(os.environ.get('EMAIL_DIGEST_INTERVAL', 60)),
+        'EMAIL_DIGEST_COUNT': int(os.environ.get('EMAIL_DIGEST_COUNT', 50)),
+    }
+
+
+def load_config(config=None):
+    """
+    :param config: settings returned by ``read_config``, read now (loading SERVER_ENV_FILE if needed) when not given
+    """
+    global MIN_REQUESTS_COUNT, SERVER_HOST, SERVER_PORT, SERVER_WORKER_NUM, EMAIL_RECEIVER, TEA_VARIANTS
+    global SMTP_USER, SMTP_PASS, SMTP_SERVER, SMTP_PORT, SMTP_SECURITY, SMTP_CONNECT_TIMEOUT, SMTP_SEND_TIMEOUT
+    global EMAIL_MODE, EMAIL_DIGEST_INTERVAL, EMAIL_DIGEST_COUNT
+
+    if config is None:
+        try:
+            config = read_config()
+        except KeyError:
+            import dotenv
+            dotenv.load_dotenv(SERVER_ENV_FILE, override=True)
+            config = read_config()
+
+    # Settings are read all at once, so an invalid file changes none of them
+    MIN_REQUESTS_COUNT = config['MIN_REQUESTS_COUNT']
+    SERVER_HOST = config['SERVER_HOST']
+    SERVER_PORT = config['SERVER_PORT']
+    SERVER_WORKER_NUM = config['SERVER_WORKER_NUM']
+    SMTP_USER = config['SMTP_USER']
+    SMTP_PASS = config['SMTP_PASS']
+    SMTP_SERVER = config['SMTP_SERVER']
+    SMTP_PORT = config['SMTP_PORT']
+    EMAIL_RECEIVER = config['EMAIL_RECEIVER']
+    TEA_VARIANTS = config['TEA_VARIANTS']
+    SMTP_SECURITY = config['SMTP_SECURITY']
+    SMTP_CONNECT_TIMEOUT = config['SMTP_CONNECT_TIMEOUT']
+    SMTP_SEND_TIMEOUT = config['SMTP_SEND_TIMEOUT']
+    EMAIL_MODE = config['EMAIL_MODE']
+    EMAIL_DIGEST_INTERVAL = config['EMAIL_DIGEST_INTERVAL']
+    EMAIL_DIGEST_COUNT = config['EMAIL_DIGEST_COUNT']
+
+
+load_config()
+
+# Server engine - `japronto` or `uvloop` (asyncio + uvloop + httptools)
+SERVER_ENGINES = ('japronto', 'uvloop')
+SERVER_ENGINE = os.environ.get('SERVER_ENGINE', 'japronto')
+
+# Connection handling of the uvloop engine (limits are per worker, 0 disables them)
+SERVER_KEEP_ALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEP_ALIVE_TIMEOUT', 15))
+SERVER_MAX_REQUESTS_PER_CONNECTION = int(os.environ.get('SERVER_MAX_REQUESTS_PER_CONNECTION', 0))
+SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', 1024))
+SERVER_MAX_CONNECTIONS = int(os.environ.get('SERVER_MAX_CONNECTIONS', 0))
+SERVER_REQUEST_TIMEOUT = float(os.environ.get('SERVER_REQUEST_TIMEOUT', 10))
+SERVER_MAX_BODY_SIZE = int(os.environ.get('SERVER_MAX_BODY_SIZE', 1024 * 1024))
+
+# Memory diagnostics (`/debug/memory`) - off unless MEMORY_DIAGNOSTICS=1
+MEMORY_DIAGNOSTICS = os.environ.get('MEMORY_DIAGNOSTICS', '') == '1'
+MEMORY_SNAPSHOT_INTERVAL = float(os.environ.get('MEMORY_SNAPSHOT_INTERVAL', 60))
+MEMORY_SNAPSHOTS_KEPT = int(os.environ.get('MEMORY_SNAPSHOTS_KEPT', 10))
+MEMORY_TOP_N = int(os.environ.get('MEMORY_TOP_N', 20))
+
+# Worker-local cache of pot states, invalidated by shared per-shard generations
+# (POT_STATE_CACHE_SIZE=0 disables it)
+POT_STATE_CACHE_SIZE = int(os.environ.get('POT_STATE_CACHE_SIZE', 10000))
+POT_STATE_SHARDS = int(os.environ.get('POT_STATE_SHARDS', 1024))
+
+# State backend - `manager` (dicts of the Manager process), `shm` (hash tables in shared memory,
+# which `python server.py inspect` reads), tables are files STATE_SHM_PATH-<master PID>-*, or `local`
+# (dicts of the only worker). `auto` is `local` with a single worker and `manager` otherwise
+STATE_BACKENDS = ('manager', 'shm', 'local')
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'auto')
+STATE_SHM_PATH = os.environ.get('STATE_SHM_PATH', '/dev/shm/teapot-server')
+STATE_POTS_SIZE = int(os.environ.get('STATE_POTS_SIZE', 65536))
+STATE_TRAFFIC_SIZE = int(os.environ.get('STATE_TRAFFIC_SIZE', 16384))
+
+# Traffic history (`/debug/traffic`) - request counts kept for capacity planning
+TRAFFIC_HISTORY_SECONDS = int(os.environ.get('TRAFFIC_HISTORY_SECONDS', 3600))
+TRAFFIC_HISTORY_MINUTES = int(os.environ.get('TRAFFIC_HISTORY_MINUTES', 1440))
+TRAFFIC_HISTORY_MAX_CLIENT_COUNT = int(os.environ.get('TRAFFIC_HISTORY_MAX_CLIENT_COUNT', 2 * MIN_REQUESTS_COUNT))
+
+# Circuit breaker of emails - opens after EMAIL_BREAKER_FAILURES consecutive failed sends (0 disables it),
+# then `stop` fails at once, except for a probe let through every EMAIL_BREAKER_RESET_TIMEOUT seconds
+EMAIL_BREAKER_FAILURES = int(os.environ.get('EMAIL_BREAKER_FAILURES', 5))
+EMAIL_BREAKER_RESET_TIMEOUT = float(os.environ.get('EMAIL_BREAKER_RESET_TIMEOUT', 30))
+
+# Readiness thresholds (seconds for lag, ping and email send time, count for emails waiting in a digest)
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.25))
+READY_MAX_LOOP_LAG = float(os.environ.get('READY_MAX_LOOP_LAG', 0.5))
+READY_MAX_STATE_PING = float(os.environ.get('READY_MAX_STATE_PING', 0.1))
+READY_MAX_OUTSTANDING_EMAILS = int(os.environ.get('READY_MAX_OUTSTANDING_EMAILS', 10))
+READY_MAX_EMAIL_SEND_TIME = float(os.environ.get('READY_MAX_EMAIL_SEND_TIME', 5))
+# Seconds after a slow send during which the worker stays unready (it gets no stops to send faster while unready)
+READY_EMAIL_SEND_WINDOW = float(os.environ.get('READY_EMAIL_SEND_WINDOW', 30))
+
 TEA_CONTENT_TYPE = 'message/teapot'
-TEA_VARIANTS = [
-    'english-breakfast',
-    'earl-grey',
-]
 HIGH_TRAFFIC_VARIANT = 'earl-grey'
 
-with open('home.html') as home_html_file:
-    HOME_HTML_CONTENT = home_html_file.read()
+# Batch BREW (`BREW /batch`) - body is a JSON list of [endpoint, command] pairs
+BATCH_ENDPOINT = 'batch'
+BATCH_MAX_OPERATIONS = 100
+
+
+def read_home_html():
+    with open('home.html') as home_html_file:
+        return home_html_file.read()
 
 
 def create_alternates():
@@ -47,40 +165,133 @@ def create_alternates():
     )
 
 
+def create_email_client():
+    email_client = emailhelper.GmailSender(
+        SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_SECURITY, SMTP_CONNECT_TIMEOUT, SMTP_SEND_TIMEOUT
+    )
+
+    if email_breaker is None:
+        return email_client
+
+    return notifications.CircuitBreakerSender(email_client, email_breaker)
+
+
+HOME_HTML_CONTENT = read_home_html()
 TEA_ALTERNATES = create_alternates()
 
-email_client = emailhelper.GmailSender(SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS)
+# Shared by workers and kept by reloads
+if EMAIL_BREAKER_FAILURES:
+    email_breaker = notifications.CircuitBreaker(EMAIL_BREAKER_FAILURES, EMAIL_BREAKER_RESET_TIMEOUT)
+else:
+    email_breaker = None
+
+email_client = create_email_client()
 
 # Runtime variables
 mp_manager = multiprocessing.Manager()
 
 POTS_BREWING = mp_manager.dict()
+POTS_GENERATIONS = multiprocessing.Array('Q', POT_STATE_SHARDS)
 
 TRAFFIC = mp_manager.dict()
 TRAFFIC_LOCK_INCREASE = mp_manager.Lock()
 TRAFFIC_LOCK_ADD_SECOND = mp_manager.Lock()
 TRAFFIC_LOCK_DEL_SECOND = mp_manager.Lock()
 
+MANAGER_PID = mp_manager._process.pid
+
+# Created by `cli` for the `shm` and `local` backends, so other commands don't create tables
+state_store = None
+
+traffic_history = traffichistory.TrafficHistory(
+    TEA_VARIANTS,
+    seconds_kept=TRAFFIC_HISTORY_SECONDS,
+    minutes_kept=TRAFFIC_HISTORY_MINUTES,
+    max_client_count=TRAFFIC_HISTORY_MAX_CLIENT_COUNT
+)
+
+# Per worker
+loop_lag_monitor = monitoring.LoopLagMonitor(LOOP_LAG_INTERVAL)
+last_email_send_time = 0.0
+last_email_send_finished = 0.0
+pot_state_cache = {} if POT_STATE_CACHE_SIZE else None
+
+if MEMORY_DIAGNOSTICS:
+    memory_diagnostics = monitoring.MemoryDiagnostics(MEMORY_SNAPSHOT_INTERVAL, MEMORY_SNAPSHOTS_KEPT)
+else:
+    memory_diagnostics = None
+
+# Set by `create_app` for engines counting connections
+connection_stats = None
+
+
+def get_pot_key(remote_addr, endpoint):
+    return f'{remote_addr}/{endpoint}'
+
 
 def get_request_key(request):
     endpoint = request.match_dict.get('endpoint', '')
-    return f'{request.remote_addr}/{endpoint}'
+    return get_pot_key(request.remote_addr, endpoint)
+
+
+def get_pot_shard(pot_key):
+    return zlib.crc32(pot_key.encode()) % POT_STATE_SHARDS
+
+
+def get_pot_state(pot_key):
+    """
+    Read pot state through the worker cache. Generation of the key's shard is
+    read before the value, so a value cached while a write is in progress is
+    dropped on the next read. Shared memory backend is read directly.
+    """
+    if state_store is not None:
+        return state_store.get_pot_state(pot_key)
+
+    if pot_state_cache is None:
+        return POTS_BREWING.get(pot_key, False)
+
+    generation = POTS_GENERATIONS.get_obj()[get_pot_shard(pot_key)]
+    cached = pot_state_cache.get(pot_key)
+
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    brewing_state = POTS_BREWING.get(pot_key, False)
+
+    if len(pot_state_cache) >= POT_STATE_CACHE_SIZE:
+        pot_state_cache.clear()
+    pot_state_cache[pot_key] = (generation, brewing_state)
+
+    return brewing_state
+
+
+def set_pot_states(brewing_states):
+    if state_store is not None:
+        state_store.set_pot_states(brewing_states)
+        return
+
+    POTS_BREWING.update(brewing_states)
+
+    with POTS_GENERATIONS.get_lock():
+        generations = POTS_GENERATIONS.get_obj()
+        for shard in {get_pot_shard(pot_key) for pot_key in brewing_states}:
+            generations[shard] += 1
 
 
 def set_brewing_state(request, brewing_state):
-    POTS_BREWING[get_request_key(request)] = brewing_state
+    set_pot_states({get_request_key(request): brewing_state})
 
 
 def get_brewing_state(request):
-    return POTS_BREWING.get(get_request_key(request), False)
+    return get_pot_state(get_request_key(request))
 
 
-def increase_or_set(lock, dict_obj, key, default):
+def increase_or_set(lock, dict_obj, key, default, step=1):
     lock.acquire()
 
     if key in dict_obj:
         value = dict_obj[key]
-        value += 1
+        value += step
     else:
         value = default
 
@@ -89,9 +300,17 @@ def increase_or_set(lock, dict_obj, key, default):
     return value
 
 
-def increase_traffic_by_request(request):
-    cur_second_int = int(time.time())
-    request_key = get_request_key(request)
+def increase_traffic_by_request(request, hits=1):
+    return increase_traffic(get_request_key(request), hits)
+
+
+def increase_traffic(request_key, hits=1, now=None):
+    cur_second_int = int(time.time() if now is None else now)
+
+    if state_store is not None:
+        request_traffic = state_store.increase_traffic(request_key, cur_second_int, hits)
+        traffic_history.add_client_count(request_traffic - hits, request_traffic)
+        return request_traffic
 
     # Clear old seconds (only if it's not already being cleared)
     if TRAFFIC_LOCK_DEL_SECOND.acquire():
@@ -102,27 +321,426 @@ def increase_traffic_by_request(request):
         TRAFFIC_LOCK_DEL_SECOND.release()
 
     TRAFFIC_LOCK_ADD_SECOND.acquire()
-    # First time handling current second
-    if cur_second_int not in TRAFFIC:
+    # Another time handling current second (fetched at once, it may be cleared meanwhile)
+    cur_second_counter = TRAFFIC.get(cur_second_int)
+    # First time handling current second - unless a newer second already cleared it
+    if cur_second_counter is None and not any(second > cur_second_int for second in TRAFFIC.keys()):
         cur_second_counter = mp_manager.dict()
         TRAFFIC[cur_second_int] = cur_second_counter
-    # Another time handling current second
-    else:
-        cur_second_counter = TRAFFIC[cur_second_int]
 
     TRAFFIC_LOCK_ADD_SECOND.release()
 
-    request_traffic = increase_or_set(TRAFFIC_LOCK_INCREASE, cur_second_counter, request_key, 1)
+    # Late request of an expired second is counted on its own
+    if cur_second_counter is None:
+        request_traffic = hits
+    else:
+        request_traffic = increase_or_set(TRAFFIC_LOCK_INCREASE, cur_second_counter, request_key, hits, hits)
+    traffic_history.add_client_count(request_traffic - hits, request_traffic)
 
     # print(f'Increasing {request_key!r} from value {request_traffic} (second {cur_second_int})')
 
     return request_traffic
 
 
+def format_completion_digest(completions):
+    rows = ''.join(
+        f'<tr><td>{time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(completion_time))}</td>'
+        f'<td>{html.escape(client_email)}</td><td>{html.escape(endpoint)}</td>'
+        f'<td>{html.escape(remote_addr)}</td><td>{html.escape(host)}</td></tr>'
+        for completion_time, client_email, endpoint, remote_addr, host in completions
+    )
+
+    return (
+        f'{len(completions)} candidates have completed recruitment task v{__version__}',
+        f'<table><tr><th>Time (UTC)</th><th>Email</th><th>Tea</th><th>IP</th><th>Host</th></tr>{rows}</table>'
+    )
+
+
+def create_email_digest():
+    if EMAIL_MODE != 'digest':
+        return None
+
+    return notifications.DigestSender(
+        email_client,
+        addr_from=SMTP_USER,
+        addr_to=EMAIL_RECEIVER,
+        format_digest=format_completion_digest,
+        interval=EMAIL_DIGEST_INTERVAL,
+        max_count=EMAIL_DIGEST_COUNT
+    )
+
+
+email_digest = create_email_digest()
+
+
+def reload_config():
+    """
+    Re-read SERVER_ENV_FILE (overriding environment) and home.html, and
+    rebuild everything computed from them. It runs in the master process, so
+    only workers started afterwards use the new settings, while state kept by
+    the Manager process and in shared memory stays. Settings outside of
+    ``read_config`` need a restart.
+    """
+    global HOME_HTML_CONTENT, TEA_ALTERNATES, email_client, email_digest
+
+    if isinstance(state_store, statestore.LocalStateStore):
+        raise RuntimeError('State of the only worker would be lost by a new worker, restart the server instead')
+
+    import dotenv
+    dotenv.load_dotenv(SERVER_ENV_FILE, override=True)
+
+    # Both files are read before anything is assigned, so when either is invalid nothing changes
+    config = read_config()
+    home_html_content = read_home_html()
+
+    load_config(config)
+
+    HOME_HTML_CONTENT = home_html_content
+    TEA_ALTERNATES = create_alternates()
+    email_client = create_email_client()
+    email_digest = create_email_digest()
+
+
+def get_emails_outstanding():
+    """
+    Completions waiting in the digest of this worker, failed ones included.
+    Urgent emails are sent while the request waits, so none are outstanding.
+    """
+    if email_digest is None:
+        return 0
+
+    return len(email_digest)
+
+
+def send_completion_email(request, endpoint, client_email):
+    global last_email_send_time, last_email_send_finished
+
+    if email_digest is not None:
+        email_digest.add(
+            (time.time(), client_email, endpoint, request.remote_addr, request.headers.get('Host', 'Unknown'))
+        )
+        return
+
+    start_time = time.perf_counter()
+    try:
+        email_client.send(
+            addr_from=SMTP_USER,
+            addr_to=EMAIL_RECEIVER,
+            subject=f'Someone has completed recruitment task v{__version__} - {client_email}',
+            message=f'Candidate has successfully brewed tea {endpoint!r} from IP {request.remote_addr}, '
+                    f'using mail {client_email!r} and host {request.headers.get("Host", "Unknown")!r}.'
+        )
+    finally:
+        last_email_send_time = time.perf_counter() - start_time
+        last_email_send_finished = time.monotonic()
+
+
+def is_batch_operation(operation):
+    return (
+        isinstance(operation, list) and
+        len(operation) == 2 and
+        all(isinstance(item, str) for item in operation)
+    )
+
+
+def brew_batch(request):
+    """
+    Apply many pot commands of a single client at once.
+
+    Body is a JSON list of ``[endpoint, command]`` pairs, for example
+    ``[["earl-grey", "start"], ["english-breakfast", "stop"]]``. Operations are
+    applied in order, as if they were sent one after another, and the response
+    is a JSON list with status code and text of every operation.
+
+    Each pot state is read once and all changes are written back with a single
+    update. Every ``start`` of the high traffic pot which reaches the traffic
+    gate (the pot isn't busy) counts as one hit, so a batch with N of them is
+    worth N individual requests made in the same second.
+    """
+    if request.headers.get('Content-Type', '') != TEA_CONTENT_TYPE:
+        return request.Response(
+            code=400,
+            headers={'Alternates': TEA_ALTERNATES}
+        )
+
+    try:
+        operations = json.loads(request.body)
+    except (TypeError, ValueError):
+        operations = None
+
+    if not (
+        isinstance(operations, list) and
+        0 < len(operations) <= BATCH_MAX_OPERATIONS and
+        all(is_batch_operation(operation) for operation in operations)
+    ):
+        return request.Response(
+            code=400,
+            text=f'Body must be a JSON list of up to {BATCH_MAX_OPERATIONS} [endpoint, command] pairs'
+        )
+
+    pot_keys = {
+        endpoint: get_pot_key(request.remote_addr, endpoint)
+        for endpoint, _ in operations
+        if endpoint in TEA_VARIANTS
+    }
+    for endpoint, requests_count in collections.Counter(endpoint for endpoint, _ in operations).items():
+        if endpoint in TEA_VARIANTS:
+            traffic_history.add_requests(endpoint, requests_count)
+
+    brewing = {endpoint: get_pot_state(pot_key) for endpoint, pot_key in pot_keys.items()}
+    brewing_changes = {}
+
+    # All starts of the high traffic pot are counted at once, the ones which find it busy are taken back below
+    traffic_hits = operations.count([HIGH_TRAFFIC_VARIANT, 'start']) if HIGH_TRAFFIC_VARIANT in pot_keys else 0
+    gate_hits = 0
+    if traffic_hits:
+        traffic_time = time.time()
+        # Traffic before the batch, increased again by every start reaching the gate below
+        traffic = increase_traffic(pot_keys[HIGH_TRAFFIC_VARIANT], traffic_hits, traffic_time) - traffic_hits
+
+    client_email = request.headers.get('Email', '')
+    results = []
+
+    for endpoint, command in operations:
+        text = ''
+
+        if endpoint not in TEA_VARIANTS:
+            code, text = 503, f'"{endpoint}" is not supported for this pot'
+
+        elif command == 'start':
+            if endpoint == HIGH_TRAFFIC_VARIANT and not brewing[endpoint]:
+                traffic += 1
+                gate_hits += 1
+
+            if brewing[endpoint]:
+                code, text = 503, 'Pot is busy'
+            elif endpoint == HIGH_TRAFFIC_VARIANT and traffic < MIN_REQUESTS_COUNT:
+                code, text = 424, f'Traffic too low to brew "{endpoint}" tea: {traffic}/{MIN_REQUESTS_COUNT}'
+            else:
+                brewing[endpoint] = brewing_changes[pot_keys[endpoint]] = True
+                code, text = 202, 'Brewing'
+
+        elif command == 'stop':
+            if not brewing[endpoint]:
+                code, text = 400, 'No beverage is being brewed by this pot'
+            elif not client_email:
+                code, text = 400, 'Please set "Email" header in your request to your email address'
+            else:
+                try:
+                    send_completion_email(request, endpoint, client_email)
+                except notifications.CircuitOpenError:
+                    code, text = 503, 'Emails can\'t be sent now, please try again later'
+                except:
+                    print(traceback.format_exc())
+                    code, text = 500, 'Something went wrong'
+                else:
+                    brewing[endpoint] = brewing_changes[pot_keys[endpoint]] = False
+                    code, text = 201, 'Finished'
+
+        else:
+            code = 400
+
+        results.append({'endpoint': endpoint, 'command': command, 'code': code, 'text': text})
+
+    if brewing_changes:
+        set_pot_states(brewing_changes)
+
+    # Hits of a second which has passed don't count for the gate anymore
+    if gate_hits < traffic_hits and int(time.time()) == int(traffic_time):
+        increase_traffic(pot_keys[HIGH_TRAFFIC_VARIANT], gate_hits - traffic_hits, traffic_time)
+
+    return request.Response(
+        code=200,
+        text=json.dumps(results),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def ensure_worker_monitors():
+    if not loop_lag_monitor.is_running:
+        loop_lag_monitor.start()
+
+        if memory_diagnostics is not None:
+            memory_diagnostics.start()
+
+
+def ping_state_backend():
+    start_time = time.perf_counter()
+
+    if state_store is not None:
+        state_store.ping()
+    else:
+        len(POTS_BREWING)
+
+    return time.perf_counter() - start_time
+
+
+def healthz(request):
+    """
+    Liveness probe - answering at all means the worker's event loop runs.
+    """
+    ensure_worker_monitors()
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    return request.Response(
+        code=200,
+        text='OK'
+    )
+
+
+def readyz(request):
+    """
+    Readiness probe - fails when event loop lag, state backend ping time,
+    completions waiting in the email digest or time of the last urgent email
+    send of this worker is over its threshold.
+    """
+    ensure_worker_monitors()
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    failures = []
+
+    loop_lag = loop_lag_monitor.current_lag()
+    if loop_lag > READY_MAX_LOOP_LAG:
+        failures.append('loop_lag')
+
+    try:
+        state_ping = ping_state_backend()
+    except:
+        print(traceback.format_exc())
+        state_ping = None
+        failures.append('state_ping')
+    else:
+        if state_ping > READY_MAX_STATE_PING:
+            failures.append('state_ping')
+
+    outstanding_emails = get_emails_outstanding()
+    if outstanding_emails > READY_MAX_OUTSTANDING_EMAILS:
+        failures.append('emails_outstanding')
+
+    if (
+        last_email_send_time > READY_MAX_EMAIL_SEND_TIME and
+        time.monotonic() - last_email_send_finished < READY_EMAIL_SEND_WINDOW
+    ):
+        failures.append('email_send_time')
+
+    return request.Response(
+        code=503 if failures else 200,
+        text=json.dumps({
+            'ready': not failures,
+            'failures': failures,
+            'loop_lag': loop_lag,
+            'state_ping': state_ping,
+            'emails_outstanding': outstanding_emails,
+            'email_send_time': last_email_send_time,
+        }),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def debug_memory(request):
+    """
+    RSS of all server processes and top allocation growth of this worker
+    between its oldest and newest kept tracemalloc snapshot.
+    """
+    ensure_worker_monitors()
+
+    if memory_diagnostics is None:
+        return request.Response(code=404)
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    return request.Response(
+        code=200,
+        text=json.dumps({
+            'rss': monitoring.get_rss_by_process(MANAGER_PID),
+            'allocations': memory_diagnostics.top_diff(MEMORY_TOP_N),
+        }),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def debug_connections(request):
+    """
+    Connection counters of all workers (uvloop engine only).
+    """
+    ensure_worker_monitors()
+
+    if connection_stats is None:
+        return request.Response(code=404)
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    return request.Response(
+        code=200,
+        text=json.dumps(connection_stats.snapshot()),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def debug_email(request):
+    """
+    State and counters of the email circuit breaker, shared by all workers.
+    """
+    ensure_worker_monitors()
+
+    if email_breaker is None:
+        return request.Response(code=404)
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    return request.Response(
+        code=200,
+        text=json.dumps(email_breaker.snapshot()),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def debug_traffic(request):
+    """
+    Traffic history as JSON, or one of its tables as CSV when queried with
+    ``?format=csv&table=seconds|minutes|client_counts``.
+    """
+    ensure_worker_monitors()
+
+    if request.method != 'GET':
+        return request.Response(code=405)
+
+    snapshot = traffic_history.snapshot()
+
+    if request.query.get('format') == 'csv':
+        table = request.query.get('table', 'seconds')
+
+        if table not in traffichistory.TRAFFIC_HISTORY_TABLES:
+            return request.Response(
+                code=400,
+                text=f'Table must be one of: {", ".join(traffichistory.TRAFFIC_HISTORY_TABLES)}'
+            )
+
+        return request.Response(
+            code=200,
+            text=traffichistory.snapshot_to_csv(snapshot, table),
+            headers={'Content-Type': 'text/csv'}
+        )
+
+    return request.Response(
+        code=200,
+        text=json.dumps(snapshot),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
 def slash(request):
     """
     :type request:
     """
+    ensure_worker_monitors()
 
     endpoint = request.match_dict.get('endpoint', '')
 
@@ -141,8 +759,12 @@ def slash(request):
                 headers={'Alternates': TEA_ALTERNATES}
             )
 
+        elif endpoint == BATCH_ENDPOINT:
+            return brew_batch(request)
+
         # Some pot
         elif endpoint in TEA_VARIANTS:
+            traffic_history.add_requests(endpoint)
 
             # Wrong Content-Type
             if request.headers.get('Content-Type', '') != TEA_CONTENT_TYPE:
@@ -168,8 +790,6 @@ def slash(request):
                     traffic = increase_traffic_by_request(request)
 
                     if traffic < MIN_REQUESTS_COUNT:
-                        # FIXME: uvloop is unable to return status code 424
-                        #        see https://github.com/squeaky-pl/japronto/issues/131
                         return request.Response(
                             code=424,
                             text=f'Traffic too low to brew "{endpoint}" tea: {traffic}/{MIN_REQUESTS_COUNT}'
@@ -201,12 +821,12 @@ def slash(request):
                     )
 
                 try:
-                    email_client.send(
-                        addr_from=SMTP_USER,
-                        addr_to=EMAIL_RECEIVER,
-                        subject=f'Someone has completed recruitment task v{__version__} - {client_email}',
-                        message=f'Candidate has successfully brewed tea {endpoint!r} from IP {request.remote_addr}, '
-                                f'using mail {client_email!r} and host {request.headers.get("Host", "Unknown")!r}.'
+                    send_completion_email(request, endpoint, client_email)
+                except notifications.CircuitOpenError as e:
+                    return request.Response(
+                        code=503,
+                        text='Emails can\'t be sent now, please try again later',
+                        headers={'Retry-After': str(math.ceil(e.retry_after))}
                     )
                 except:
                     print(traceback.format_exc())
@@ -238,25 +858,152 @@ def slash(request):
         return request.Response(code=405)
 
 
-app = Application()
-r = app.router
+def pot_route(request):
+    """
+    ``slash`` answering 503 instead of 500 when shared memory state has no
+    slot left for a pot or traffic key (or one is stuck by a dead writer).
+    """
+    try:
+        return slash(request)
+    except (statestore.TableFull, statestore.SlotBusy):
+        print(traceback.format_exc())
+        return request.Response(
+            code=503,
+            text='Too many pots are in use, please try again later'
+        )
+
+
+def create_app(engine, connection_options=None):
+    """
+    :param connection_options: keyword arguments of uvloop engine Application
+    """
+    global connection_stats
+
+    if engine == 'japronto':
+        from japronto import Application
+        app = Application()
+    else:
+        from uvengine import Application
+        app = Application(**(connection_options or {}))
+        app.reload_hooks.append(reload_config)
+        connection_stats = app.connection_stats
+
+    r = app.router
+
+    r.add_route('/healthz', healthz)
+    r.add_route('/readyz', readyz)
+    r.add_route('/debug/memory', debug_memory)
+    r.add_route('/debug/connections', debug_connections)
+    r.add_route('/debug/email', debug_email)
+    r.add_route('/debug/traffic', debug_traffic)
+    r.add_route('/', pot_route)
+    r.add_route('/{endpoint}', pot_route)
+
+    return app
+
+
+def get_state_backend(worker_num):
+    if STATE_BACKEND == 'auto':
+        return 'local' if (worker_num or 1) == 1 else 'manager'
+
+    return STATE_BACKEND
+
+
+def read_pid_file(pid_file):
+    """
+    PID and engine of the master process, as written by ``cli``.
+    """
+    with open(pid_file) as pid_file_obj:
+        pid, engine = pid_file_obj.read().split()
+
+    return int(pid), engine
+
+
+def remove_pid_file(pid_file, pid):
+    """
+    Remove the PID file of an exiting master, unless another one wrote it since.
+    """
+    try:
+        if read_pid_file(pid_file)[0] == pid:
+            os.unlink(pid_file)
+    except (FileNotFoundError, ValueError):
+        pass
+
+
+def is_server_process(pid):
+    try:
+        cmdline = psutil.Process(pid).cmdline()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+
+    return any(os.path.basename(arg) == 'server.py' for arg in cmdline)
+
+
+def get_master_pid(pid_file, pid):
+    if pid is None:
+        if not pid_file:
+            raise click.UsageError('Either --pid or --pid-file is required')
 
-r.add_route('/', slash)
-r.add_route('/{endpoint}', slash)
+        pid, _ = read_pid_file(pid_file)
 
+    return pid
 
-@click.command()
+
+@click.group(invoke_without_command=True)
 @click.option('--host', default=SERVER_HOST)
 @click.option('--port', default=SERVER_PORT)
 @click.option('--worker-num', default=SERVER_WORKER_NUM)
 @click.option('--debug', default=False, is_flag=True)
-def cli(host, port, worker_num, debug):
+@click.option('--engine', default=SERVER_ENGINE, type=click.Choice(SERVER_ENGINES))
+@click.option('--pid-file', default=SERVER_PID_FILE, help='File to write PID of the master process to')
+@click.option('--keep-alive-timeout', default=SERVER_KEEP_ALIVE_TIMEOUT, help='Seconds an idle connection is kept (uvloop)')
+@click.option('--max-requests-per-connection', default=SERVER_MAX_REQUESTS_PER_CONNECTION,
+              help='Requests served on a connection before closing it (uvloop)')
+@click.option('--backlog', default=SERVER_BACKLOG, help='Listen backlog of every worker socket (uvloop)')
+@click.option('--max-connections', default=SERVER_MAX_CONNECTIONS, help='Connections open at once per worker (uvloop)')
+@click.option('--request-timeout', default=SERVER_REQUEST_TIMEOUT,
+              help='Seconds a client has to send a whole request (uvloop)')
+@click.option('--max-body-size', default=SERVER_MAX_BODY_SIZE, help='Largest request body in bytes (uvloop)')
+@click.pass_context
+def cli(ctx, host, port, worker_num, debug, engine, pid_file, **connection_options):
+    global state_store
+
+    if ctx.invoked_subcommand is not None:
+        return
+
+    state_backend = get_state_backend(worker_num)
+
+    if state_backend == 'shm':
+        state_store = statestore.SharedStateStore(
+            f'{STATE_SHM_PATH}-{os.getpid()}',
+            pots_size=STATE_POTS_SIZE,
+            traffic_size=STATE_TRAFFIC_SIZE
+        )
+    elif state_backend == 'local':
+        if (worker_num or 1) != 1:
+            raise click.UsageError('STATE_BACKEND=local needs a single worker (--worker-num 1)')
+
+        state_store = statestore.LocalStateStore()
+
     click.echo('Starting server with following configuration:')
     click.echo('Host: %r' % host)
     click.echo('Port: %r' % port)
     click.echo('Worker number: %r' % worker_num)
     click.echo('Debug: %r' % debug)
+    click.echo('Engine: %r' % engine)
+    click.echo('State backend: %r' % state_backend)
 
+    if engine == 'uvloop':
+        click.echo('Connections: %r' % connection_options)
+
+    if pid_file:
+        with open(pid_file, 'w') as pid_file_obj:
+            pid_file_obj.write(f'{os.getpid()}\n{engine}\n')
+
+        # Finalizers run only in the process which registered them - the master
+        multiprocessing.util.Finalize(None, remove_pid_file, args=(pid_file, os.getpid()), exitpriority=0)
+
+    app = create_app(engine, connection_options)
     app.run(
         host=host,
         port=int(port),
@@ -265,5 +1012,68 @@ def cli(host, port, worker_num, debug):
     )
 
 
+@cli.command('reload')
+@click.option('--pid-file', default=SERVER_PID_FILE)
+def reload_command(pid_file):
+    """Reload configuration of a running server (uvloop engine) without a restart."""
+    if not pid_file:
+        raise click.UsageError('--pid-file is required')
+
+    # SIGHUP would kill a japronto master, so the engine written next to its PID is checked first
+    pid, engine = read_pid_file(pid_file)
+    if engine != 'uvloop':
+        raise click.ClickException(f'Process {pid} runs the {engine} engine, only uvloop can reload - restart it instead')
+
+    # A stale file may hold the PID of an unrelated process by now
+    if not is_server_process(pid):
+        raise click.ClickException(f'Process {pid} from {pid_file} is not a running server')
+
+    os.kill(pid, signal.SIGHUP)
+    click.echo(f'Reload requested from process {pid}')
+
+
+@cli.command('inspect')
+@click.option('--pid-file', default=SERVER_PID_FILE)
+@click.option('--pid', type=int, help='PID of the master process, instead of --pid-file')
+@click.option('--top', 'top_count', default=10, help='Number of top traffic keys')
+@click.option('--json', 'as_json', default=False, is_flag=True, help='Dump the whole snapshot as JSON')
+def inspect_command(pid_file, pid, top_count, as_json):
+    """
+    Show state of a running server (STATE_BACKEND=shm) - brewing pots, top
+    traffic keys and table stats - read from shared memory without locks.
+    """
+    path_prefix = f'{STATE_SHM_PATH}-{get_master_pid(pid_file, pid)}'
+
+    try:
+        snapshot = statestore.inspect_state(path_prefix, top_count)
+    except FileNotFoundError:
+        raise click.ClickException(f'No state tables at {path_prefix}-*, is the server running with STATE_BACKEND=shm?')
+
+    if as_json:
+        click.echo(json.dumps(snapshot, indent=2))
+        return
+
+    if not snapshot['consistent']:
+        click.echo('Tables were written while copied, every entry is consistent only by itself')
+
+    click.echo(f'Brewing pots ({len(snapshot["brewing_pots"])}):')
+    for pot_key in snapshot['brewing_pots']:
+        click.echo(f'  {pot_key}')
+
+    click.echo('Top traffic keys:')
+    for entry in snapshot['top_traffic']:
+        click.echo(f'  {entry["second"]}  {entry["count"]:>8}  {entry["key"]}')
+
+    tables = [('pots', snapshot['tables']['pots'])]
+    tables.extend((f'traffic {stats["second"]}', stats) for stats in snapshot['tables']['traffic'])
+
+    click.echo('Tables:')
+    for name, stats in tables:
+        click.echo(
+            f'  {name:<18} {stats["used"]:>8}/{stats["capacity"]} used ({stats["load"]:.1%})   '
+            f'{stats["collided"]} collided   probe mean {stats["mean_probe"]:.2f} max {stats["max_probe"]}'
+        )
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,457 @@
+"""
+Shared-memory state backend (``STATE_BACKEND=shm``) - pot states and
+per-second traffic counters kept in hash tables in memory-mapped files.
+
+Workers read pot states without any lock or call to another process, and
+``python server.py inspect`` maps the same files read-only to look at the
+state of a running server without competing with its traffic.
+
+A single worker keeps the same state in its own dicts instead
+(``STATE_BACKEND=local``).
+"""
+import mmap
+import multiprocessing
+import multiprocessing.util
+import os
+import struct
+import time
+import zlib
+
+
+# Magic, capacity, key size, write sequence, epoch
+HEADER = struct.Struct('<8sQQQq')
+# Sequence, value, key length - followed by KEY_SIZE bytes of key
+SLOT = struct.Struct('<QqI4x')
+SEQUENCE = struct.Struct('<Q')
+
+MAGIC = b'TEAPOT01'
+KEY_SIZE = 104
+SLOT_SIZE = SLOT.size + KEY_SIZE
+
+# Offset of the write sequence in the header
+WRITE_SEQUENCE_OFFSET = 24
+
+# Seconds a reader waits for a slot being written (its writer may have died in the middle)
+READ_TIMEOUT = 1
+
+
+class TableFull(Exception):
+    pass
+
+
+class SlotBusy(Exception):
+    pass
+
+
+def read_raw_slot(buffer, offset):
+    """
+    Value and key of a slot without checking its sequence.
+    """
+    _, value, key_len = SLOT.unpack_from(buffer, offset)
+    return value, buffer[offset + SLOT.size:offset + SLOT.size + min(key_len, KEY_SIZE)]
+
+
+class SharedTable:
+    """
+    Fixed-size open addressing (linear probing) hash table of byte string
+    keys and integer values. Keys are never removed one by one, the whole
+    table is cleared at once when an increment of a newer epoch comes. A key
+    of value 0 reads the same as a missing one, so its slot is taken over by
+    the next new key probing past it.
+
+    Writers must hold ``lock``. Every slot has a sequence number which is
+    odd while the slot is written, so readers retry torn reads instead of
+    taking the lock. The table has one more such sequence for the whole
+    write, used by ``snapshot``.
+    """
+
+    def __init__(self, path, mm, lock=None):
+        self.path = path
+        self.lock = lock
+        self._mm = mm
+
+        magic, self.capacity, key_size, _, _ = HEADER.unpack_from(mm, 0)
+
+        if magic != MAGIC or key_size != KEY_SIZE:
+            raise ValueError(f'{path} is not a state table')
+
+    @classmethod
+    def create(cls, path, capacity, lock):
+        size = HEADER.size + capacity * SLOT_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        try:
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(mm, 0, MAGIC, capacity, KEY_SIZE, 0, 0)
+        return cls(path, mm, lock)
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Map an existing table read-only.
+        """
+        with open(path, 'rb') as table_file:
+            mm = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(path, mm)
+
+    @property
+    def write_sequence(self):
+        return SEQUENCE.unpack_from(self._mm, WRITE_SEQUENCE_OFFSET)[0]
+
+    @property
+    def epoch(self):
+        return HEADER.unpack_from(self._mm, 0)[4]
+
+    def _read_slot(self, offset):
+        mm = self._mm
+        deadline = None
+
+        while True:
+            sequence, value, key_len = SLOT.unpack_from(mm, offset)
+
+            if not sequence & 1:
+                key = mm[offset + SLOT.size:offset + SLOT.size + key_len]
+
+                if SEQUENCE.unpack_from(mm, offset)[0] == sequence:
+                    return value, key
+
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise SlotBusy(f'{self.path} slot at {offset} is written for over {READ_TIMEOUT}s')
+
+    def _find(self, key):
+        """
+        Offset and value of the key's slot, or offset of the empty slot it
+        would be written to (None when the table is full) and None.
+        """
+        index = zlib.crc32(key) % self.capacity
+
+        for _ in range(self.capacity):
+            offset = HEADER.size + index * SLOT_SIZE
+            value, slot_key = self._read_slot(offset)
+
+            if not slot_key or slot_key == key:
+                return offset, value if slot_key else None
+
+            index = (index + 1) % self.capacity
+
+        return None, None
+
+    def _find_writable(self, key):
+        """
+        Like ``_find``, but a missing key gets the first slot of value 0 on
+        its probe path when there is one.
+        """
+        index = zlib.crc32(key) % self.capacity
+        reusable = None
+
+        for _ in range(self.capacity):
+            offset = HEADER.size + index * SLOT_SIZE
+            value, slot_key = self._read_slot(offset)
+
+            if slot_key == key:
+                return offset, value
+
+            if not slot_key:
+                return (offset if reusable is None else reusable), None
+
+            if reusable is None and not value:
+                reusable = offset
+
+            index = (index + 1) % self.capacity
+
+        if reusable is None:
+            raise TableFull(f'{self.path} has no free slot for {key!r}')
+
+        return reusable, None
+
+    def get(self, key, default=None):
+        value = self._find(key)[1]
+        return default if value is None else value
+
+    def _begin_write(self):
+        SEQUENCE.pack_into(self._mm, WRITE_SEQUENCE_OFFSET, self.write_sequence + 1)
+
+    def _end_write(self):
+        SEQUENCE.pack_into(self._mm, WRITE_SEQUENCE_OFFSET, self.write_sequence + 1)
+
+    def _write_slot(self, offset, key, value):
+        mm = self._mm
+        sequence = SEQUENCE.unpack_from(mm, offset)[0]
+
+        SEQUENCE.pack_into(mm, offset, sequence + 1)
+        SLOT.pack_into(mm, offset, sequence + 1, value, len(key))
+        mm[offset + SLOT.size:offset + SLOT.size + len(key)] = key
+        SEQUENCE.pack_into(mm, offset, sequence + 2)
+
+    def update(self, items):
+        with self.lock:
+            self._begin_write()
+            try:
+                for key, value in items:
+                    self._write_slot(self._find_writable(key)[0], key, value)
+            finally:
+                self._end_write()
+
+    def increment(self, key, step, epoch=None):
+        """
+        Add ``step`` to the key's value and return it. With ``epoch``, the
+        table is cleared first when it holds an older epoch, and a step of
+        an epoch older than the table's one is returned without storing it.
+        """
+        with self.lock:
+            table_epoch = self.epoch
+
+            if epoch is not None and epoch < table_epoch:
+                return step
+
+            self._begin_write()
+            try:
+                if epoch is not None and epoch > table_epoch:
+                    self._mm[HEADER.size:] = bytes(self.capacity * SLOT_SIZE)
+                    HEADER.pack_into(self._mm, 0, MAGIC, self.capacity, KEY_SIZE, self.write_sequence, epoch)
+
+                offset, value = self._find_writable(key)
+                value = step if value is None else value + step
+                self._write_slot(offset, key, value)
+            finally:
+                self._end_write()
+
+        return value
+
+    def _get_entries(self, buffer, read_slot):
+        entries = []
+
+        for index in range(self.capacity):
+            offset = HEADER.size + index * SLOT_SIZE
+            value, key = read_slot(buffer, offset)
+
+            if key:
+                probe_length = (index - zlib.crc32(key) % self.capacity) % self.capacity
+                entries.append((key.decode(), value, probe_length))
+
+        return entries
+
+    def snapshot(self, attempts=10):
+        """
+        ``(epoch, entries, consistent)`` where entries are ``(key, value,
+        probe_length)`` of all keys.
+
+        Whole table is copied between two writes if any of ``attempts``
+        succeeds (``consistent`` is True), otherwise every entry is only
+        consistent by itself.
+        """
+        for _ in range(attempts):
+            write_sequence = self.write_sequence
+            if write_sequence & 1:
+                continue
+
+            data = self._mm[:]
+
+            if self.write_sequence == write_sequence:
+                epoch = HEADER.unpack_from(data, 0)[4]
+                return epoch, self._get_entries(data, read_raw_slot), True
+
+        def read_live_slot(buffer, offset):
+            try:
+                return self._read_slot(offset)
+            except SlotBusy:
+                # Its writer died in the middle, so the slot may be torn for good
+                return read_raw_slot(buffer, offset)
+
+        return self.epoch, self._get_entries(self._mm, read_live_slot), False
+
+
+def get_table_stats(capacity, entries):
+    probe_lengths = [probe_length for _, _, probe_length in entries]
+
+    return {
+        'capacity': capacity,
+        'used': len(entries),
+        'load': len(entries) / capacity,
+        'collided': sum(1 for probe_length in probe_lengths if probe_length),
+        'mean_probe': sum(probe_lengths) / len(probe_lengths) if probe_lengths else 0.0,
+        'max_probe': max(probe_lengths, default=0),
+    }
+
+
+def get_table_paths(path_prefix):
+    return {
+        'pots': f'{path_prefix}-pots',
+        'traffic': [f'{path_prefix}-traffic-{parity}' for parity in range(2)],
+    }
+
+
+def encode_key(key):
+    key = key.encode()
+
+    if len(key) > KEY_SIZE:
+        raise ValueError(f'State keys are limited to {KEY_SIZE} bytes')
+
+    return key
+
+
+class SharedStateStore:
+    """
+    Pot states and traffic counters of all workers, created by the master
+    before workers are forked and removed when it exits.
+
+    Traffic of even and odd seconds is counted in separate tables, each
+    cleared by the first increase of a new second, so the previous second
+    stays readable while the current one is counted.
+    """
+
+    def __init__(self, path_prefix, pots_size, traffic_size):
+        paths = get_table_paths(path_prefix)
+
+        self.pots = SharedTable.create(paths['pots'], pots_size, multiprocessing.Lock())
+        self.traffic = [
+            SharedTable.create(path, traffic_size, multiprocessing.Lock())
+            for path in paths['traffic']
+        ]
+
+        # Finalizers run only in the process which registered them - the master
+        multiprocessing.util.Finalize(self, self.unlink, exitpriority=0)
+
+    def unlink(self):
+        for table in [self.pots, *self.traffic]:
+            try:
+                os.unlink(table.path)
+            except FileNotFoundError:
+                pass
+
+    def get_pot_state(self, pot_key):
+        return bool(self.pots.get(encode_key(pot_key), 0))
+
+    def set_pot_states(self, brewing_states):
+        self.pots.update([
+            (encode_key(pot_key), int(brewing_state))
+            for pot_key, brewing_state in brewing_states.items()
+        ])
+
+    def increase_traffic(self, request_key, second, hits=1):
+        # Late request of a second already cleared is counted on its own
+        return self.traffic[second % 2].increment(encode_key(request_key), hits, epoch=second)
+
+    def ping(self):
+        return self.pots.write_sequence
+
+
+def is_process_alive(pid):
+    if not pid:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class LocalStateStore:
+    """
+    Pot states and traffic counters of the only worker, with the interface
+    of ``SharedStateStore``. The first process using the store owns it, any
+    other one (a worker forked later) gets an error instead of an empty
+    state of its own - unless the owner is dead, its state is lost then and
+    the process replacing it takes the store over.
+    """
+
+    def __init__(self):
+        self.pots = {}
+        self.traffic = {}
+        self.traffic_second = None
+
+        self._pid = None
+        self._owner_pid = multiprocessing.RawValue('q', 0)
+        self._owner_lock = multiprocessing.Lock()
+
+    def _check_owner(self):
+        pid = os.getpid()
+
+        if pid == self._pid:
+            return
+
+        with self._owner_lock:
+            if self._owner_pid.value != pid and is_process_alive(self._owner_pid.value):
+                raise RuntimeError(
+                    f'Local state of process {self._owner_pid.value} used by process {pid} - '
+                    f'it can\'t be shared by workers, use STATE_BACKEND=manager or shm'
+                )
+
+            self._owner_pid.value = pid
+
+        self._pid = pid
+
+    def get_pot_state(self, pot_key):
+        self._check_owner()
+        return self.pots.get(pot_key, False)
+
+    def set_pot_states(self, brewing_states):
+        self._check_owner()
+        self.pots.update(brewing_states)
+
+    def increase_traffic(self, request_key, second, hits=1):
+        self._check_owner()
+
+        if self.traffic_second is not None and second < self.traffic_second:
+            # Late request of a second already cleared is counted on its own
+            return hits
+
+        if second != self.traffic_second:
+            self.traffic.clear()
+            self.traffic_second = second
+
+        request_traffic = self.traffic[request_key] = self.traffic.get(request_key, 0) + hits
+        return request_traffic
+
+    def ping(self):
+        self._check_owner()
+        return len(self.pots)
+
+
+def inspect_state(path_prefix, top_count):
+    """
+    Snapshot of a running server's state, read through read-only mappings
+    of its tables without taking any of its locks.
+    """
+    paths = get_table_paths(path_prefix)
+
+    pots = SharedTable.attach(paths['pots'])
+    _, pot_entries, pots_consistent = pots.snapshot()
+
+    traffic_entries = []
+    traffic_stats = []
+    traffic_consistent = True
+
+    for path in paths['traffic']:
+        table = SharedTable.attach(path)
+        epoch, entries, consistent = table.snapshot()
+
+        traffic_consistent = traffic_consistent and consistent
+        traffic_stats.append(dict(get_table_stats(table.capacity, entries), second=epoch))
+        traffic_entries.extend((epoch, key, value) for key, value, _ in entries)
+
+    traffic_entries.sort(key=lambda entry: (-entry[2], -entry[0], entry[1]))
+
+    return {
+        'consistent': pots_consistent and traffic_consistent,
+        'brewing_pots': sorted(key for key, value, _ in pot_entries if value),
+        'top_traffic': [
+            {'second': second, 'key': key, 'count': count}
+            for second, key, count in traffic_entries[:top_count]
+        ],
+        'tables': {
+            'pots': get_table_stats(pots.capacity, pot_entries),
+            'traffic': traffic_stats,
+        },
+    }
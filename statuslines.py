@@ -0,0 +1,171 @@
+"""
+HTTP status lines of all registered codes, pre-serialized for both server
+engines. The patched japronto header is generated from the same table:
+
+    python statuslines.py > japronto_diff/src/japronto/response/reasons.h
+"""
+import click
+
+
+# IANA registry, including RFC 7168 (HTCPCP) and RFC 4918 (WebDAV) codes
+REASONS = {
+    100: 'Continue',
+    101: 'Switching Protocols',
+    102: 'Processing',
+    103: 'Early Hints',
+
+    200: 'OK',
+    201: 'Created',
+    202: 'Accepted',
+    203: 'Non-Authoritative Information',
+    204: 'No Content',
+    205: 'Reset Content',
+    206: 'Partial Content',
+    207: 'Multi-Status',
+    208: 'Already Reported',
+    226: 'IM Used',
+
+    300: 'Multiple Choices',
+    301: 'Moved Permanently',
+    302: 'Found',
+    303: 'See Other',
+    304: 'Not Modified',
+    305: 'Use Proxy',
+    307: 'Temporary Redirect',
+    308: 'Permanent Redirect',
+
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    402: 'Payment Required',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    406: 'Not Acceptable',
+    407: 'Proxy Authentication Required',
+    408: 'Request Timeout',
+    409: 'Conflict',
+    410: 'Gone',
+    411: 'Length Required',
+    412: 'Precondition Failed',
+    413: 'Payload Too Large',
+    414: 'URI Too Long',
+    415: 'Unsupported Media Type',
+    416: 'Range Not Satisfiable',
+    417: 'Expectation Failed',
+    418: "I'm a teapot",
+    421: 'Misdirected Request',
+    422: 'Unprocessable Entity',
+    423: 'Locked',
+    424: 'Failed Dependency',
+    425: 'Too Early',
+    426: 'Upgrade Required',
+    428: 'Precondition Required',
+    429: 'Too Many Requests',
+    431: 'Request Header Fields Too Large',
+    451: 'Unavailable For Legal Reasons',
+
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+    502: 'Bad Gateway',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+    505: 'HTTP Version Not Supported',
+    506: 'Variant Also Negotiates',
+    507: 'Insufficient Storage',
+    508: 'Loop Detected',
+    510: 'Not Extended',
+    511: 'Network Authentication Required',
+}
+
+UNKNOWN_REASON = 'Unknown'
+
+MIN_CODE = 100
+MAX_CODE = 599
+
+
+def get_status_line(code):
+    return f'HTTP/1.1 {code} {REASONS.get(code, UNKNOWN_REASON)}\r\n'.encode('latin-1')
+
+
+# Every code of the range has a line, unregistered ones with UNKNOWN_REASON
+STATUS_LINES = {code: get_status_line(code) for code in range(MIN_CODE, MAX_CODE + 1)}
+
+
+def to_c_string(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\r', '\\r').replace('\n', '\\n') + '"'
+
+
+def render_reasons_h():
+    lines = [
+        '// Generated by statuslines.py - do not edit, run:',
+        '//   python statuslines.py > japronto_diff/src/japronto/response/reasons.h',
+        '#pragma once',
+        '',
+        '#include <stddef.h>',
+        '#include <string.h>',
+        '',
+        'typedef struct {',
+        '  const char* line;',
+        '  size_t length;',
+        '} StatusLine;',
+        '',
+        f'#define STATUS_LINE_MIN {MIN_CODE}',
+        f'#define STATUS_LINE_MAX {MAX_CODE}',
+        '',
+        '// Whole "HTTP/1.1 <code> <reason>\\r\\n" of every code in the range',
+        'static const StatusLine status_lines[] = {',
+    ]
+    lines.extend(
+        f'  {{{to_c_string(status_line.decode("latin-1"))}, {len(status_line)}}}, //{code}'
+        for code, status_line in sorted(STATUS_LINES.items())
+    )
+    lines.extend([
+        '};',
+        '',
+        '// Copies status line of a code between STATUS_LINE_MIN and STATUS_LINE_MAX',
+        'static inline size_t write_status_line(char* buffer, int code) {',
+        '  const StatusLine* status_line = &status_lines[code - STATUS_LINE_MIN];',
+        '  memcpy(buffer, status_line->line, status_line->length);',
+        '  return status_line->length;',
+        '}',
+    ])
+
+    # Reason phrases alone, for code which doesn't write whole status lines
+    ranges = []
+    for code_class in range(MIN_CODE // 100, MAX_CODE // 100 + 1):
+        maximum = max(code % 100 for code in REASONS if code // 100 == code_class)
+        ranges.append((code_class, maximum))
+
+        lines.extend(['', f'static const char* reasons_{code_class}xx[] = {{'])
+        lines.extend(
+            f'  {to_c_string(REASONS.get(code, UNKNOWN_REASON))}, //{code}'
+            for code in range(code_class * 100, code_class * 100 + maximum + 1)
+        )
+        lines.append('};')
+
+    lines.extend([
+        '',
+        'typedef struct {',
+        '  const char** reasons;',
+        '  size_t maximum;',
+        '} ReasonRange;',
+        '',
+        'static const ReasonRange reason_ranges[] = {',
+    ])
+    lines.extend(
+        f'  {{reasons_{code_class}xx, {maximum}}},'
+        for code_class, maximum in ranges
+    )
+    lines.append('};')
+
+    return '\n'.join(lines) + '\n'
+
+
+@click.command()
+def cli():
+    """Print reasons.h of the patched japronto."""
+    click.echo(render_reasons_h(), nl=False)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,8 +1,17 @@
+import os
+import signal
+import socket
 import unittest
 import time
 import threading
 import multiprocessing
 import asyncio
+import json
+import email
+import socketserver
+import subprocess
+import tempfile
+import tracemalloc
 
 import requests
 from aiohttp import ClientSession
@@ -14,6 +23,13 @@ dotenv.load_dotenv('.env.test', override=True)
 
 
 import server
+import monitoring
+import emailhelper
+import notifications
+import statestore
+import statuslines
+import uvengine
+import traffichistory
 
 
 def sleep_to_next_second():
@@ -21,6 +37,67 @@ def sleep_to_next_second():
     time.sleep(time_left_to_next_second)
 
 
+class StandInSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, *lines):
+        for line in lines:
+            self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 stand-in ESMTP')
+
+        for line in self.rfile:
+            verb = line[:4].decode().upper()
+
+            if verb == 'EHLO':
+                self.reply('250-stand-in', '250 AUTH PLAIN')
+            elif verb == 'AUTH':
+                self.reply('235 Authenticated')
+            elif verb == 'MAIL' and self.server.is_failing:
+                self.reply('451 Try again later')
+            elif verb == 'MAIL' and self.server.is_hanging:
+                self.server.stopped.wait()
+                return
+            elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append(email.message_from_bytes(data))
+                self.reply('250 Queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class StandInSmtpServer(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP server accepting (or, when ``is_failing``, refusing) every
+    message and keeping accepted ones in ``messages``. When ``is_hanging``,
+    it never answers a message until stopped.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInSmtpHandler)
+        self.messages = []
+        self.is_failing = False
+        self.is_hanging = False
+        self.stopped = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
 class FakeRequest:
     def __init__(self, remote_addr, endpoint):
         self.remote_addr = remote_addr
@@ -134,6 +211,221 @@ class TestTrafficCounter(unittest.TestCase):
             )
 
 
+class TestTrafficCounterStress(unittest.TestCase):
+    """
+    Every process increments traffic of its share of ``STRESS_KEYS`` keys
+    (and of one key shared by all) in each of ``STRESS_SECONDS`` seconds,
+    waiting for the others before going to the next second, or incrementing
+    two seconds at once to cross a second boundary. With
+    ``TRAFFIC_STRESS_REPORT`` set, increments per second of every backend
+    and process count are appended to that CSV file.
+    """
+    STRESS_PROCESSES = [int(count) for count in os.getenv('TRAFFIC_STRESS_PROCESSES', '32,64,128').split(',')]
+    STRESS_KEYS = int(os.getenv('TRAFFIC_STRESS_KEYS', 2048))
+    STRESS_INCREMENTS = int(os.getenv('TRAFFIC_STRESS_INCREMENTS', 40))
+    STRESS_SECONDS = 3
+    STRESS_REPORT = os.getenv('TRAFFIC_STRESS_REPORT')
+
+    HOT_KEY_INDEX = 0
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.addCleanup(setattr, server, 'state_store', server.state_store)
+        server.TRAFFIC.clear()
+        self.addCleanup(server.TRAFFIC.clear)
+
+        self.first_second = int(time.time())
+        self.seconds = list(range(self.first_second, self.first_second + self.STRESS_SECONDS))
+
+    def use_backend(self, backend):
+        if backend == 'shm':
+            server.state_store = statestore.SharedStateStore(
+                os.path.join(self.temp_dir.name, f'state-{len(os.listdir(self.temp_dir.name))}'),
+                pots_size=8,
+                traffic_size=self.STRESS_KEYS * 2
+            )
+        else:
+            server.state_store = None
+            server.TRAFFIC.clear()
+
+    def get_key(self, key_index):
+        return f'10.{key_index // 250}.{key_index % 250}.1/earl-grey'
+
+    def get_key_indexes(self, process_index):
+        # Every fourth increment goes to the key shared by all processes
+        return [
+            (process_index * self.STRESS_INCREMENTS + increment) % self.STRESS_KEYS if increment % 4 else self.HOT_KEY_INDEX
+            for increment in range(self.STRESS_INCREMENTS)
+        ]
+
+    def increase_traffic(self, process_index, start_barrier, second_barrier, results_queue):
+        key_indexes = self.get_key_indexes(process_index)
+        results = []
+
+        start_barrier.wait()
+
+        for second in self.seconds:
+            for key_index in key_indexes:
+                results.append((second, key_index, server.increase_traffic(self.get_key(key_index), now=second)))
+
+            second_barrier.wait()
+
+        results_queue.put(results)
+
+    def increase_traffic_across_boundary(self, process_index, start_barrier, second_barrier, results_queue):
+        key_indexes = self.get_key_indexes(process_index)
+        # Half of processes start every key on the next second, so both seconds are incremented at once
+        seconds = self.seconds[:2] if process_index % 2 else self.seconds[1::-1]
+        results = []
+
+        start_barrier.wait()
+
+        for key_index in key_indexes:
+            for second in seconds:
+                results.append((second, key_index, server.increase_traffic(self.get_key(key_index), now=second)))
+
+        results_queue.put(results)
+
+    def run_stress(self, processes_count, target=None):
+        start_barrier = multiprocessing.Barrier(processes_count + 1)
+        second_barrier = multiprocessing.Barrier(processes_count)
+        results_queue = multiprocessing.Queue()
+
+        processes = [
+            multiprocessing.Process(
+                target=target or self.increase_traffic,
+                args=(process_index, start_barrier, second_barrier, results_queue)
+            )
+            for process_index in range(processes_count)
+        ]
+        [process.start() for process in processes]
+
+        start_barrier.wait()
+        started = time.perf_counter()
+        results = [result for _ in processes for result in results_queue.get(timeout=300)]
+        duration = time.perf_counter() - started
+
+        [process.join() for process in processes]
+        return results, duration
+
+    def get_expected_counts(self, processes_count):
+        expected_counts = {}
+
+        for process_index in range(processes_count):
+            for key_index in self.get_key_indexes(process_index):
+                expected_counts[key_index] = expected_counts.get(key_index, 0) + 1
+
+        return expected_counts
+
+    def record_rate(self, backend, processes_count, increments, duration):
+        if not self.STRESS_REPORT:
+            return
+
+        is_new = not os.path.exists(self.STRESS_REPORT)
+
+        with open(self.STRESS_REPORT, 'a') as report:
+            if is_new:
+                report.write('backend,processes,increments,seconds,increments_per_second\n')
+            report.write(f'{backend},{processes_count},{increments},{duration:.3f},{increments / duration:.0f}\n')
+
+    def assert_expired(self, backend):
+        last_second = self.seconds[-1]
+
+        if backend == 'shm':
+            self.assertEqual(
+                sorted(table.epoch for table in server.state_store.traffic),
+                [last_second - 1, last_second]
+            )
+        else:
+            self.assertEqual(
+                list(server.TRAFFIC.keys()),
+                [last_second]
+            )
+
+        # Late increment of an expired second is counted on its own
+        self.assertEqual(
+            server.increase_traffic(self.get_key(self.HOT_KEY_INDEX), now=self.first_second),
+            1
+        )
+
+        # Next second starts from zero
+        self.assertEqual(
+            server.increase_traffic(self.get_key(self.HOT_KEY_INDEX), now=last_second + 1),
+            1
+        )
+
+        if backend == 'shm':
+            self.assertEqual(
+                sorted(table.epoch for table in server.state_store.traffic),
+                [last_second, last_second + 1]
+            )
+        else:
+            self.assertEqual(
+                list(server.TRAFFIC.keys()),
+                [last_second + 1]
+            )
+
+    def test_exact_counts(self):
+        # `local` backend is owned by a single process
+        for backend in ('manager', 'shm'):
+            for processes_count in self.STRESS_PROCESSES:
+                with self.subTest(backend=backend, processes=processes_count):
+                    self.use_backend(backend)
+
+                    results, duration = self.run_stress(processes_count)
+                    self.record_rate(backend, processes_count, len(results), duration)
+
+                    counts_by_second = {}
+                    for second, key_index, count in results:
+                        counts_by_second.setdefault(second, {}).setdefault(key_index, []).append(count)
+
+                    self.assertEqual(
+                        sorted(counts_by_second),
+                        self.seconds
+                    )
+
+                    # Every increment of every second got its own count - none lost or repeated
+                    expected_counts = self.get_expected_counts(processes_count)
+                    for second, counts in counts_by_second.items():
+                        self.assertEqual(
+                            {key_index: sorted(key_counts) for key_index, key_counts in counts.items()},
+                            {key_index: list(range(1, count + 1)) for key_index, count in expected_counts.items()}
+                        )
+
+                    self.assert_expired(backend)
+
+    def test_exact_counts_across_second_boundary(self):
+        previous_second, next_second = self.seconds[:2]
+        processes_count = max(self.STRESS_PROCESSES)
+
+        # `local` backend is owned by a single process
+        for backend in ('manager', 'shm'):
+            with self.subTest(backend=backend):
+                self.use_backend(backend)
+
+                results, _ = self.run_stress(processes_count, self.increase_traffic_across_boundary)
+
+                counts_by_second = {previous_second: {}, next_second: {}}
+                for second, key_index, count in results:
+                    counts_by_second[second].setdefault(key_index, []).append(count)
+
+                # Late increments of the previous second may be counted on their own, never above its total
+                expected_counts = self.get_expected_counts(processes_count)
+                for key_index, key_counts in counts_by_second[previous_second].items():
+                    self.assertLessEqual(
+                        max(key_counts),
+                        expected_counts[key_index]
+                    )
+
+                # None of the next second's increments are lost or repeated
+                self.assertEqual(
+                    {key_index: sorted(key_counts) for key_index, key_counts in counts_by_second[next_second].items()},
+                    {key_index: list(range(1, count + 1)) for key_index, count in expected_counts.items()}
+                )
+
+
 class TestPotsState(unittest.TestCase):
     def setUp(self):
         self.earl_grey_request = FakeRequest('127.0.0.1', 'earl-grey')
@@ -188,413 +480,2402 @@ class TestPotsState(unittest.TestCase):
         )
 
 
-class TestServer(unittest.TestCase):
-    SERVER_EXE_PATH = 'server.py'
-    SERVER_TEST_PORT = 10000
+class TestPotsStateCache(unittest.TestCase):
+    def run_in_process(self, target, *args):
+        process = multiprocessing.Process(target=target, args=args)
+        process.start()
+        process.join()
 
-    def setUp(self, worker_num=None, debug=True):
+    def test_cache_invalidated_by_another_process(self):
+        request = FakeRequest('127.0.1.1', 'earl-grey')
 
-        def non_op_func(*args, **kwargs):
-            pass
+        # Cached in this process, changed by another one
+        self.assertEqual(
+            server.get_brewing_state(request),
+            False
+        )
+        self.run_in_process(server.set_brewing_state, request, True)
+        self.assertEqual(
+            server.get_brewing_state(request),
+            True
+        )
 
-        server.email_client.send = non_op_func
+        self.run_in_process(server.set_brewing_state, request, False)
+        self.assertEqual(
+            server.get_brewing_state(request),
+            False
+        )
 
-        self.host = server.SERVER_HOST
-        self.port = self.SERVER_TEST_PORT
-        self.__class__.SERVER_TEST_PORT += 1
+    def test_cached_reads_skip_manager(self):
+        request = FakeRequest('127.0.1.2', 'earl-grey')
+        server.set_brewing_state(request, True)
+        server.get_brewing_state(request)
 
-        self.base_url = f'http://{self.host}:{self.port}'
+        pots_brewing = server.POTS_BREWING
+        server.POTS_BREWING = None
+        try:
+            self.assertEqual(
+                server.get_brewing_state(request),
+                True
+            )
+        finally:
+            server.POTS_BREWING = pots_brewing
+
+    def test_concurrent_start_stop_across_processes(self):
+        rounds = 50
+        readers_count = 4
+        requests = [FakeRequest(f'127.0.2.{i}', 'earl-grey') for i in range(8)]
+        barrier = multiprocessing.Barrier(readers_count + 1)
+        stale_reads = multiprocessing.Value('i', 0)
+
+        def write():
+            for round_num in range(rounds):
+                for i, request in enumerate(requests):
+                    server.set_brewing_state(request, (round_num + i) % 2 == 0)
+                barrier.wait()
+                barrier.wait()
+
+        def read():
+            for round_num in range(rounds):
+                barrier.wait()
+                for i, request in enumerate(requests):
+                    if server.get_brewing_state(request) != ((round_num + i) % 2 == 0):
+                        with stale_reads.get_lock():
+                            stale_reads.value += 1
+                barrier.wait()
 
-        args = [
-            'python',
-            'server.py',
-            f'--host={self.host}',
-            f'--port={self.port}',
+        processes = [
+            multiprocessing.Process(target=write),
+            *[multiprocessing.Process(target=read) for _ in range(readers_count)],
         ]
+        [p.start() for p in processes]
+        [p.join() for p in processes]
 
-        if worker_num:
-            args.append(f'--worker-num={worker_num}')
-
-        if debug:
-            args.append('--debug')
-
-        server_process = psutil.Popen(args)
+        self.assertEqual(
+            stale_reads.value,
+            0
+        )
 
-        self.server_process = server_process
 
-        for _ in range(100):
-            try:
-                self.request('GET', '/')
-            except requests.ConnectionError:
-                time.sleep(0.05)
-                continue
-            else:
-                break
+class TestTrafficHistory(unittest.TestCase):
+    def setUp(self):
+        self.history = traffichistory.TrafficHistory(
+            ['english-breakfast', 'earl-grey'],
+            seconds_kept=3,
+            minutes_kept=2,
+            max_client_count=3
+        )
 
-    def tearDown(self):
-        server_processes = [self.server_process]
-        server_processes.extend(self.server_process.children(recursive=True))
+    def test_seconds_and_minutes(self):
+        for second in range(1200, 1206):
+            self.history.add_requests('earl-grey', now=second)
+        self.history.add_requests('english-breakfast', count=5, now=1205)
 
-        for process in server_processes:
-            try:
-                process.terminate()
-            except psutil.NoSuchProcess:
-                continue
+        snapshot = self.history.snapshot(now=1205)
 
-        psutil.wait_procs(server_processes, timeout=5)
+        # Only last 3 seconds are kept
+        self.assertEqual(
+            snapshot['seconds'],
+            [[1203, 0, 1], [1204, 0, 1], [1205, 5, 1]]
+        )
+        self.assertEqual(
+            snapshot['minutes'],
+            [[20, 5, 6]]
+        )
 
-        for process in server_processes:
-            if process.is_running():
-                try:
-                    process.kill()
-                except psutil.NoSuchProcess:
-                    continue
+        # Old rows are skipped even before being overwritten
+        self.assertEqual(
+            self.history.snapshot(now=1260)['minutes'],
+            [[20, 5, 6]]
+        )
+        self.assertEqual(
+            self.history.snapshot(now=1320)['minutes'],
+            []
+        )
 
-        psutil.wait_procs(server_processes, timeout=5)
+    def test_client_counts(self):
+        # Client making 1, 2 and 3 requests, then another making 5 requests at once
+        self.history.add_client_count(0, 1)
+        self.history.add_client_count(1, 2)
+        self.history.add_client_count(2, 3)
+        self.history.add_client_count(0, 5)
+        self.history.add_client_count(0, 1)
 
-        return
+        self.assertEqual(
+            self.history.snapshot()['client_counts'],
+            [1, 0, 2]
+        )
+        self.assertEqual(
+            traffichistory.snapshot_to_csv(self.history.snapshot(), 'client_counts'),
+            'requests,clients\r\n1,1\r\n2,0\r\n3+,2\r\n'
+        )
 
-    def request(self, method, endpoint, **kwargs):
-        url = f'{self.base_url}{endpoint}'
-        return requests.request(method.upper(), url, timeout=None, **kwargs)
+    def test_csv(self):
+        self.history.add_requests('earl-grey', count=2, now=1205)
 
-    def test_invalid_method(self):
-        bad_requests = [
-            # GET, PUT, HEAD, DELETE, OPTIONS, PATCH, and TRACE
-            # methods are not acceptable HTCPCP verbs
-            self.request('PUT', '/'),
-            self.request('HEAD', '/'),
-            self.request('DELETE', '/'),
-            self.request('OPTIONS', '/'),
-            self.request('PATCH', '/'),
-            self.request('TRACE', '/'),
-            # Missing body
-            # self.request('POST', '/'),
-            # self.request('BREW', '/'),
-            # self.request('WHEN', '/'),
-        ]
-        for response in bad_requests:
-            self.assertEqual(
-                response.status_code,
-                405
-            )
+        self.assertEqual(
+            traffichistory.snapshot_to_csv(self.history.snapshot(now=1205), 'seconds'),
+            'time,english-breakfast,earl-grey\r\n1205,0,2\r\n'
+        )
 
-    def test_get_returns_home_page(self):
-        with open('home.html', 'rb') as home_html_file:
-            expected_home_content = home_html_file.read()
+    def test_updates_from_many_processes(self):
+        processes_count = 8
+        requests_count = 500
+        second = int(time.time())
 
-        for endpoint in ('/', '/whatever-endpoint'):
-            response = self.request(
-                'GET',
-                endpoint,
-            )
-            self.assertEqual(
-                response.status_code,
-                200
-            )
-            self.assertEqual(
-                response.headers.get('Content-Type'),
-                'text/plain; charset=utf-8, text/html'
-            )
-            self.assertEqual(
-                response.content,
-                expected_home_content
-            )
+        def add_requests():
+            for _ in range(requests_count):
+                self.history.add_requests('earl-grey', now=second)
 
-    def test_brew_no_pot(self):
-        response = self.request(
-            'BREW',
-            '/',
-            data='start'
-        )
+        processes = [multiprocessing.Process(target=add_requests) for _ in range(processes_count)]
+        [p.start() for p in processes]
+        [p.join() for p in processes]
 
         self.assertEqual(
-            response.status_code,
-            300
+            self.history.snapshot(now=second)['seconds'],
+            [[second, 0, processes_count * requests_count]]
         )
+
+
+class TestSharedStateStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.path_prefix = os.path.join(self.temp_dir.name, 'state')
+        self.store = statestore.SharedStateStore(self.path_prefix, pots_size=8, traffic_size=4)
+
+    def test_pot_states(self):
+        self.assertFalse(self.store.get_pot_state('127.0.0.1/earl-grey'))
+
+        self.store.set_pot_states({'127.0.0.1/earl-grey': True, '127.0.0.2/earl-grey': True})
+        self.store.set_pot_states({'127.0.0.2/earl-grey': False})
+
         self.assertEqual(
-            response.headers['Alternates'],
-            '{"/english-breakfast" {type message/teapot}}, '
-            '{"/earl-grey" {type message/teapot}}'
+            [self.store.get_pot_state(f'127.0.0.{num}/earl-grey') for num in range(1, 4)],
+            [True, False, False]
         )
 
-    def test_start_brew_unsupported_tea(self):
-        response = self.request(
-            'BREW',
-            '/unsupported-tea',
-            data='start',
-            headers={'Content-Type': 'message/teapot'}
+    def test_pot_states_shared_with_forked_process(self):
+        process = multiprocessing.Process(
+            target=self.store.set_pot_states,
+            args=({'127.0.0.1/earl-grey': True},)
         )
+        process.start()
+        process.join()
 
+        self.assertTrue(self.store.get_pot_state('127.0.0.1/earl-grey'))
+
+    def test_traffic_by_second(self):
         self.assertEqual(
-            response.status_code,
-            503
+            [self.store.increase_traffic('127.0.0.1/earl-grey', 1000) for _ in range(3)],
+            [1, 2, 3]
         )
         self.assertEqual(
-            response.content,
-            b'"unsupported-tea" is not supported for this pot'
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1001, hits=5),
+            5
         )
 
-    def test_start_brew_english_breakfast_successfully(self):
-        response = self.request(
-            'BREW',
-            '/english-breakfast',
-            data='start',
-            headers={'Content-Type': 'message/teapot'}
+        # Previous second is still counted, until second after the next one clears it
+        self.assertEqual(
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1000),
+            4
         )
-
         self.assertEqual(
-            response.status_code,
-            202
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1002),
+            1
         )
         self.assertEqual(
-            response.content,
-            b'Brewing'
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1000),
+            1
         )
 
-    def test_start_brew_english_breakfast_but_its_busy(self):
-        for _ in range(2):
-            response = self.request(
-                'BREW',
-                '/english-breakfast',
-                data='start',
-                headers={'Content-Type': 'message/teapot'}
-            )
+    def test_table_full(self):
+        for num in range(4):
+            self.store.increase_traffic(f'127.0.0.{num}/earl-grey', 1000)
+
+        with self.assertRaises(statestore.TableFull):
+            self.store.increase_traffic('127.0.0.9/earl-grey', 1000)
+
+    def test_stopped_pot_slots_reused(self):
+        self.store.set_pot_states({f'127.0.0.{num}/earl-grey': True for num in range(8)})
+
+        with self.assertRaises(statestore.TableFull):
+            self.store.set_pot_states({'127.0.0.9/earl-grey': True})
+
+        self.store.set_pot_states({f'127.0.0.{num}/earl-grey': False for num in range(3)})
+        self.store.set_pot_states({f'127.0.1.{num}/earl-grey': True for num in range(3)})
 
         self.assertEqual(
-            response.status_code,
-            503
+            [self.store.get_pot_state(f'127.0.0.{num}/earl-grey') for num in range(8)],
+            [False] * 3 + [True] * 5
         )
         self.assertEqual(
-            response.content,
-            b'Pot is busy'
+            [self.store.get_pot_state(f'127.0.1.{num}/earl-grey') for num in range(3)],
+            [True] * 3
         )
-
-    def test_stop_brew_english_breakfast_successfully(self):
-        self.request(
-            'BREW',
-            '/english-breakfast',
-            data='start',
-            headers={'Content-Type': 'message/teapot'}
+        self.assertEqual(
+            statestore.inspect_state(self.path_prefix, top_count=1)['tables']['pots']['used'],
+            8
         )
 
-        response = self.request(
-            'BREW',
-            '/english-breakfast',
-            data='stop',
-            headers={'Content-Type': 'message/teapot', 'Email': 'unittest@email.com'}
+    def test_slot_of_dead_writer(self):
+        self.store.set_pot_states({'127.0.0.1/earl-grey': True})
+
+        # Writer dies in the middle of writing the slot
+        offset = self.store.pots._find(b'127.0.0.1/earl-grey')[0]
+        self.store.pots._begin_write()
+        statestore.SEQUENCE.pack_into(self.store.pots._mm, offset, 3)
+
+        original_timeout = statestore.READ_TIMEOUT
+        statestore.READ_TIMEOUT = 0.05
+        self.addCleanup(setattr, statestore, 'READ_TIMEOUT', original_timeout)
+
+        with self.assertRaises(statestore.SlotBusy):
+            self.store.get_pot_state('127.0.0.1/earl-grey')
+
+        snapshot = statestore.inspect_state(self.path_prefix, top_count=1)
+
+        self.assertEqual(
+            (snapshot['consistent'], snapshot['brewing_pots']),
+            (False, ['127.0.0.1/earl-grey'])
+        )
+
+    def test_key_too_long(self):
+        with self.assertRaises(ValueError):
+            self.store.set_pot_states({'x' * (statestore.KEY_SIZE + 1): True})
+
+    def test_inspect_state(self):
+        # Stopped pots keep their slots until new pots take them over
+        self.store.set_pot_states({f'127.0.0.{num}/earl-grey': True for num in range(6)})
+        self.store.set_pot_states({f'127.0.0.{num}/earl-grey': False for num in range(1, 6, 2)})
+        for hits in range(1, 4):
+            self.store.increase_traffic(f'127.0.0.{hits}/earl-grey', 1000, hits)
+        self.store.increase_traffic('127.0.0.9/earl-grey', 1001, 2)
+
+        snapshot = statestore.inspect_state(self.path_prefix, top_count=2)
+
+        self.assertTrue(snapshot['consistent'])
+        self.assertEqual(
+            snapshot['brewing_pots'],
+            ['127.0.0.0/earl-grey', '127.0.0.2/earl-grey', '127.0.0.4/earl-grey']
+        )
+        self.assertEqual(
+            snapshot['top_traffic'],
+            [
+                {'second': 1000, 'key': '127.0.0.3/earl-grey', 'count': 3},
+                {'second': 1001, 'key': '127.0.0.9/earl-grey', 'count': 2},
+            ]
+        )
+
+        pots_stats = snapshot['tables']['pots']
+        self.assertEqual(
+            (pots_stats['capacity'], pots_stats['used']),
+            (8, 6)
+        )
+        self.assertEqual(
+            pots_stats['collided'] > 0,
+            pots_stats['max_probe'] > 0
+        )
+        self.assertEqual(
+            sorted((stats['second'], stats['used']) for stats in snapshot['tables']['traffic']),
+            [(1000, 3), (1001, 1)]
+        )
+
+    def test_snapshot_while_written(self):
+        table = statestore.SharedTable.attach(self.store.pots.path)
+        stop_writing = multiprocessing.Event()
+        self.store.set_pot_states({'127.0.0.1/earl-grey': True, '127.0.0.2/earl-grey': False})
+
+        def write():
+            num = 0
+            while not stop_writing.is_set():
+                self.store.set_pot_states({'127.0.0.1/earl-grey': True, '127.0.0.2/earl-grey': num % 2 == 0})
+                num += 1
+
+        writer = multiprocessing.Process(target=write)
+        writer.start()
+
+        try:
+            for _ in range(20):
+                _, entries, _ = table.snapshot(attempts=1)
+                self.assertEqual(
+                    sorted((key, value) for key, value, _ in entries if key.startswith('127.0.0.1/')),
+                    [('127.0.0.1/earl-grey', 1)]
+                )
+                self.assertEqual(
+                    len(entries),
+                    2
+                )
+        finally:
+            stop_writing.set()
+            writer.join()
+
+    def test_unlink(self):
+        self.store.unlink()
+
+        with self.assertRaises(FileNotFoundError):
+            statestore.inspect_state(self.path_prefix, top_count=1)
+
+
+class TestLocalStateStore(unittest.TestCase):
+    def setUp(self):
+        self.store = statestore.LocalStateStore()
+
+    def run_in_process(self, func, *args):
+        process = multiprocessing.Process(target=func, args=args)
+        process.start()
+        process.join()
+        return process.exitcode
+
+    def test_pot_states(self):
+        self.store.set_pot_states({'127.0.0.1/earl-grey': True, '127.0.0.2/earl-grey': True})
+        self.store.set_pot_states({'127.0.0.2/earl-grey': False})
+
+        self.assertEqual(
+            [self.store.get_pot_state(f'127.0.0.{num}/earl-grey') for num in range(1, 4)],
+            [True, False, False]
+        )
+
+    def test_traffic_by_second(self):
+        self.assertEqual(
+            [self.store.increase_traffic('127.0.0.1/earl-grey', 1000, hits) for hits in (1, 2)],
+            [1, 3]
+        )
+        self.assertEqual(
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1001),
+            1
+        )
+
+        # Late request of a cleared second is counted on its own
+        self.assertEqual(
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1000, 5),
+            5
+        )
+        self.assertEqual(
+            self.store.increase_traffic('127.0.0.1/earl-grey', 1001),
+            2
+        )
+
+    def test_used_by_forked_process(self):
+        self.store.ping()
+
+        self.assertEqual(
+            self.run_in_process(self.store.set_pot_states, {'127.0.0.1/earl-grey': True}),
+            1
+        )
+        self.assertFalse(self.store.get_pot_state('127.0.0.1/earl-grey'))
+
+    def test_owned_by_first_process(self):
+        # Master creates the store, but only its forked worker uses it
+        owner = multiprocessing.Process(target=time.sleep, args=(60,))
+        owner.start()
+        self.addCleanup(owner.join)
+        self.addCleanup(owner.terminate)
+
+        self.store._owner_pid.value = owner.pid
+
+        with self.assertRaises(RuntimeError):
+            self.store.get_pot_state('127.0.0.1/earl-grey')
+
+    def test_taken_over_from_dead_owner(self):
+        self.assertEqual(
+            self.run_in_process(self.store.set_pot_states, {'127.0.0.1/earl-grey': True}),
+            0
+        )
+
+        # State of the dead owner is lost with it
+        self.assertFalse(self.store.get_pot_state('127.0.0.1/earl-grey'))
+
+        self.assertEqual(
+            self.run_in_process(self.store.ping),
+            1
+        )
+
+    def test_auto_backend(self):
+        original_backend = server.STATE_BACKEND
+        self.addCleanup(setattr, server, 'STATE_BACKEND', original_backend)
+
+        server.STATE_BACKEND = 'auto'
+        self.assertEqual(
+            [server.get_state_backend(worker_num) for worker_num in (None, 0, 1, 2)],
+            ['local', 'local', 'local', 'manager']
+        )
+
+        server.STATE_BACKEND = 'shm'
+        self.assertEqual(
+            server.get_state_backend(1),
+            'shm'
+        )
+
+
+class TestLoopLagMonitor(unittest.TestCase):
+    def run_loop_for(self, loop, seconds):
+        loop.call_later(seconds, loop.stop)
+        loop.run_forever()
+
+    def test_lag_of_blocked_loop(self):
+        loop = asyncio.new_event_loop()
+        monitor = monitoring.LoopLagMonitor(interval=0.01)
+        monitor.start(loop)
+
+        # Let the timer run on time, then block the loop longer than the interval
+        self.run_loop_for(loop, 0.05)
+        self.assertLess(
+            monitor.current_lag(),
+            0.05
+        )
+
+        loop.call_soon(time.sleep, 0.2)
+        self.run_loop_for(loop, 0.05)
+        loop.close()
+
+        self.assertGreater(
+            monitor.lag,
+            0.1
+        )
+
+
+class TestDigestSender(unittest.TestCase):
+    def setUp(self):
+        self.smtp_server = StandInSmtpServer()
+        self.email_client = emailhelper.GmailSender('127.0.0.1', self.smtp_server.port, 'user', 'pass', 'plain')
+
+    def tearDown(self):
+        self.smtp_server.stop()
+
+    def create_digest_sender(self, interval=60, max_count=1000):
+        return notifications.DigestSender(
+            self.email_client,
+            addr_from='server@example.com',
+            addr_to=['receiver@example.com'],
+            format_digest=lambda rows: (f'{len(rows)} rows', '\n'.join(rows)),
+            interval=interval,
+            max_count=max_count
+        )
+
+    def wait_for_messages(self, count, timeout=5):
+        for _ in range(int(timeout / 0.01)):
+            if len(self.smtp_server.messages) >= count:
+                break
+            time.sleep(0.01)
+
+    def get_sent_rows(self):
+        return [
+            row
+            for message in self.smtp_server.messages
+            for part in message.walk()
+            if part.get_content_type() == 'text/html'
+            for row in part.get_payload(decode=True).decode().splitlines()
+        ]
+
+    def test_flush_on_max_count(self):
+        digest_sender = self.create_digest_sender(max_count=3)
+
+        for i in range(3):
+            digest_sender.add(f'candidate-{i}')
+
+        self.wait_for_messages(1)
+
+        self.assertEqual(
+            [message['Subject'] for message in self.smtp_server.messages],
+            ['3 rows']
+        )
+        self.assertEqual(
+            self.get_sent_rows(),
+            ['candidate-0', 'candidate-1', 'candidate-2']
+        )
+
+    def test_flush_on_interval(self):
+        digest_sender = self.create_digest_sender(interval=0.1)
+        digest_sender.add('candidate-0')
+
+        self.wait_for_messages(1)
+
+        self.assertEqual(
+            self.get_sent_rows(),
+            ['candidate-0']
+        )
+
+    def test_failed_flush_keeps_rows(self):
+        digest_sender = self.create_digest_sender()
+        digest_sender.add('candidate-0')
+        digest_sender.add('candidate-1')
+
+        self.smtp_server.is_failing = True
+        with self.assertRaises(Exception):
+            digest_sender.flush()
+
+        self.assertEqual(
+            digest_sender.rows_retrying,
+            2
+        )
+
+        self.smtp_server.is_failing = False
+        digest_sender.add('candidate-2')
+        digest_sender.flush()
+
+        self.assertEqual(
+            self.get_sent_rows(),
+            ['candidate-0', 'candidate-1', 'candidate-2']
+        )
+        self.assertEqual(
+            digest_sender.rows_retrying,
+            0
+        )
+
+    def test_rows_being_sent_are_counted(self):
+        digest_sender = self.create_digest_sender()
+        digest_sender.add('candidate-0')
+        digest_sender.add('candidate-1')
+
+        self.smtp_server.is_hanging = True
+        flush_errors = []
+
+        def flush():
+            try:
+                digest_sender.flush()
+            except Exception as e:
+                flush_errors.append(e)
+
+        flush_thread = threading.Thread(target=flush)
+        flush_thread.start()
+
+        # Wait for the send to reach the hanging MAIL command
+        time.sleep(0.2)
+        digest_sender.add('candidate-2')
+
+        self.assertEqual(
+            len(digest_sender),
+            3
+        )
+
+        # Hanging send is dropped, its rows go out with the next one
+        self.smtp_server.is_hanging = False
+        self.smtp_server.stopped.set()
+        flush_thread.join()
+        digest_sender.flush()
+
+        self.assertEqual(
+            (len(flush_errors), len(digest_sender)),
+            (1, 0)
+        )
+        self.assertEqual(
+            self.get_sent_rows(),
+            ['candidate-0', 'candidate-1', 'candidate-2']
+        )
+
+    def test_no_rows_lost_during_flushes(self):
+        rows_count = 500
+        digest_sender = self.create_digest_sender(interval=0.01, max_count=7)
+
+        def add_rows(offset):
+            for i in range(offset, rows_count, 5):
+                digest_sender.add(f'candidate-{i}')
+
+        threads = [threading.Thread(target=add_rows, args=(offset,)) for offset in range(5)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        digest_sender.flush()
+
+        self.assertEqual(
+            sorted(self.get_sent_rows()),
+            sorted(f'candidate-{i}' for i in range(rows_count))
+        )
+
+    def test_flush_on_worker_exit(self):
+        digest_sender = self.create_digest_sender()
+
+        def add_rows():
+            digest_sender.add('candidate-0')
+            digest_sender.add('candidate-1')
+
+        process = multiprocessing.Process(target=add_rows)
+        process.start()
+        process.join()
+
+        self.assertEqual(
+            self.get_sent_rows(),
+            ['candidate-0', 'candidate-1']
+        )
+        self.assertEqual(
+            len(digest_sender),
+            0
+        )
+
+
+class TestEmailClient(unittest.TestCase):
+    def setUp(self):
+        self.smtp_server = StandInSmtpServer()
+        self.addCleanup(self.smtp_server.stop)
+
+    def send(self, port, **timeouts):
+        email_client = emailhelper.GmailSender('127.0.0.1', port, 'user', 'pass', 'plain', **timeouts)
+        start_time = time.perf_counter()
+
+        with self.assertRaises(OSError):
+            email_client.send(
+                addr_from='server@example.com',
+                addr_to=['receiver@example.com'],
+                subject='Subject',
+                message='Message'
+            )
+
+        return time.perf_counter() - start_time
+
+    def test_send_timeout(self):
+        self.smtp_server.is_hanging = True
+
+        self.assertLess(
+            self.send(self.smtp_server.port, connect_timeout=5, send_timeout=0.2),
+            1
+        )
+
+    def test_connect_timeout(self):
+        # Connections wait in the backlog of a socket which never accepts them
+        with socket.socket() as listening_socket:
+            listening_socket.bind(('127.0.0.1', 0))
+            listening_socket.listen(1)
+
+            self.assertLess(
+                self.send(listening_socket.getsockname()[1], connect_timeout=0.2, send_timeout=5),
+                1
+            )
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = notifications.CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+        self.calls = 0
+
+    def succeed(self):
+        self.calls += 1
+        return 'sent'
+
+    def fail(self):
+        self.calls += 1
+        raise ConnectionError('SMTP is down')
+
+    def call_failing(self, count):
+        for _ in range(count):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(self.fail)
+
+    def open_breaker(self):
+        self.call_failing(3)
+        self.calls = 0
+
+    def test_opens_after_consecutive_failures(self):
+        self.call_failing(2)
+        self.assertEqual(
+            self.breaker.call(self.succeed),
+            'sent'
+        )
+
+        # Success resets the count
+        self.call_failing(2)
+        self.assertEqual(
+            self.breaker.state,
+            'closed'
+        )
+
+        self.call_failing(1)
+        self.assertEqual(
+            self.breaker.state,
+            'open'
+        )
+
+    def test_fails_fast_while_open(self):
+        self.open_breaker()
+
+        for _ in range(5):
+            with self.assertRaises(notifications.CircuitOpenError) as context:
+                self.breaker.call(self.succeed)
+
+        self.assertEqual(
+            self.calls,
+            0
+        )
+        self.assertTrue(0 < context.exception.retry_after <= 0.2)
+
+    def test_probe_closes(self):
+        self.open_breaker()
+        time.sleep(0.2)
+
+        self.assertEqual(
+            self.breaker.call(self.succeed),
+            'sent'
+        )
+        self.assertEqual(
+            self.breaker.state,
+            'closed'
+        )
+
+    def test_failed_probe_opens_again(self):
+        self.open_breaker()
+        time.sleep(0.2)
+
+        self.call_failing(1)
+
+        self.assertEqual(
+            self.breaker.state,
+            'open'
+        )
+        with self.assertRaises(notifications.CircuitOpenError):
+            self.breaker.call(self.succeed)
+
+    def test_single_probe_at_once(self):
+        self.open_breaker()
+        time.sleep(0.2)
+        probe_states = []
+
+        def probe():
+            probe_states.append(self.breaker.state)
+
+            with self.assertRaises(notifications.CircuitOpenError):
+                self.breaker.call(self.succeed)
+
+        self.breaker.call(probe)
+
+        self.assertEqual(
+            probe_states,
+            ['half_open']
+        )
+        self.assertEqual(
+            self.calls,
+            0
+        )
+
+    def test_shared_with_forked_process(self):
+        process = multiprocessing.Process(target=self.call_failing, args=(3,))
+        process.start()
+        process.join()
+
+        self.assertEqual(
+            self.breaker.state,
+            'open'
+        )
+
+    def test_snapshot(self):
+        self.open_breaker()
+
+        with self.assertRaises(notifications.CircuitOpenError):
+            self.breaker.call(self.succeed)
+
+        time.sleep(0.2)
+        self.breaker.call(self.succeed)
+
+        snapshot = self.breaker.snapshot()
+
+        self.assertEqual(
+            {name: snapshot[name] for name in notifications.BREAKER_VALUES},
+            {
+                'state': 'closed',
+                'consecutive_failures': 0,
+                'successes': 1,
+                'failures': 3,
+                'rejected': 1,
+                'opened': 1,
+                'probes': 1,
+            }
+        )
+        self.assertEqual(
+            snapshot['retry_after'],
+            0.0
+        )
+
+
+class TestMemoryDiagnostics(unittest.TestCase):
+    def test_top_diff_shows_growth(self):
+        loop = asyncio.new_event_loop()
+        diagnostics = monitoring.MemoryDiagnostics(interval=3600, snapshots_kept=2)
+        diagnostics.start(loop)
+
+        allocated = [bytes(1000) for _ in range(1000)]
+        diagnostics.take_snapshot()
+
+        loop.close()
+        tracemalloc.stop()
+
+        top_allocation = diagnostics.top_diff(limit=1)['top'][0]
+
+        self.assertIn(
+            'tests.py',
+            top_allocation['location']
+        )
+        self.assertGreaterEqual(
+            top_allocation['size_diff'],
+            len(allocated) * 1000
+        )
+
+
+class TestReloadConfig(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        with open('.env.test') as env_test_file:
+            env_test = env_test_file.read()
+
+        self.env_file = os.path.join(temp_dir.name, '.env')
+        with open(self.env_file, 'w') as env_file_obj:
+            env_file_obj.write(env_test.replace('MIN_REQUESTS_COUNT=20', 'MIN_REQUESTS_COUNT=3'))
+
+        original_env = dict(os.environ)
+        original_globals = {
+            name: getattr(server, name)
+            for name in (
+                'SERVER_ENV_FILE', 'MIN_REQUESTS_COUNT', 'HOME_HTML_CONTENT', 'TEA_ALTERNATES', 'email_client',
+                'email_digest', 'read_home_html'
+            )
+        }
+
+        def restore():
+            os.environ.clear()
+            os.environ.update(original_env)
+            for name, value in original_globals.items():
+                setattr(server, name, value)
+
+        self.addCleanup(restore)
+        server.SERVER_ENV_FILE = self.env_file
+
+    def test_reload(self):
+        server.reload_config()
+
+        self.assertEqual(
+            server.MIN_REQUESTS_COUNT,
+            3
+        )
+
+    def test_invalid_home_html_changes_nothing(self):
+        def read_home_html():
+            raise FileNotFoundError('home.html')
+
+        home_html_content = server.HOME_HTML_CONTENT
+        server.read_home_html = read_home_html
+
+        with self.assertRaises(FileNotFoundError):
+            server.reload_config()
+
+        self.assertEqual(
+            (server.MIN_REQUESTS_COUNT, server.HOME_HTML_CONTENT),
+            (20, home_html_content)
+        )
+
+
+class TestStatusLines(unittest.TestCase):
+    REASONS_H_PATH = 'japronto_diff/src/japronto/response/reasons.h'
+
+    def test_htcpcp_and_webdav_codes(self):
+        self.assertEqual(
+            [statuslines.STATUS_LINES[code] for code in (418, 102, 207, 422, 423, 424, 507)],
+            [
+                b"HTTP/1.1 418 I'm a teapot\r\n",
+                b'HTTP/1.1 102 Processing\r\n',
+                b'HTTP/1.1 207 Multi-Status\r\n',
+                b'HTTP/1.1 422 Unprocessable Entity\r\n',
+                b'HTTP/1.1 423 Locked\r\n',
+                b'HTTP/1.1 424 Failed Dependency\r\n',
+                b'HTTP/1.1 507 Insufficient Storage\r\n',
+            ]
+        )
+
+    def test_table_is_complete(self):
+        self.assertEqual(
+            sorted(statuslines.STATUS_LINES),
+            list(range(100, 600))
+        )
+        self.assertEqual(
+            statuslines.STATUS_LINES[499],
+            b'HTTP/1.1 499 Unknown\r\n'
+        )
+
+    def test_reasons_h_is_generated(self):
+        with open(self.REASONS_H_PATH) as reasons_h_file:
+            self.assertEqual(
+                reasons_h_file.read(),
+                statuslines.render_reasons_h()
+            )
+
+
+class FakeTransport:
+    def __init__(self):
+        self.data = b''
+        self.is_closed = False
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 12345)
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.is_closed = True
+
+
+class TestUvEngine(unittest.TestCase):
+    def setUp(self):
+        self.app = uvengine.Application()
+        self.app.router.add_route('/', lambda request: request.Response(text='home'))
+        self.app.router.add_route('/{endpoint}', lambda request: request.Response(
+            code=418,
+            text=f'{request.method} {request.match_dict["endpoint"]} {request.body}',
+            headers={'Tea': request.headers.get('Tea', '')}
+        ))
+
+        self.transport = FakeTransport()
+        self.protocol = uvengine.HttpProtocol(self.app)
+        self.protocol.connection_made(self.transport)
+
+    def test_router_match(self):
+        self.assertEqual(
+            self.app.router.match('/')[1],
+            {}
+        )
+        self.assertEqual(
+            self.app.router.match('/earl-grey')[1],
+            {'endpoint': 'earl-grey'}
+        )
+        self.assertEqual(
+            self.app.router.match('/earl-grey/cup'),
+            (None, None)
+        )
+
+    def test_pipelined_htcpcp_requests(self):
+        request = b'BREW /earl-grey HTTP/1.1\r\ntea: yes\r\nContent-Length: 5\r\n\r\nstart'
+
+        # Second request arrives in two parts
+        self.protocol.data_received(request + request[:-3])
+        self.protocol.data_received(request[-3:])
+
+        responses = self.transport.data.split(b'HTTP/1.1 ')[1:]
+
+        self.assertEqual(
+            len(responses),
+            2
+        )
+        for response in responses:
+            self.assertTrue(response.startswith(b"418 I'm a teapot\r\nConnection: keep-alive\r\n"))
+            self.assertIn(b'\r\nTea: yes\r\n', response)
+            self.assertTrue(response.endswith(b"\r\n\r\nBREW earl-grey b'start'"))
+
+        self.assertFalse(self.transport.is_closed)
+
+    def test_connection_close(self):
+        self.protocol.data_received(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+
+        self.assertTrue(self.transport.data.startswith(b'HTTP/1.1 200 OK\r\nConnection: close\r\n'))
+        self.assertTrue(self.transport.data.endswith(b'\r\n\r\nhome'))
+        self.assertTrue(self.transport.is_closed)
+
+    def test_chunked_request_rejected(self):
+        self.protocol.data_received(b'BREW /earl-grey HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n')
+
+        self.assertTrue(self.transport.data.startswith(b'HTTP/1.1 411 Length Required\r\n'))
+        self.assertTrue(self.transport.is_closed)
+
+    def test_connection_stats_of_replaced_worker(self):
+        stats = self.app.connection_stats
+        stats.allocate(2)
+
+        # Old and new worker of the second slot serve it at once during a reload
+        for row in (2, 3):
+            stats.row = row
+            stats.add('opened')
+            stats.add('closed')
+        stats.add('opened')
+
+        self.assertEqual(
+            [(worker['opened'], worker['closed'], worker['open']) for worker in stats.snapshot()['workers']],
+            [(0, 0, 0), (3, 2, 1)]
+        )
+
+    def connect(self):
+        transport = FakeTransport()
+        protocol = uvengine.HttpProtocol(self.app)
+        protocol.connection_made(transport)
+        return protocol, transport
+
+    def test_max_requests_per_connection(self):
+        self.app.max_requests_per_connection = 2
+        self.app.connection_stats.allocate(1)
+        protocol, transport = self.connect()
+
+        protocol.data_received(b'GET / HTTP/1.1\r\n\r\n' * 3)
+
+        responses = transport.data.split(b'HTTP/1.1 ')[1:]
+
+        self.assertEqual(
+            [response.split(b'\r\n')[1] for response in responses],
+            [b'Connection: keep-alive', b'Connection: close']
+        )
+        self.assertTrue(transport.is_closed)
+
+        stats = self.app.connection_stats.snapshot()['total']
+        self.assertEqual(
+            (stats['opened'], stats['requests'], stats['reused'], stats['pipelined'], stats['max_requests_closes']),
+            (1, 2, 1, 1, 1)
+        )
+
+    def test_max_connections(self):
+        # Connection of setUp is the first one
+        self.app.max_connections = 2
+        self.app.connection_stats.allocate(1)
+
+        _, first_transport = self.connect()
+        _, second_transport = self.connect()
+
+        self.assertFalse(first_transport.is_closed)
+        self.assertTrue(second_transport.data.startswith(b'HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\n'))
+        self.assertTrue(second_transport.is_closed)
+
+        stats = self.app.connection_stats.snapshot()['total']
+        self.assertEqual(
+            (stats['opened'], stats['rejected']),
+            (2, 1)
+        )
+
+    def test_keep_alive_timeout(self):
+        self.app.loop = asyncio.new_event_loop()
+        self.app.keep_alive_timeout = 0.05
+        self.app.connection_stats.allocate(1)
+        protocol, transport = self.connect()
+
+        protocol.data_received(b'GET / HTTP/1.1\r\n\r\n')
+        self.assertFalse(transport.is_closed)
+
+        self.app.loop.call_later(0.2, self.app.loop.stop)
+        self.app.loop.run_forever()
+        self.app.loop.close()
+
+        self.assertTrue(transport.is_closed)
+        self.assertEqual(
+            self.app.connection_stats.snapshot()['total']['idle_timeouts'],
+            1
+        )
+
+    def test_request_timeout(self):
+        self.app.loop = asyncio.new_event_loop()
+        self.app.request_timeout = 0.1
+        self.app.connection_stats.allocate(1)
+
+        silent_protocol, silent_transport = self.connect()
+        trickling_protocol, trickling_transport = self.connect()
+        head = b'GET / HTTP/1.1\r\nTea: earl-grey\r\n'
+
+        # Every byte of a stalled head arrives before the timeout, but not all of them
+        for num, byte in enumerate(head):
+            self.app.loop.call_later(num * 0.01, trickling_protocol.data_received, bytes([byte]))
+
+        self.app.loop.call_later(0.2, self.app.loop.stop)
+        self.app.loop.run_forever()
+        self.app.loop.close()
+
+        self.assertTrue(silent_transport.is_closed)
+        self.assertTrue(trickling_transport.is_closed)
+        self.assertEqual(
+            trickling_transport.data,
+            b''
+        )
+        self.assertEqual(
+            self.app.connection_stats.snapshot()['total']['request_timeouts'],
+            2
+        )
+
+    def test_max_body_size(self):
+        self.app.max_body_size = 4
+        protocol, transport = self.connect()
+
+        protocol.data_received(b'BREW /earl-grey HTTP/1.1\r\nContent-Length: 5\r\n\r\n')
+
+        self.assertTrue(transport.data.startswith(b'HTTP/1.1 413 Payload Too Large\r\nConnection: close\r\n'))
+        self.assertTrue(transport.is_closed)
+
+    def test_stop_closes_connections_without_request(self):
+        class FakeServer:
+            def close(self):
+                pass
+
+        original_timeout = uvengine.STOP_REQUEST_TIMEOUT
+        self.addCleanup(setattr, uvengine, 'STOP_REQUEST_TIMEOUT', original_timeout)
+        uvengine.STOP_REQUEST_TIMEOUT = 0.05
+
+        self.app.loop = asyncio.new_event_loop()
+        self.app.connection_stats.allocate(1)
+        _, silent_transport = self.connect()
+        idle_protocol, idle_transport = self.connect()
+        idle_protocol.data_received(b'GET / HTTP/1.1\r\n\r\n')
+        partial_protocol, partial_transport = self.connect()
+        partial_protocol.data_received(b'GET / HTTP/1.1\r\n')
+
+        self.app.stop(self.app.loop, FakeServer())
+
+        # Keep-alive connection is closed right away, a new one once its request doesn't come
+        self.assertEqual(
+            [transport.is_closed for transport in (silent_transport, idle_transport, partial_transport)],
+            [False, True, False]
+        )
+
+        self.app.loop.call_later(0.1, self.app.loop.stop)
+        self.app.loop.run_forever()
+        self.app.loop.close()
+
+        self.assertEqual(
+            [transport.is_closed for transport in (silent_transport, idle_transport, partial_transport)],
+            [True, True, False]
+        )
+
+
+class TestServer(unittest.TestCase):
+    SERVER_EXE_PATH = 'server.py'
+    SERVER_TEST_PORT = 10000
+
+    def setUp(self, worker_num=None, debug=True, extra_args=()):
+
+        def non_op_func(*args, **kwargs):
+            pass
+
+        server.email_client.send = non_op_func
+
+        self.host = server.SERVER_HOST
+        self.port = self.SERVER_TEST_PORT
+        self.__class__.SERVER_TEST_PORT += 1
+
+        self.base_url = f'http://{self.host}:{self.port}'
+
+        args = [
+            'python',
+            'server.py',
+            f'--host={self.host}',
+            f'--port={self.port}',
+        ]
+
+        if worker_num:
+            args.append(f'--worker-num={worker_num}')
+
+        if debug:
+            args.append('--debug')
+
+        args.extend(extra_args)
+
+        server_process = psutil.Popen(args)
+
+        self.server_process = server_process
+
+        for _ in range(100):
+            try:
+                self.request('GET', '/')
+            except requests.ConnectionError:
+                time.sleep(0.05)
+                continue
+            else:
+                break
+
+    def tearDown(self):
+        server_processes = [self.server_process]
+        server_processes.extend(self.server_process.children(recursive=True))
+
+        for process in server_processes:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                continue
+
+        psutil.wait_procs(server_processes, timeout=5)
+
+        for process in server_processes:
+            if process.is_running():
+                try:
+                    process.kill()
+                except psutil.NoSuchProcess:
+                    continue
+
+        psutil.wait_procs(server_processes, timeout=5)
+
+        return
+
+    def request(self, method, endpoint, **kwargs):
+        url = f'{self.base_url}{endpoint}'
+        return requests.request(method.upper(), url, timeout=None, **kwargs)
+
+    def test_invalid_method(self):
+        bad_requests = [
+            # GET, PUT, HEAD, DELETE, OPTIONS, PATCH, and TRACE
+            # methods are not acceptable HTCPCP verbs
+            self.request('PUT', '/'),
+            self.request('HEAD', '/'),
+            self.request('DELETE', '/'),
+            self.request('OPTIONS', '/'),
+            self.request('PATCH', '/'),
+            self.request('TRACE', '/'),
+            # Missing body
+            # self.request('POST', '/'),
+            # self.request('BREW', '/'),
+            # self.request('WHEN', '/'),
+        ]
+        for response in bad_requests:
+            self.assertEqual(
+                response.status_code,
+                405
+            )
+
+    def test_get_returns_home_page(self):
+        with open('home.html', 'rb') as home_html_file:
+            expected_home_content = home_html_file.read()
+
+        for endpoint in ('/', '/whatever-endpoint'):
+            response = self.request(
+                'GET',
+                endpoint,
+            )
+            self.assertEqual(
+                response.status_code,
+                200
+            )
+            self.assertEqual(
+                response.headers.get('Content-Type'),
+                'text/plain; charset=utf-8, text/html'
+            )
+            self.assertEqual(
+                response.content,
+                expected_home_content
+            )
+
+    def test_brew_no_pot(self):
+        response = self.request(
+            'BREW',
+            '/',
+            data='start'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            300
+        )
+        self.assertEqual(
+            response.headers['Alternates'],
+            '{"/english-breakfast" {type message/teapot}}, '
+            '{"/earl-grey" {type message/teapot}}'
+        )
+
+    def test_start_brew_unsupported_tea(self):
+        response = self.request(
+            'BREW',
+            '/unsupported-tea',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            503
+        )
+        self.assertEqual(
+            response.content,
+            b'"unsupported-tea" is not supported for this pot'
+        )
+
+    def test_start_brew_english_breakfast_successfully(self):
+        response = self.request(
+            'BREW',
+            '/english-breakfast',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            202
+        )
+        self.assertEqual(
+            response.content,
+            b'Brewing'
+        )
+
+    def test_start_brew_english_breakfast_but_its_busy(self):
+        for _ in range(2):
+            response = self.request(
+                'BREW',
+                '/english-breakfast',
+                data='start',
+                headers={'Content-Type': 'message/teapot'}
+            )
+
+        self.assertEqual(
+            response.status_code,
+            503
+        )
+        self.assertEqual(
+            response.content,
+            b'Pot is busy'
+        )
+
+    def test_stop_brew_english_breakfast_successfully(self):
+        self.request(
+            'BREW',
+            '/english-breakfast',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        response = self.request(
+            'BREW',
+            '/english-breakfast',
+            data='stop',
+            headers={'Content-Type': 'message/teapot', 'Email': 'unittest@email.com'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            201
+        )
+        self.assertEqual(
+            response.content,
+            b'Finished'
+        )
+
+    def test_stop_brew_english_breakfast_but_its_not_started(self):
+        response = self.request(
+            'BREW',
+            '/english-breakfast',
+            data='stop',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            400
+        )
+        self.assertEqual(
+            response.content,
+            b'No beverage is being brewed by this pot'
+        )
+
+    # Earl-grey
+    def test_start_brew_earl_grey_successfully(self):
+        responses = []
+        start_brew = lambda: responses.append(
+            self.request(
+                'BREW',
+                '/earl-grey',
+                data='start',
+                headers={'Content-Type': 'message/teapot'}
+            )
+        )
+        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
+        sleep_to_next_second()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        success_responses = list(filter(lambda r: r.status_code == 202, responses))
+
+        self.assertEqual(
+            len(success_responses),
+            1
+        )
+
+        response = success_responses[0]
+
+        self.assertEqual(
+            response.content,
+            b'Brewing'
+        )
+
+    def test_start_brew_earl_grey_but_its_busy(self):
+        responses = []
+        start_brew = lambda: responses.append(
+            self.request(
+                'BREW',
+                '/earl-grey',
+                data='start',
+                headers={'Content-Type': 'message/teapot'}
+            )
+        )
+        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
+        sleep_to_next_second()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        response = self.request(
+            'BREW',
+            '/earl-grey',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            503
+        )
+        self.assertEqual(
+            response.content,
+            b'Pot is busy'
+        )
+
+    def test_start_brew_earl_grey_but_traffic_is_too_low(self):
+        responses = []
+        start_brew = lambda: responses.append(
+            self.request(
+                'BREW',
+                '/earl-grey',
+                data='start',
+                headers={'Content-Type': 'message/teapot'}
+            )
+        )
+        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT - 1)]
+        sleep_to_next_second()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        self.assertEqual(
+            len(responses),
+            server.MIN_REQUESTS_COUNT - 1
+        )
+
+        expected_messages = [
+            f'Traffic too low to brew "earl-grey" tea: {traffic}/{server.MIN_REQUESTS_COUNT}'
+            for traffic in range(1, server.MIN_REQUESTS_COUNT)
+        ]
+
+        for response in responses:
+
+            self.assertEqual(
+                (response.status_code, response.reason),
+                (424, 'Failed Dependency')
+            )
+            self.assertIn(
+                response.text,
+                expected_messages
+            )
+
+            expected_messages = list(filter(lambda msg: msg != response.text, expected_messages))
+
+        self.assertEqual(
+            expected_messages,
+            []
+        )
+
+    def test_start_brew_earl_grey_stress_test(self):
+        requests_count = 10000
+        server_workers = server.SERVER_WORKER_NUM
+        max_expected_duration = 10
+
+        self.tearDown()
+        time.sleep(0.5)
+        self.setUp(worker_num=server_workers, debug=False)
+
+        async def run():
+            url = f"{self.base_url}/earl-gray"
+            tasks = []
+
+            async with ClientSession() as session:
+                for _ in range(requests_count):
+                    task = asyncio.ensure_future(session.request('BREW', url, data='start'))
+                    tasks.append(task)
+
+                responses = asyncio.gather(*tasks)
+                await responses
+
+        loop = asyncio.get_event_loop()
+        future = asyncio.ensure_future(run())
+
+        start_time = time.time()
+        loop.run_until_complete(future)
+        duration = time.time() - start_time
+
+        request_per_second = requests_count / duration
+
+        print(f'\n!!! Stress test made {requests_count} in {duration:.3f} seconds ({request_per_second:.3f} requests '
+              f'per second, using server {server_workers} workers)')
+
+        self.assertLess(
+            duration,
+            max_expected_duration
+        )
+
+    def test_stop_brew_earl_grey_successfully(self):
+        start_brew = lambda: self.request(
+            'BREW',
+            '/earl-grey',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
+        sleep_to_next_second()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        response = self.request(
+            'BREW',
+            '/earl-grey',
+            data='stop',
+            headers={'Content-Type': 'message/teapot', 'Email': 'patryk.stachurski@reef.pl'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            201
+        )
+        self.assertEqual(
+            response.content,
+            b'Finished'
+        )
+
+    def test_stop_brew_earl_grey_but_its_not_started(self):
+        response = self.request(
+            'BREW',
+            '/earl-grey',
+            data='stop',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            400
+        )
+        self.assertEqual(
+            response.content,
+            b'No beverage is being brewed by this pot'
+        )
+
+    # Batch
+    def brew_batch(self, operations, headers=None):
+        return self.request(
+            'BREW',
+            '/batch',
+            data=json.dumps(operations),
+            headers={'Content-Type': 'message/teapot', **(headers or {})}
+        )
+
+    def test_brew_batch_english_breakfast_start_and_stop(self):
+        smtp_server = StandInSmtpServer()
+        self.addCleanup(smtp_server.stop)
+
+        self.restart_with_env({
+            'EMAIL_CREDS': f'user:pass:127.0.0.1:{smtp_server.port}',
+            'EMAIL_SECURITY': 'plain',
+        })
+
+        response = self.brew_batch(
+            [
+                ['english-breakfast', 'start'],
+                ['english-breakfast', 'start'],
+                ['english-breakfast', 'stop'],
+                ['english-breakfast', 'stop'],
+            ],
+            headers={'Email': 'unittest@email.com'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertEqual(
+            [(result['code'], result['text']) for result in response.json()],
+            [
+                (202, 'Brewing'),
+                (503, 'Pot is busy'),
+                (201, 'Finished'),
+                (400, 'No beverage is being brewed by this pot'),
+            ]
+        )
+        self.assertEqual(
+            len(smtp_server.messages),
+            1
+        )
+
+    def test_brew_batch_earl_grey_counts_starts_reaching_gate(self):
+        sleep_to_next_second()
+        response = self.brew_batch(
+            [['earl-grey', 'start']] * (server.MIN_REQUESTS_COUNT + 2)
+        )
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertEqual(
+            [(result['code'], result['text']) for result in response.json()],
+            [
+                *[
+                    (424, f'Traffic too low to brew "earl-grey" tea: {traffic}/{server.MIN_REQUESTS_COUNT}')
+                    for traffic in range(1, server.MIN_REQUESTS_COUNT)
+                ],
+                (202, 'Brewing'),
+                (503, 'Pot is busy'),
+                (503, 'Pot is busy'),
+            ]
+        )
+
+        # Starts finding the pot busy aren't hits, as with individual requests
+        client_counts = self.request('GET', '/debug/traffic').json()['client_counts']
+
+        self.assertEqual(
+            [(count, clients) for count, clients in enumerate(client_counts, 1) if clients],
+            [(server.MIN_REQUESTS_COUNT, 1)]
+        )
+
+        # State written by the batch is visible to individual requests
+        response = self.request(
+            'BREW',
+            '/earl-grey',
+            data='start',
+            headers={'Content-Type': 'message/teapot'}
+        )
+
+        self.assertEqual(
+            response.status_code,
+            503
+        )
+
+    def test_brew_batch_unsupported_tea_and_command(self):
+        response = self.brew_batch(
+            [
+                ['unsupported-tea', 'start'],
+                ['english-breakfast', 'pour'],
+            ]
+        )
+
+        self.assertEqual(
+            [(result['code'], result['text']) for result in response.json()],
+            [
+                (503, '"unsupported-tea" is not supported for this pot'),
+                (400, ''),
+            ]
+        )
+
+    def test_brew_batch_earl_grey_not_in_variants(self):
+        self.restart_with_env({'TEA_VARIANTS': 'english-breakfast;green'})
+
+        response = self.brew_batch(
+            [
+                ['earl-grey', 'start'],
+                ['green', 'start'],
+            ]
+        )
+
+        self.assertEqual(
+            [(result['code'], result['text']) for result in response.json()],
+            [
+                (503, '"earl-grey" is not supported for this pot'),
+                (202, 'Brewing'),
+            ]
+        )
+
+    def test_brew_batch_invalid_body(self):
+        bodies = [
+            'start',
+            '[]',
+            '[["earl-grey"]]',
+            json.dumps([['earl-grey', 'start']] * (server.BATCH_MAX_OPERATIONS + 1)),
+        ]
+
+        for body in bodies:
+            response = self.request(
+                'BREW',
+                '/batch',
+                data=body,
+                headers={'Content-Type': 'message/teapot'}
+            )
+
+            self.assertEqual(
+                response.status_code,
+                400
+            )
+
+    # Probes
+    def test_healthz(self):
+        response = self.request('GET', '/healthz')
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertEqual(
+            response.content,
+            b'OK'
+        )
+
+    def test_readyz(self):
+        response = self.request('GET', '/readyz')
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertEqual(
+            response.json()['ready'],
+            True
+        )
+        self.assertEqual(
+            set(response.json()),
+            {'ready', 'failures', 'loop_lag', 'state_ping', 'emails_outstanding', 'email_send_time'}
+        )
+
+    def test_probes_invalid_method(self):
+        for endpoint in ('/healthz', '/readyz'):
+            self.assertEqual(
+                self.request('BREW', endpoint).status_code,
+                405
+            )
+
+    def test_debug_memory(self):
+        self.assertEqual(
+            self.request('GET', '/debug/memory').status_code,
+            404
+        )
+
+        self.tearDown()
+        os.environ['MEMORY_DIAGNOSTICS'] = '1'
+        try:
+            self.setUp(worker_num=2)
+        finally:
+            del os.environ['MEMORY_DIAGNOSTICS']
+
+        response = self.request('GET', '/debug/memory')
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertEqual(
+            len(response.json()['rss']['workers']),
+            2
+        )
+        self.assertGreater(
+            response.json()['rss']['manager'],
+            0
+        )
+        self.assertIsInstance(
+            response.json()['allocations']['top'],
+            list
+        )
+
+    def test_debug_traffic(self):
+        for _ in range(3):
+            self.request(
+                'BREW',
+                '/earl-grey',
+                data='start',
+                headers={'Content-Type': 'message/teapot'}
+            )
+
+        history = self.request('GET', '/debug/traffic').json()
+
+        self.assertEqual(
+            sum(row[history['variants'].index('earl-grey') + 1] for row in history['seconds']),
+            3
+        )
+        self.assertEqual(
+            sum(history['client_counts']),
+            len({row[0] for row in history['seconds']})
+        )
+
+        response = self.request('GET', '/debug/traffic?format=csv&table=minutes')
+
+        self.assertEqual(
+            response.status_code,
+            200
+        )
+        self.assertTrue(response.text.startswith('time,english-breakfast,earl-grey\r\n'))
+
+    def test_reload_under_load(self):
+        self.tearDown()
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        env_file = os.path.join(temp_dir.name, '.env')
+        pid_file = os.path.join(temp_dir.name, 'server.pid')
+
+        with open('.env.test') as env_test_file:
+            env_test = env_test_file.read()
+        with open(env_file, 'w') as env_file_obj:
+            env_file_obj.write(env_test)
+
+        os.environ['SERVER_ENV_FILE'] = env_file
+        try:
+            self.setUp(worker_num=2, extra_args=['--engine=uvloop', f'--pid-file={pid_file}'])
+        finally:
+            del os.environ['SERVER_ENV_FILE']
+
+        # Pot state is kept by the Manager process, which outlives workers
+        self.assertEqual(
+            self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+            202
+        )
+
+        old_children = {child.pid for child in self.server_process.children()}
+        failures = []
+        stop_load = threading.Event()
+
+        def load():
+            # New connection for every request, so some of them hit workers being replaced
+            while not stop_load.is_set():
+                try:
+                    status_code = self.request('GET', '/').status_code
+                except Exception as e:
+                    failures.append(repr(e))
+                else:
+                    if status_code != 200:
+                        failures.append(status_code)
+
+        load_threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in load_threads:
+            thread.start()
+
+        with open(env_file, 'w') as env_file_obj:
+            env_file_obj.write(env_test.replace('MIN_REQUESTS_COUNT=20', 'MIN_REQUESTS_COUNT=3'))
+
+        time.sleep(0.5)
+        subprocess.run(['python', 'server.py', 'reload', f'--pid-file={pid_file}'], check=True)
+
+        # Both workers replaced, the Manager process stays
+        for _ in range(100):
+            if len(old_children - {child.pid for child in self.server_process.children()}) == 2:
+                break
+            time.sleep(0.1)
+
+        time.sleep(0.5)
+        stop_load.set()
+        for thread in load_threads:
+            thread.join()
+
+        self.assertEqual(
+            failures,
+            []
+        )
+        self.assertEqual(
+            len(old_children - {child.pid for child in self.server_process.children()}),
+            2
+        )
+
+        self.assertEqual(
+            self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+            503
+        )
+        self.assertEqual(
+            [
+                self.request('BREW', '/earl-grey', data='start', headers={'Content-Type': 'message/teapot'}).status_code
+                for _ in range(3)
+            ],
+            [424, 424, 202]
+        )
+
+    def test_reload_refused_for_japronto(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        pid_file = os.path.join(temp_dir.name, 'server.pid')
+
+        # Stands in for a japronto master, SIGHUP would end it
+        master_process = psutil.Popen(['sleep', '30'])
+        self.addCleanup(master_process.kill)
+
+        with open(pid_file, 'w') as pid_file_obj:
+            pid_file_obj.write(f'{master_process.pid}\njapronto\n')
+
+        reload_process = subprocess.run(
+            ['python', 'server.py', 'reload', f'--pid-file={pid_file}'],
+            stderr=subprocess.PIPE
         )
 
         self.assertEqual(
-            response.status_code,
-            201
+            reload_process.returncode,
+            1
+        )
+        self.assertIn(
+            b'only uvloop can reload',
+            reload_process.stderr
         )
         self.assertEqual(
-            response.content,
-            b'Finished'
+            master_process.status(),
+            psutil.STATUS_SLEEPING
         )
 
-    def test_stop_brew_english_breakfast_but_its_not_started(self):
-        response = self.request(
-            'BREW',
-            '/english-breakfast',
-            data='stop',
-            headers={'Content-Type': 'message/teapot'}
+    def test_reload_refused_for_stale_pid_file(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        pid_file = os.path.join(temp_dir.name, 'server.pid')
+
+        # PID of a stopped server reused by an unrelated process
+        unrelated_process = psutil.Popen(['sleep', '30'])
+        self.addCleanup(unrelated_process.kill)
+
+        with open(pid_file, 'w') as pid_file_obj:
+            pid_file_obj.write(f'{unrelated_process.pid}\nuvloop\n')
+
+        reload_process = subprocess.run(
+            ['python', 'server.py', 'reload', f'--pid-file={pid_file}'],
+            stderr=subprocess.PIPE
         )
 
         self.assertEqual(
-            response.status_code,
-            400
+            reload_process.returncode,
+            1
+        )
+        self.assertIn(
+            b'is not a running server',
+            reload_process.stderr
         )
         self.assertEqual(
-            response.content,
-            b'No beverage is being brewed by this pot'
+            unrelated_process.status(),
+            psutil.STATUS_SLEEPING
         )
 
-    # Earl-grey
-    def test_start_brew_earl_grey_successfully(self):
-        responses = []
-        start_brew = lambda: responses.append(
-            self.request(
-                'BREW',
-                '/earl-grey',
-                data='start',
-                headers={'Content-Type': 'message/teapot'}
-            )
+    def test_pid_file_removed_on_exit(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        pid_file = os.path.join(temp_dir.name, 'server.pid')
+
+        self.tearDown()
+        self.setUp(worker_num=1, extra_args=['--engine=uvloop', f'--pid-file={pid_file}'])
+
+        self.assertEqual(
+            server.read_pid_file(pid_file),
+            (self.server_process.pid, 'uvloop')
         )
-        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
-        sleep_to_next_second()
-        [t.start() for t in threads]
-        [t.join() for t in threads]
 
-        success_responses = list(filter(lambda r: r.status_code == 202, responses))
+        self.tearDown()
+        self.assertFalse(os.path.exists(pid_file))
+
+        # Server stopped by tearDown of the test
+        self.setUp()
+
+    def test_inspect(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        pid_file = os.path.join(temp_dir.name, 'server.pid')
+
+        self.restart_with_env({'STATE_BACKEND': 'shm'}, worker_num=2, extra_args=[f'--pid-file={pid_file}'])
 
         self.assertEqual(
-            len(success_responses),
+            self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+            202
+        )
+        self.assertEqual(
+            [
+                self.request('BREW', '/earl-grey', data='start', headers={'Content-Type': 'message/teapot'}).status_code
+                for _ in range(3)
+            ],
+            [424, 424, 424]
+        )
+
+        inspect_process = subprocess.run(
+            ['python', 'server.py', 'inspect', f'--pid-file={pid_file}', '--json'],
+            stdout=subprocess.PIPE,
+            check=True
+        )
+        snapshot = json.loads(inspect_process.stdout)
+
+        self.assertEqual(
+            [pot_key.split('/')[1] for pot_key in snapshot['brewing_pots']],
+            ['english-breakfast']
+        )
+        self.assertEqual(
+            sum(entry['count'] for entry in snapshot['top_traffic']),
+            3
+        )
+        self.assertEqual(
+            snapshot['tables']['pots']['used'],
             1
         )
 
-        response = success_responses[0]
+    def test_shared_state_full(self):
+        self.restart_with_env({
+            'STATE_BACKEND': 'shm',
+            'STATE_POTS_SIZE': '1',
+            'TEA_VARIANTS': 'english-breakfast;earl-grey;green',
+        }, worker_num=2)
+
+        responses = [
+            self.request('BREW', f'/{endpoint}', data='start', headers={'Content-Type': 'message/teapot'})
+            for endpoint in ('english-breakfast', 'green')
+        ]
 
         self.assertEqual(
-            response.content,
-            b'Brewing'
+            [(response.status_code, response.text) for response in responses],
+            [(202, 'Brewing'), (503, 'Too many pots are in use, please try again later')]
         )
 
-    def test_start_brew_earl_grey_but_its_busy(self):
-        responses = []
-        start_brew = lambda: responses.append(
-            self.request(
-                'BREW',
-                '/earl-grey',
-                data='start',
-                headers={'Content-Type': 'message/teapot'}
-            )
+    def test_dead_worker_replaced(self):
+        self.tearDown()
+        self.setUp(worker_num=2, extra_args=['--engine=uvloop'])
+
+        # The Manager process was started before the listening sockets were bound
+        workers = [
+            child for child in self.server_process.children()
+            if any(connection.status == psutil.CONN_LISTEN for connection in child.connections())
+        ]
+        self.assertEqual(
+            len(workers),
+            2
         )
-        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
-        sleep_to_next_second()
-        [t.start() for t in threads]
-        [t.join() for t in threads]
 
-        response = self.request(
-            'BREW',
-            '/earl-grey',
-            data='start',
-            headers={'Content-Type': 'message/teapot'}
+        workers[0].kill()
+        workers[0].wait()
+
+        # New connections balanced to the dead worker's socket are answered by its replacement
+        self.assertEqual(
+            [requests.get(f'{self.base_url}/', timeout=5).status_code for _ in range(20)],
+            [200] * 20
         )
 
+    def test_dead_single_worker_replaced(self):
+        self.tearDown()
+        self.setUp(worker_num=1, extra_args=['--engine=uvloop'])
+
         self.assertEqual(
-            response.status_code,
-            503
+            self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+            202
         )
+
+        worker, = [
+            child for child in self.server_process.children()
+            if any(connection.status == psutil.CONN_LISTEN for connection in child.connections())
+        ]
+        worker.kill()
+        worker.wait()
+        time.sleep(1)
+
+        # Replacement takes local state of the dead worker over, its pots are lost with it
         self.assertEqual(
-            response.content,
-            b'Pot is busy'
+            [
+                self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+                self.request('GET', '/readyz').status_code,
+            ],
+            [202, 200]
         )
 
-    def test_start_brew_earl_grey_but_traffic_is_too_low(self):
-        responses = []
-        start_brew = lambda: responses.append(
-            self.request(
-                'BREW',
-                '/earl-grey',
-                data='start',
-                headers={'Content-Type': 'message/teapot'}
-            )
+    def test_silent_connections_closed(self):
+        self.tearDown()
+        self.setUp(worker_num=1, extra_args=['--engine=uvloop', '--max-connections=3', '--request-timeout=1'])
+
+        silent_sockets = [socket.create_connection((self.host, self.port)) for _ in range(3)]
+        for silent_socket in silent_sockets:
+            self.addCleanup(silent_socket.close)
+
+        self.assertEqual(
+            self.request('GET', '/').status_code,
+            503
         )
-        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT - 1)]
-        sleep_to_next_second()
-        [t.start() for t in threads]
-        [t.join() for t in threads]
+
+        time.sleep(1.5)
 
         self.assertEqual(
-            len(responses),
-            server.MIN_REQUESTS_COUNT - 1
+            self.request('GET', '/').status_code,
+            200
+        )
+        self.assertEqual(
+            [silent_socket.recv(1) for silent_socket in silent_sockets],
+            [b''] * 3
         )
 
-        expected_messages = [
-            f'Traffic too low to brew "earl-grey" tea: {traffic}/{server.MIN_REQUESTS_COUNT}'
-            for traffic in range(1, server.MIN_REQUESTS_COUNT)
+    def get_status_line(self, raw_request):
+        with socket.create_connection((self.host, self.port)) as client:
+            client.sendall(raw_request)
+            client.shutdown(socket.SHUT_WR)
+
+            response = b''
+            while b'\r\n' not in response:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+
+        return response.split(b'\r\n')[0] + b'\r\n'
+
+    def test_emitted_status_lines_are_registered(self):
+        smtp_server = StandInSmtpServer()
+        self.addCleanup(smtp_server.stop)
+
+        self.restart_with_env({
+            'EMAIL_CREDS': f'user:pass:127.0.0.1:{smtp_server.port}',
+            'EMAIL_SECURITY': 'plain',
+        })
+
+        teapot = 'Content-Type: message/teapot\r\n'
+        stop = f'BREW /english-breakfast HTTP/1.1\r\n{teapot}Email: unittest@email.com\r\nContent-Length: 4\r\n\r\nstop'
+        raw_requests = [
+            'GET / HTTP/1.1\r\n\r\n',
+            'PUT / HTTP/1.1\r\nContent-Length: 0\r\n\r\n',
+            'BREW / HTTP/1.1\r\nContent-Length: 5\r\n\r\nstart',
+            'BREW /english-breakfast HTTP/1.1\r\nContent-Length: 5\r\n\r\nstart',
+            f'BREW /english-breakfast HTTP/1.1\r\n{teapot}Content-Length: 5\r\n\r\nstart',
+            f'BREW /english-breakfast HTTP/1.1\r\n{teapot}Content-Length: 5\r\n\r\nstart',
+            stop,
+            f'BREW /earl-grey HTTP/1.1\r\n{teapot}Content-Length: 5\r\n\r\nstart',
+            f'BREW /earl-grey HTTP/1.1\r\n{teapot}Content-Length: 4\r\n\r\nstop',
+            f'BREW /unsupported-tea HTTP/1.1\r\n{teapot}Content-Length: 5\r\n\r\nstart',
+            # Memory diagnostics are off
+            'GET /debug/memory HTTP/1.1\r\n\r\n',
+            'GET /debug/traffic?format=csv&table=centuries HTTP/1.1\r\n\r\n',
+            f'BREW /earl-grey HTTP/1.1\r\n{teapot}Transfer-Encoding: chunked\r\n\r\n5\r\nstart\r\n0\r\n\r\n',
         ]
 
-        for response in responses:
+        status_lines = {}
+        for raw_request in raw_requests:
+            status_line = self.get_status_line(raw_request.encode())
+            status_lines[int(status_line.split(b' ')[1])] = status_line
+
+        # Sending the completion email fails
+        smtp_server.is_failing = True
+        for raw_request in (f'BREW /english-breakfast HTTP/1.1\r\n{teapot}Content-Length: 5\r\n\r\nstart', stop):
+            status_line = self.get_status_line(raw_request.encode())
+            status_lines[int(status_line.split(b' ')[1])] = status_line
+
+        self.assertLessEqual(
+            {200, 201, 202, 300, 400, 404, 405, 424, 500, 503},
+            set(status_lines)
+        )
 
+        for code, status_line in status_lines.items():
+            self.assertIn(code, statuslines.REASONS)
             self.assertEqual(
-                response.status_code,
-                424
-            )
-            self.assertIn(
-                response.text,
-                expected_messages
+                status_line,
+                statuslines.STATUS_LINES[code]
             )
 
-            expected_messages = list(filter(lambda msg: msg != response.text, expected_messages))
+    def test_single_worker_local_state(self):
+        self.tearDown()
+        self.setUp(worker_num=1, extra_args=['--engine=uvloop'])
 
         self.assertEqual(
-            expected_messages,
-            []
+            [
+                self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code
+                for _ in range(2)
+            ],
+            [202, 503]
+        )
+        self.assertEqual(
+            self.request('GET', '/readyz').status_code,
+            200
         )
 
-    def test_start_brew_earl_grey_stress_test(self):
-        requests_count = 10000
-        server_workers = server.SERVER_WORKER_NUM
-        max_expected_duration = 10
+        # Reload would lose state of the only worker, so it's refused
+        children = {child.pid for child in self.server_process.children()}
+        self.server_process.send_signal(signal.SIGHUP)
+        time.sleep(1)
 
+        self.assertEqual(
+            {child.pid for child in self.server_process.children()},
+            children
+        )
+        self.assertEqual(
+            self.request('BREW', '/english-breakfast', data='start', headers={'Content-Type': 'message/teapot'}).status_code,
+            503
+        )
+
+    def restart_with_env(self, env, **kwargs):
+        """
+        Restart the server with ``env`` set on top of our environment.
+        """
         self.tearDown()
-        time.sleep(0.5)
-        self.setUp(worker_num=server_workers, debug=False)
 
-        async def run():
-            url = f"{self.base_url}/earl-gray"
-            tasks = []
+        original_env = dict(os.environ)
+        os.environ.update(env)
+        try:
+            self.setUp(**kwargs)
+        finally:
+            os.environ.clear()
+            os.environ.update(original_env)
 
-            async with ClientSession() as session:
-                for _ in range(requests_count):
-                    task = asyncio.ensure_future(session.request('BREW', url, data='start'))
-                    tasks.append(task)
+    def brew_and_stop(self, endpoint='/english-breakfast'):
+        headers = {'Content-Type': 'message/teapot', 'Email': 'candidate@example.com'}
 
-                responses = asyncio.gather(*tasks)
-                await responses
+        self.assertEqual(
+            self.request('BREW', endpoint, data='start', headers=headers).status_code,
+            202
+        )
+        return self.request('BREW', endpoint, data='stop', headers=headers)
+
+    def test_readyz_digest_waiting(self):
+        smtp_server = StandInSmtpServer()
+        smtp_server.is_failing = True
+        self.addCleanup(smtp_server.stop)
+
+        self.restart_with_env({
+            'EMAIL_CREDS': f'user:pass:127.0.0.1:{smtp_server.port}',
+            'EMAIL_SECURITY': 'plain',
+            'EMAIL_MODE': 'digest',
+            'EMAIL_DIGEST_COUNT': '2',
+            'EMAIL_DIGEST_INTERVAL': '600',
+            'READY_MAX_OUTSTANDING_EMAILS': '2',
+        }, worker_num=1)
 
-        loop = asyncio.get_event_loop()
-        future = asyncio.ensure_future(run())
+        self.assertEqual(
+            [self.brew_and_stop().status_code for _ in range(2)],
+            [201, 201]
+        )
 
-        start_time = time.time()
-        loop.run_until_complete(future)
-        duration = time.time() - start_time
+        # Failed digest of both completions is kept for the next send
+        for _ in range(100):
+            report = self.request('GET', '/readyz').json()
+            if report['emails_outstanding'] == 2:
+                break
+            time.sleep(0.05)
 
-        request_per_second = requests_count / duration
+        self.assertEqual(
+            (report['ready'], report['emails_outstanding']),
+            (True, 2)
+        )
 
-        print(f'\n!!! Stress test made {requests_count} in {duration:.3f} seconds ({request_per_second:.3f} requests '
-              f'per second, using server {server_workers} workers)')
+        self.brew_and_stop()
 
-        self.assertLess(
-            duration,
-            max_expected_duration
+        response = self.request('GET', '/readyz')
+
+        self.assertEqual(
+            (response.status_code, response.json()['failures'], response.json()['emails_outstanding']),
+            (503, ['emails_outstanding'], 3)
         )
 
-    def test_stop_brew_earl_grey_successfully(self):
-        start_brew = lambda: self.request(
-            'BREW',
-            '/earl-grey',
-            data='start',
-            headers={'Content-Type': 'message/teapot'}
+    def test_readyz_slow_email_send(self):
+        smtp_server = StandInSmtpServer()
+        smtp_server.is_hanging = True
+        self.addCleanup(smtp_server.stop)
+
+        self.restart_with_env({
+            'EMAIL_CREDS': f'user:pass:127.0.0.1:{smtp_server.port}',
+            'EMAIL_SECURITY': 'plain',
+            'EMAIL_SEND_TIMEOUT': '0.5',
+            'READY_MAX_EMAIL_SEND_TIME': '0.25',
+            'READY_EMAIL_SEND_WINDOW': '1',
+        }, worker_num=1)
+
+        self.assertEqual(
+            self.brew_and_stop().status_code,
+            500
         )
 
-        threads = [threading.Thread(target=start_brew) for _ in range(server.MIN_REQUESTS_COUNT)]
-        sleep_to_next_second()
-        [t.start() for t in threads]
-        [t.join() for t in threads]
+        response = self.request('GET', '/readyz')
 
-        response = self.request(
-            'BREW',
-            '/earl-grey',
-            data='stop',
-            headers={'Content-Type': 'message/teapot', 'Email': 'patryk.stachurski@reef.pl'}
+        self.assertEqual(
+            (response.status_code, response.json()['failures']),
+            (503, ['email_send_time'])
         )
+        self.assertGreaterEqual(
+            response.json()['email_send_time'],
+            0.5
+        )
+
+        time.sleep(1)
 
         self.assertEqual(
-            response.status_code,
-            201
+            self.request('GET', '/readyz').status_code,
+            200
         )
+
+    def test_stop_with_smtp_down(self):
+        smtp_server = StandInSmtpServer()
+        smtp_server.is_hanging = True
+        self.addCleanup(smtp_server.stop)
+
+        smtp_env = {
+            'EMAIL_CREDS': f'user:pass:127.0.0.1:{smtp_server.port}',
+            'EMAIL_SECURITY': 'plain',
+            'EMAIL_SEND_TIMEOUT': '0.5',
+            'EMAIL_BREAKER_FAILURES': '2',
+            'EMAIL_BREAKER_RESET_TIMEOUT': '60',
+        }
+        self.restart_with_env(smtp_env, worker_num=1)
+
+        headers = {'Content-Type': 'message/teapot', 'Email': 'candidate@example.com'}
+
+        def stop():
+            return self.request('BREW', '/english-breakfast', data='stop', headers=headers)
+
         self.assertEqual(
-            response.content,
-            b'Finished'
+            self.request('BREW', '/english-breakfast', data='start', headers=headers).status_code,
+            202
         )
 
-    def test_stop_brew_earl_grey_but_its_not_started(self):
-        response = self.request(
-            'BREW',
-            '/earl-grey',
-            data='stop',
-            headers={'Content-Type': 'message/teapot'}
+        # Sends time out until the breaker opens
+        start_time = time.perf_counter()
+        self.assertEqual(
+            [stop().status_code for _ in range(2)],
+            [500, 500]
+        )
+        self.assertGreaterEqual(
+            time.perf_counter() - start_time,
+            1
+        )
+
+        response = stop()
+        self.assertEqual(
+            (response.status_code, response.headers['Retry-After']),
+            (503, '60')
+        )
+
+        # The only worker keeps serving while stops keep coming
+        served = []
+        stop_load = threading.Event()
+
+        def load(func, results):
+            while not stop_load.is_set():
+                results.append(func().status_code)
+
+        stop_results = []
+        threads = [
+            threading.Thread(target=load, args=(stop, stop_results)),
+            *[threading.Thread(target=load, args=(lambda: self.request('GET', '/'), served)) for _ in range(4)],
+        ]
+        [t.start() for t in threads]
+        time.sleep(1)
+        stop_load.set()
+        [t.join() for t in threads]
+
+        self.assertEqual(
+            set(stop_results),
+            {503}
+        )
+        self.assertEqual(
+            set(served),
+            {200}
+        )
+        self.assertGreater(
+            len(served),
+            50
+        )
+
+        snapshot = self.request('GET', '/debug/email').json()
+
+        self.assertEqual(
+            (snapshot['state'], snapshot['failures'], snapshot['opened'], snapshot['rejected']),
+            ('open', 2, 1, len(stop_results) + 1)
         )
 
+    def test_debug_connections(self):
+        self.tearDown()
+        self.setUp(worker_num=2, extra_args=['--engine=uvloop', '--max-requests-per-connection=2'])
+
+        with requests.Session() as session:
+            for _ in range(3):
+                self.assertEqual(
+                    session.get(f'{self.base_url}/').status_code,
+                    200
+                )
+
+        response = self.request('GET', '/debug/connections')
+
         self.assertEqual(
             response.status_code,
-            400
+            200
         )
+
+        stats = response.json()
         self.assertEqual(
-            response.content,
-            b'No beverage is being brewed by this pot'
+            len(stats['workers']),
+            2
+        )
+        self.assertGreaterEqual(
+            stats['total']['requests'],
+            4
+        )
+        self.assertGreaterEqual(
+            stats['total']['reused'],
+            1
+        )
+        self.assertGreaterEqual(
+            stats['total']['max_requests_closes'],
+            1
         )
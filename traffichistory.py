@@ -0,0 +1,109 @@
+"""
+History of traffic kept for capacity planning.
+"""
+import csv
+import io
+import multiprocessing
+import time
+
+
+class TrafficHistory:
+    """
+    Per-second and per-minute request counts of every variant, and histogram
+    of per-client request counts within a second, kept in fixed-size ring
+    buffers in shared memory.
+
+    It must be created before workers are forked. Every update takes a
+    process-shared lock and changes a few integers, without any call to the
+    Manager process.
+    """
+
+    def __init__(self, variants, seconds_kept, minutes_kept, max_client_count):
+        self.variants = list(variants)
+        self.seconds_kept = seconds_kept
+        self.minutes_kept = minutes_kept
+        self.max_client_count = max_client_count
+
+        # Ring rows are [timestamp, count of every variant...]
+        self._row_size = len(self.variants) + 1
+        self._seconds = multiprocessing.RawArray('q', seconds_kept * self._row_size)
+        self._minutes = multiprocessing.RawArray('q', minutes_kept * self._row_size)
+        self._client_counts = multiprocessing.RawArray('q', max_client_count + 1)
+        self._lock = multiprocessing.Lock()
+
+    def _add(self, ring, timestamp, variant_index, count):
+        row_start = timestamp % (len(ring) // self._row_size) * self._row_size
+
+        if ring[row_start] != timestamp:
+            ring[row_start:row_start + self._row_size] = [timestamp] + [0] * len(self.variants)
+
+        ring[row_start + 1 + variant_index] += count
+
+    def add_requests(self, variant, count=1, now=None):
+        """
+        Variants added after the history was created (by a reload) aren't kept.
+        """
+        if variant not in self.variants:
+            return
+
+        second = int(time.time() if now is None else now)
+        variant_index = self.variants.index(variant)
+
+        with self._lock:
+            self._add(self._seconds, second, variant_index, count)
+            self._add(self._minutes, second // 60, variant_index, count)
+
+    def add_client_count(self, previous_count, count):
+        """
+        Move a client from ``previous_count`` requests made in current second
+        to ``count``. Counts over ``max_client_count`` share the last bucket.
+        """
+        with self._lock:
+            if previous_count:
+                self._client_counts[min(previous_count, self.max_client_count)] -= 1
+            self._client_counts[min(count, self.max_client_count)] += 1
+
+    def _get_rows(self, ring, oldest_timestamp):
+        rows = [
+            list(ring[row_start:row_start + self._row_size])
+            for row_start in range(0, len(ring), self._row_size)
+        ]
+        return sorted(row for row in rows if row[0] and row[0] >= oldest_timestamp)
+
+    def snapshot(self, now=None):
+        second = int(time.time() if now is None else now)
+
+        with self._lock:
+            return {
+                'variants': self.variants,
+                'seconds': self._get_rows(self._seconds, second - self.seconds_kept + 1),
+                'minutes': self._get_rows(self._minutes, second // 60 - self.minutes_kept + 1),
+                'client_counts': list(self._client_counts[1:]),
+            }
+
+
+TRAFFIC_HISTORY_TABLES = ('seconds', 'minutes', 'client_counts')
+
+
+def snapshot_to_csv(snapshot, table):
+    """
+    One of the snapshot tables as CSV - seconds and minutes are rows of
+    unix time (in seconds or minutes) and count of every variant,
+    client_counts are rows of requests made by a client in a second and
+    number of such client seconds.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    if table == 'client_counts':
+        max_client_count = len(snapshot['client_counts'])
+        writer.writerow(['requests', 'clients'])
+        writer.writerows(
+            [requests if requests < max_client_count else f'{requests}+', clients]
+            for requests, clients in enumerate(snapshot['client_counts'], start=1)
+        )
+    else:
+        writer.writerow(['time', *snapshot['variants']])
+        writer.writerows(snapshot[table])
+
+    return output.getvalue()
@@ -0,0 +1,586 @@
+"""
+Alternative server engine on asyncio + uvloop + httptools, running the same
+handlers and routes as japronto (``python server.py --engine uvloop``).
+
+It implements only the part of japronto API the teapot server uses. The
+master binds one SO_REUSEPORT socket per worker, so the kernel balances
+connections between them, and keeps them open for the workers replacing
+the current ones on reload (SIGHUP).
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import traceback
+import urllib.parse
+
+import httptools
+import uvloop
+
+import statuslines
+
+
+MAX_HEAD_SIZE = 64 * 1024
+
+# Seconds a stopping worker waits for open connections, and a reload waits for a new worker
+GRACEFUL_TIMEOUT = 30
+WORKER_START_TIMEOUT = 10
+# Seconds a stopping worker waits for the first request of a new connection
+STOP_REQUEST_TIMEOUT = 1
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+CONNECTION_COUNTERS = (
+    'opened',
+    'closed',
+    'reused',
+    'requests',
+    'pipelined',
+    'idle_timeouts',
+    'request_timeouts',
+    'max_requests_closes',
+    'rejected',
+)
+
+
+class Response:
+    def __init__(self, code=200, text=None, body=None, mime_type='text/plain', encoding='utf-8', headers=None):
+        self.code = code
+        self.mime_type = mime_type
+        self.encoding = encoding
+        self.headers = headers or {}
+        self.body = text.encode(encoding) if text is not None else (body or b'')
+
+    def render(self, keep_alive):
+        status_line = statuslines.STATUS_LINES.get(self.code) or statuslines.get_status_line(self.code)
+
+        # Same headers as japronto writes - `headers` are added after the default Content-Type
+        head = [
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+            f'Content-Length: {len(self.body)}\r\n'
+            f'Content-Type: {self.mime_type}; charset={self.encoding}\r\n'
+        ]
+        head.extend(f'{name}: {value}\r\n' for name, value in self.headers.items())
+        head.append('\r\n')
+
+        return b''.join((status_line, ''.join(head).encode('latin-1'), self.body))
+
+
+class Request:
+    Response = Response
+
+    def __init__(self, method, path, query, headers, body, remote_addr, match_dict):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.remote_addr = remote_addr
+        self.match_dict = match_dict
+
+
+class Router:
+    def __init__(self):
+        self.routes = []
+
+    def add_route(self, pattern, handler):
+        segments = pattern.strip('/').split('/') if pattern != '/' else []
+        self.routes.append((segments, handler))
+
+    def match(self, path):
+        path_segments = path.strip('/').split('/') if path != '/' else []
+
+        for segments, handler in self.routes:
+            if len(segments) != len(path_segments):
+                continue
+
+            match_dict = {}
+            for segment, path_segment in zip(segments, path_segments):
+                if segment.startswith('{') and segment.endswith('}'):
+                    if not path_segment:
+                        break
+                    match_dict[segment[1:-1]] = path_segment
+                elif segment != path_segment:
+                    break
+            else:
+                return handler, match_dict
+
+        return None, None
+
+
+class ConnectionStats:
+    """
+    Connection counters of every worker in shared memory. Every socket slot
+    has two rows and a worker replacing another one on reload writes the row
+    the old one doesn't, as both serve the slot until the old one exits. Each
+    row has a single writer, so no lock is needed, and rows of a slot are
+    added together, so the counts continue over reloads.
+    """
+    ROWS_PER_SLOT = 2
+
+    def __init__(self):
+        self.row = 0
+        self.worker_count = 0
+        self._counters = None
+
+    def allocate(self, worker_count):
+        self.worker_count = worker_count
+        self._counters = multiprocessing.RawArray('Q', worker_count * self.ROWS_PER_SLOT * len(CONNECTION_COUNTERS))
+
+    def add(self, counter, count=1):
+        if self._counters is not None:
+            self._counters[self.row * len(CONNECTION_COUNTERS) + CONNECTION_COUNTERS.index(counter)] += count
+
+    def snapshot(self):
+        workers = []
+
+        for slot in range(self.worker_count):
+            worker = dict.fromkeys(CONNECTION_COUNTERS, 0)
+
+            for row in range(slot * self.ROWS_PER_SLOT, (slot + 1) * self.ROWS_PER_SLOT):
+                row_start = row * len(CONNECTION_COUNTERS)
+                for counter, count in zip(CONNECTION_COUNTERS, self._counters[row_start:row_start + len(CONNECTION_COUNTERS)]):
+                    worker[counter] += count
+
+            worker['open'] = worker['opened'] - worker['closed']
+            workers.append(worker)
+
+        return {
+            'total': {
+                counter: sum(worker[counter] for worker in workers)
+                for counter in CONNECTION_COUNTERS + ('open',)
+            },
+            'workers': workers,
+        }
+
+
+class HttpProtocol(asyncio.Protocol):
+    """
+    HTTP/1.1 connection with keep-alive and pipelining.
+
+    Idle keep-alive connection is closed after ``keep_alive_timeout`` seconds
+    and any connection after ``max_requests_per_connection`` requests (if set).
+    A client has ``request_timeout`` seconds to send a whole request, counted
+    from connecting or from its first byte after the previous response, and
+    bodies over ``max_body_size`` bytes get 413.
+
+    httptools rejects HTCPCP methods (BREW, WHEN), so request line is split
+    off here and the parser gets the rest of the message with a placeholder
+    method. Bodies must have Content-Length, chunked requests get 411.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.transport = None
+        self.remote_addr = None
+        self.buffer = bytearray()
+        self.parser = httptools.HttpRequestParser(self)
+
+        self._headers = {}
+        self._body = []
+        self._keep_alive = True
+        self.requests_served = 0
+        self._timer = None
+        self._timer_counter = None
+
+    @property
+    def is_idle(self):
+        """
+        Connection without any part of a request - a new one or a keep-alive
+        one waiting for its next request.
+        """
+        return not self.buffer
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.remote_addr = transport.get_extra_info('peername')[0]
+        self.app.connection_stats.add('opened')
+
+        if self.app.max_connections and len(self.app.connections) >= self.app.max_connections:
+            self.app.connection_stats.add('rejected')
+            self.write_error(503)
+            return
+
+        self.app.connections.add(self)
+        self.start_request_timer(self.app.request_timeout)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.app.connections.discard(self)
+        self.app.connection_stats.add('closed')
+        self._cancel_timer()
+
+    def _start_timer(self, timeout, counter):
+        """
+        Close the connection after ``timeout`` seconds, counting it as ``counter``.
+        """
+        self._cancel_timer()
+
+        if self.app.loop is not None and timeout:
+            self._timer = self.app.loop.call_later(timeout, self._close_on_timeout)
+            self._timer_counter = counter
+
+    def start_request_timer(self, timeout):
+        self._start_timer(timeout, 'request_timeouts')
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._timer_counter = None
+
+    def _close_on_timeout(self):
+        counter = self._timer_counter
+        self._timer = None
+        self._timer_counter = None
+
+        if self.transport is not None:
+            self.app.connection_stats.add(counter)
+            self.close()
+
+    # httptools callbacks
+    def on_header(self, name, value):
+        self._headers[name.decode('latin-1').title()] = value.decode('latin-1')
+
+    def on_headers_complete(self):
+        self._keep_alive = self.parser.should_keep_alive()
+
+    def on_body(self, body):
+        self._body.append(body)
+
+    def data_received(self, data):
+        self.buffer += data
+        requests_handled = 0
+
+        # Request timer isn't restarted by every part of the request
+        if self._timer_counter != 'request_timeouts':
+            self.start_request_timer(self.app.request_timeout)
+
+        while self.transport is not None:
+            head_end = self.buffer.find(b'\r\n\r\n')
+            if head_end < 0:
+                if len(self.buffer) > MAX_HEAD_SIZE:
+                    self.write_error(431)
+                elif not self.buffer:
+                    self._start_timer(self.app.keep_alive_timeout, 'idle_timeouts')
+                return
+
+            head_end += 4
+            line_end = self.buffer.find(b'\r\n')
+            method, _, request_line_rest = bytes(self.buffer[:line_end]).partition(b' ')
+
+            self._headers = {}
+            self._body = []
+
+            try:
+                self.parser.feed_data(b'PUT ' + request_line_rest + self.buffer[line_end:head_end])
+            except httptools.HttpParserError:
+                self.write_error(400)
+                return
+
+            if 'Transfer-Encoding' in self._headers:
+                self.write_error(411)
+                return
+
+            content_length = int(self._headers.get('Content-Length') or 0)
+            if self.app.max_body_size and content_length > self.app.max_body_size:
+                self.write_error(413)
+                return
+
+            message_end = head_end + content_length
+            if len(self.buffer) < message_end:
+                # Whole message is parsed again once the rest of the body arrives
+                self.parser = httptools.HttpRequestParser(self)
+                return
+
+            if message_end > head_end:
+                self.parser.feed_data(bytes(self.buffer[head_end:message_end]))
+
+            del self.buffer[:message_end]
+
+            # Requests which came before the previous one was answered
+            if requests_handled:
+                self.app.connection_stats.add('pipelined')
+            requests_handled += 1
+
+            self.handle_request(method.decode('latin-1'), request_line_rest.partition(b' ')[0])
+
+    def handle_request(self, method, url):
+        parsed_url = httptools.parse_url(url)
+        path = parsed_url.path.decode('latin-1')
+        handler, match_dict = self.app.router.match(path)
+
+        if handler is None:
+            response = Response(code=404)
+        else:
+            request = Request(
+                method=method,
+                path=path,
+                query=dict(urllib.parse.parse_qsl((parsed_url.query or b'').decode('latin-1'))),
+                headers=self._headers,
+                body=b''.join(self._body) or None,
+                remote_addr=self.remote_addr,
+                match_dict=match_dict
+            )
+
+            try:
+                response = handler(request)
+            except:
+                print(traceback.format_exc())
+                response = Response(code=500)
+
+        self.requests_served += 1
+        self.app.connection_stats.add('requests')
+        if self.requests_served > 1:
+            self.app.connection_stats.add('reused')
+
+        # Stopping worker answers requests already sent, but asks the client to reconnect
+        keep_alive = self._keep_alive and not self.app.is_stopping
+
+        max_requests = self.app.max_requests_per_connection
+        if keep_alive and max_requests and self.requests_served >= max_requests:
+            self.app.connection_stats.add('max_requests_closes')
+            keep_alive = False
+
+        self.transport.write(response.render(keep_alive))
+
+        if not keep_alive:
+            self.close()
+
+    def write_error(self, code):
+        self.transport.write(Response(code=code).render(keep_alive=False))
+        self.close()
+
+    def close(self):
+        self._cancel_timer()
+        self.transport.close()
+        self.transport = None
+
+
+def create_socket(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Application:
+    """
+    Pre-forking server. On SIGTERM or SIGINT workers stop accepting, close
+    connections without a request (new ones after STOP_REQUEST_TIMEOUT) and
+    exit once the open ones are answered (at most GRACEFUL_TIMEOUT seconds).
+
+    On SIGHUP the master runs ``reload_hooks`` and then replaces workers one
+    at a time - a new worker starts on the socket of the old one, which is
+    stopped only after the new one accepts connections. If a hook fails, the
+    current workers are kept. A worker which exits on its own is replaced by
+    a new one on its socket.
+
+    Connection limits apply to every worker, 0 disables a limit.
+    """
+
+    def __init__(self, keep_alive_timeout=15, max_requests_per_connection=0, backlog=1024, max_connections=0,
+                 request_timeout=10, max_body_size=1024 * 1024):
+        self.router = Router()
+        self.reload_hooks = []
+
+        self.keep_alive_timeout = keep_alive_timeout
+        self.request_timeout = request_timeout
+        self.max_body_size = max_body_size
+        self.max_requests_per_connection = max_requests_per_connection
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.connection_stats = ConnectionStats()
+
+        # Worker
+        self.loop = None
+        self.connections = set()
+        self.is_stopping = False
+
+        # Master
+        self.sockets = []
+        self.workers = []
+        # Connection stats row of the worker of every slot
+        self.worker_rows = []
+        self.retiring_workers = []
+        self.is_master_stopping = False
+        self._reload_requested = False
+        self._context = multiprocessing.get_context('fork')
+
+    def serve(self, slot, row, debug, ready=None):
+        # Handlers of the master are inherited through fork. Stop signals are held
+        # from the fork until the loop runs, uvloop drops the ones caught before
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+
+        self.loop = loop = uvloop.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_debug(debug)
+
+        self.connection_stats.row = row
+        server = loop.run_until_complete(
+            loop.create_server(lambda: HttpProtocol(self), sock=self.sockets[slot], backlog=self.backlog)
+        )
+
+        for signal_num in STOP_SIGNALS:
+            loop.add_signal_handler(signal_num, self.stop, loop, server)
+        loop.call_soon(signal.pthread_sigmask, signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+        if ready is not None:
+            ready.set()
+
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def stop(self, loop, server):
+        if self.is_stopping:
+            loop.stop()
+            return
+
+        self.is_stopping = True
+        server.close()
+
+        for connection in list(self.connections):
+            if not connection.is_idle:
+                continue
+
+            if connection.requests_served:
+                connection.close()
+            else:
+                # Request of a just accepted connection may not have been read yet
+                connection.start_request_timer(STOP_REQUEST_TIMEOUT)
+
+        self._stop_when_drained(loop, loop.time() + GRACEFUL_TIMEOUT)
+
+    def _stop_when_drained(self, loop, deadline):
+        if not self.connections or loop.time() >= deadline:
+            loop.stop()
+        else:
+            loop.call_later(0.05, self._stop_when_drained, loop, deadline)
+
+    def start_worker(self, slot, row, debug):
+        ready = self._context.Event()
+        worker = self._context.Process(target=self.serve, args=(slot, row, debug, ready))
+
+        # Forked with stop signals held, Python drops the ones a child catches before it settles after fork
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            worker.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+        return worker, ready
+
+    def reload(self, debug):
+        try:
+            for hook in self.reload_hooks:
+                hook()
+        except:
+            print(traceback.format_exc())
+            print('Reload failed, keeping current workers')
+            return
+
+        for slot, old_worker in enumerate(self.workers):
+            if self.is_master_stopping:
+                return
+
+            # Other row of the slot, the old worker writes its own until it exits
+            new_row = self.worker_rows[slot] ^ 1
+            new_worker, ready = self.start_worker(slot, new_row, debug)
+            is_ready = ready.wait(WORKER_START_TIMEOUT)
+
+            if self.is_master_stopping or not is_ready:
+                if not is_ready:
+                    print(f'Worker {slot} did not start in {WORKER_START_TIMEOUT}s, keeping the old one')
+
+                new_worker.terminate()
+                new_worker.join()
+                continue
+
+            self.workers[slot] = new_worker
+            self.worker_rows[slot] = new_row
+            self.retiring_workers.append(old_worker)
+            old_worker.terminate()
+            old_worker.join()
+            self.retiring_workers.remove(old_worker)
+
+        print(f'Reloaded {len(self.workers)} workers')
+
+    def restart_dead_workers(self, debug):
+        """
+        Start a new worker on the socket of every worker which exited on its
+        own, so connections queued on the socket get answered.
+        """
+        for slot, worker in enumerate(self.workers):
+            if self.is_master_stopping:
+                return
+
+            if not worker.is_alive():
+                worker.join()
+                print(f'Worker {slot} exited with code {worker.exitcode}, starting a new one')
+                self.workers[slot] = self.start_worker(slot, self.worker_rows[slot], debug)[0]
+
+                # Signal might have come while the new worker was forked
+                if self.is_master_stopping:
+                    self.workers[slot].terminate()
+
+    def terminate_workers(self):
+        for worker in self.workers + self.retiring_workers:
+            worker.terminate()
+
+    def run(self, host='0.0.0.0', port=8080, worker_num=None, debug=False):
+        # Bound before forking, so a taken port fails right away
+        self.sockets = [create_socket(host, port, self.backlog) for _ in range(worker_num or 1)]
+        self.connection_stats.allocate(len(self.sockets))
+        master_pid = os.getpid()
+
+        def stop_workers(signal_num, frame):
+            if os.getpid() != master_pid:
+                # Worker forked before it replaced handlers of the master
+                signal.signal(signal_num, signal.SIG_DFL)
+                os.kill(os.getpid(), signal_num)
+                return
+
+            self.is_master_stopping = True
+            self.terminate_workers()
+
+        def request_reload(*args):
+            self._reload_requested = True
+
+        # Installed before forking, so a signal received meanwhile stops workers already started
+        signal.signal(signal.SIGTERM, stop_workers)
+        signal.signal(signal.SIGINT, stop_workers)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        for slot in range(len(self.sockets)):
+            if self.is_master_stopping:
+                break
+            self.worker_rows.append(slot * ConnectionStats.ROWS_PER_SLOT)
+            self.workers.append(self.start_worker(slot, self.worker_rows[slot], debug)[0])
+
+        # Signal might have come while the last worker was forked
+        if self.is_master_stopping:
+            self.terminate_workers()
+
+        print(f'Accepting connections on http://{host}:{port}')
+
+        while not self.is_master_stopping or any(worker.is_alive() for worker in self.workers):
+            if self._reload_requested and not self.is_master_stopping:
+                self._reload_requested = False
+                self.reload(debug)
+
+            self.restart_dead_workers(debug)
+            time.sleep(0.2)
+
+        for worker in self.workers:
+            worker.join()
+
+        for sock in self.sockets:
+            sock.close()